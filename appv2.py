@@ -1,103 +1,47 @@
 import os
-import sys
-import time
-import json
 import logging
 import traceback
-import pandas as pd
 import tkinter as tk
-import multiprocessing
-from openai import OpenAI
 from dotenv import load_dotenv
-from multiprocessing import Queue, Pool
+from logconfig import setup_json_logging
+from ratelimit import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+from engine import MAX_CONCURRENT_REQUESTS, CASCADE_MIN_CONFIDENCE
+from labels import parse_labels, extract_labels
+from session import ClientSession, session_options_from_env
+from streaming import read_header, STREAM_CHUNK_ROWS, OUTPUT_FORMATS
+from background import BackgroundTask, ThroughputMeter
+from telemetry import get_metrics_path
+from planner import plan_run, PLAN_SAMPLE_ROWS
+from processing import (
+    prepare_prompt_set, validate_template, build_engine, open_journal, run_prompt_set, run_streaming,
+    open_batch_job, run_prompt_set_batch, export_telemetry, load_data_file, get_output_path, get_results_path, validate_output_path, save_analysis_output,
+    list_input_files, run_files, get_files_metrics_path, rerun_errors, load_previous_analysis
+)
+from checkpoint import get_journal_path
 from tkinter.scrolledtext import ScrolledText
 from tkinter import ttk, filedialog, messagebox
 
 # Compare the names in the two lists and reply with "True" if they match or "False" if they do not. For each pair, provide the result in the format "name1 - name2: result".
 # For the given name, determine if it exists in the provided list of names. Respond with 'True' if it does, and 'False' if it does not. Provide the output in the format 'name: True/False'.
 
-
-def setup_json_logging():
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    console_handler = logging.StreamHandler(sys.stdout)
-    
-    console_handler.setLevel(logging.INFO)
-    
-    json_formatter = JSONFormatter()
-    console_handler.setFormatter(json_formatter)
-    logger.addHandler(console_handler)
-    openai_logger = logging.getLogger('openai')
-    openai_logger.setLevel(logging.DEBUG)
-    openai_logger.propagate = True
-
-MAX_INPUT_TOKENS = 2048
-
 load_dotenv(dotenv_path='./config/.env')
 api_key = os.getenv('OPENAI_API_KEY')
-client = OpenAI(api_key=api_key)
-
-
-class JSONFormatter(logging.Formatter):
-    def format(self, record):
-        log_record = {
-            'time': self.formatTime(record, self.datefmt),
-            'level': record.levelname,
-            'logger': record.name,
-            'message': record.getMessage(),
-        }
-        return json.dumps(log_record)
-
-
-class DataProcessor:
-    def __init__(self, df):
-        self.df = df
-
-    def select_data(self, selected_columns):
-        if selected_columns:
-            return self.df[selected_columns]
-        return self.df
-
-    def prepare_prompts(self, instructions, selected_data):
-        prompts = []
-        data_records = selected_data.to_dict(orient='records')
-        for idx, record in enumerate(data_records):
-            try:
-                prompt = instructions.format(**record)
-                logging.debug(f"Prompt for index {idx}:\n{prompt}\n")
-            except KeyError as e:
-                missing_key = str(e).strip("'")
-                messagebox.showerror("Error", f"Column '{missing_key}' not found in the selected data.")
-                return []
-            prompts.append(prompt)
-        return prompts
-
-
-class OpenAIAPIClient:
-    def __init__(self, model_name):
-        self.model_name = model_name
-
-    def get_response(self, prompt):
-        try:
-            response = client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            logging.error(f"OpenAI API error: {e}")
-            return f"Error: {e}"
+prometheus_textfile = os.getenv('PROMETHEUS_TEXTFILE')
 
 
 class ExcelAnalyzerApp(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Data Analyzer Made For Rumi")
-        self.geometry("600x500")
+        self.geometry("600x915")
+        self.engine = None
+        self.task = None
+        # Labels declared by a "#labels:" line in the instructions, used when "Allowed labels" is empty
+        self.template_labels = ()
+        # One connection pool for the whole app session, so later runs start on warm connections
+        self.session = ClientSession(api_key=api_key, **session_options_from_env())
         self.create_widgets()
-        self.queue = Queue()
-        self.pool = Pool(processes=multiprocessing.cpu_count())
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def on_template_selected(self, event):
         selected_template = self.template_var.get()
@@ -126,6 +70,23 @@ class ExcelAnalyzerApp(tk.Tk):
         self.model_selection = ttk.Combobox(self, textvariable=self.model_var, values=["gpt-4o", "gpt-4o-mini", "gpt-4-turbo"], state="readonly")
         self.model_selection.pack(pady=5)
 
+        # Model Cascade: uncertain or off-label replies are re-sent to a stronger model
+        cascade_frame = ttk.Frame(self)
+        cascade_frame.pack(pady=5)
+        ttk.Label(cascade_frame, text="Escalate uncertain rows to:").pack(side=tk.LEFT)
+        self.fallback_model_var = tk.StringVar()
+        self.fallback_model_var.set("none")
+        ttk.Combobox(cascade_frame, textvariable=self.fallback_model_var, values=["none", "gpt-4o", "gpt-4-turbo"], state="readonly", width=10).pack(side=tk.LEFT, padx=5)
+        ttk.Label(cascade_frame, text="Min confidence:").pack(side=tk.LEFT)
+        self.min_confidence_var = tk.DoubleVar()
+        self.min_confidence_var.set(CASCADE_MIN_CONFIDENCE)
+        ttk.Entry(cascade_frame, textvariable=self.min_confidence_var, width=6).pack(side=tk.LEFT, padx=5)
+        labels_frame = ttk.Frame(self)
+        labels_frame.pack(pady=5)
+        ttk.Label(labels_frame, text="Allowed labels (comma-separated, optional):").pack(side=tk.LEFT)
+        self.labels_var = tk.StringVar()
+        ttk.Entry(labels_frame, textvariable=self.labels_var, width=30).pack(side=tk.LEFT, padx=5)
+
         # Template Selection Combobox
         ttk.Label(self, text="Or select an analysis template:").pack(pady=5)
         self.template_var = tk.StringVar()
@@ -139,8 +100,77 @@ class ExcelAnalyzerApp(tk.Tk):
         self.template_selection.pack(pady=5)
         self.template_selection.bind("<<ComboboxSelected>>", self.on_template_selected)
 
+        # Concurrency Selection
+        ttk.Label(self, text="Concurrent requests:").pack(pady=5)
+        self.concurrency_var = tk.IntVar()
+        self.concurrency_var.set(MAX_CONCURRENT_REQUESTS)
+        ttk.Spinbox(self, from_=1, to=1000, textvariable=self.concurrency_var, width=8).pack(pady=5)
+
+        # Micro-batch Size Selection
+        ttk.Label(self, text="Rows per request (1 = no batching):").pack(pady=5)
+        self.batch_size_var = tk.IntVar()
+        self.batch_size_var.set(1)
+        ttk.Spinbox(self, from_=1, to=100, textvariable=self.batch_size_var, width=8).pack(pady=5)
+
+        # Rate Limit Budgets
+        limits_frame = ttk.Frame(self)
+        limits_frame.pack(pady=5)
+        ttk.Label(limits_frame, text="Requests/min:").pack(side=tk.LEFT)
+        self.rpm_var = tk.IntVar()
+        self.rpm_var.set(DEFAULT_REQUESTS_PER_MINUTE)
+        ttk.Entry(limits_frame, textvariable=self.rpm_var, width=10).pack(side=tk.LEFT, padx=5)
+        ttk.Label(limits_frame, text="Tokens/min:").pack(side=tk.LEFT)
+        self.tpm_var = tk.IntVar()
+        self.tpm_var.set(DEFAULT_TOKENS_PER_MINUTE)
+        ttk.Entry(limits_frame, textvariable=self.tpm_var, width=10).pack(side=tk.LEFT, padx=5)
+
+        # Streaming Mode Toggle
+        self.streaming_var = tk.BooleanVar()
+        self.streaming_var.set(False)
+        ttk.Checkbutton(self, text=f"Stream large files in chunks of {STREAM_CHUNK_ROWS} rows", variable=self.streaming_var).pack(pady=5)
+
+        # Batch API Toggle
+        self.batch_api_var = tk.BooleanVar()
+        self.batch_api_var.set(False)
+        ttk.Checkbutton(self, text="Use Batch API (half price, results within 24 h)", variable=self.batch_api_var).pack(pady=5)
+
+        # Dry-run Estimate Toggle
+        self.plan_var = tk.BooleanVar()
+        self.plan_var.set(False)
+        ttk.Checkbutton(self, text="Estimate cost and time before running", variable=self.plan_var).pack(pady=5)
+
+        # Incremental run: rows unchanged since a previous _analyzed output keep their Analysis
+        self.previous_var = tk.BooleanVar()
+        self.previous_var.set(False)
+        ttk.Checkbutton(self, text="Reuse unchanged rows from a previous output", variable=self.previous_var).pack(pady=5)
+
+        # Output Format Selection
+        output_frame = ttk.Frame(self)
+        output_frame.pack(pady=5)
+        ttk.Label(output_frame, text="Output format:").pack(side=tk.LEFT)
+        self.output_format_var = tk.StringVar()
+        self.output_format_var.set("same")
+        ttk.Combobox(output_frame, textvariable=self.output_format_var, values=list(OUTPUT_FORMATS), state="readonly", width=8).pack(side=tk.LEFT, padx=5)
+        self.results_only_var = tk.BooleanVar()
+        self.results_only_var.set(False)
+        ttk.Checkbutton(output_frame, text="Results only (row, Analysis)", variable=self.results_only_var).pack(side=tk.LEFT, padx=5)
+
+        # Response Cache Toggle
+        self.bypass_cache_var = tk.BooleanVar()
+        self.bypass_cache_var.set(False)
+        ttk.Checkbutton(self, text="Bypass response cache", variable=self.bypass_cache_var).pack(pady=5)
+
         # File Selection Button
-        ttk.Button(self, text="Select Data File", command=self.select_file).pack(pady=15)
+        buttons_frame = ttk.Frame(self)
+        buttons_frame.pack(pady=15)
+        self.select_button = ttk.Button(buttons_frame, text="Select Data File", command=self.select_file)
+        self.select_button.pack(side=tk.LEFT, padx=5)
+        self.select_folder_button = ttk.Button(buttons_frame, text="Select Folder", command=self.select_folder)
+        self.select_folder_button.pack(side=tk.LEFT, padx=5)
+        self.rerun_button = ttk.Button(buttons_frame, text="Re-run Errors", command=self.select_rerun_file)
+        self.rerun_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(buttons_frame, text="Cancel", command=self.cancel_analysis, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
 
         # Selected File Label
         self.file_label = ttk.Label(self, text="No file selected", foreground="gray")
@@ -155,43 +185,213 @@ class ExcelAnalyzerApp(tk.Tk):
         self.status_label.pack(pady=5)
 
     def select_file(self):
-        file_path = filedialog.askopenfilename(initialdir='/data', filetypes=[("Excel and CSV files", "*.xlsx *.xls *.csv")])
+        file_path = filedialog.askopenfilename(initialdir='/data', filetypes=[("Data files", "*.xlsx *.xls *.csv *.parquet *.feather *.jsonl")])
         if file_path:
-            instructions = self.instruction_entry.get("1.0", tk.END).strip()
-            if instructions:
+            instructions, self.template_labels = extract_labels(self.instruction_entry.get("1.0", tk.END).strip())
+            if self.streaming_var.get() and self.batch_api_var.get():
+                messagebox.showwarning("Warning", "Streaming and the Batch API cannot be used together.")
+            elif self.batch_api_var.get() and self.get_fallback_model():
+                messagebox.showwarning("Warning", "The Batch API cannot be combined with a model cascade.")
+            elif self.streaming_var.get() and self.previous_var.get():
+                messagebox.showwarning("Warning", "Reusing a previous output does not work with streaming.")
+            elif instructions and self.streaming_var.get():
+                self.analyze_file_streaming(file_path, instructions)
+            elif instructions:
                 self.analyze_file(file_path, instructions)
             else:
                 messagebox.showwarning("Warning", "Please provide instructions for analysis.")
 
+    def select_folder(self):
+        folder = filedialog.askdirectory(initialdir='/data')
+        if not folder:
+            return
+        instructions, self.template_labels = extract_labels(self.instruction_entry.get("1.0", tk.END).strip())
+        files = list_input_files(folder)
+        if self.streaming_var.get() or self.batch_api_var.get():
+            messagebox.showwarning(
+                "Warning", "Streaming and the Batch API work on a single file. Uncheck them to analyze a folder."
+            )
+        elif self.previous_var.get():
+            messagebox.showwarning("Warning", "Reusing a previous output works on a single file. Uncheck it to analyze a folder.")
+        elif not instructions:
+            messagebox.showwarning("Warning", "Please provide instructions for analysis.")
+        elif not files:
+            messagebox.showwarning("Warning", f"No data files were found in {folder}.")
+        else:
+            self.analyze_files(folder, files, instructions)
+
+    def select_rerun_file(self):
+        file_path = filedialog.askopenfilename(
+            initialdir='/data', title="Select an analyzed file",
+            filetypes=[("Analyzed files", "*_analyzed.*"), ("Data files", "*.xlsx *.csv *.parquet *.feather *.jsonl")]
+        )
+        if not file_path:
+            return
+        instructions, self.template_labels = extract_labels(self.instruction_entry.get("1.0", tk.END).strip())
+        if instructions:
+            self.rerun_file(file_path, instructions)
+        else:
+            messagebox.showwarning("Warning", "Please provide the instructions the file was analyzed with.")
+
+    def rerun_file(self, file_path, instructions):
+        # Only rows whose Analysis is empty or an error are sent again; the file is rewritten in place
+        try:
+            logging.info(f"Re-running failed rows of {file_path}")
+            self.file_label.config(text=file_path)
+            self.update_status("Reading file header...")
+            self.update()
+
+            header = self.read_file_header(file_path)
+            if not header:
+                return
+            if 'Analysis' not in header:
+                messagebox.showwarning("Warning", "The selected file has no Analysis column. Select an _analyzed file.")
+                self.update_status("")
+                return
+            columns_to_analyze = self.select_columns([column for column in header if column != 'Analysis'])
+            if not columns_to_analyze:
+                messagebox.showwarning("Warning", "No columns were selected for analysis.")
+                self.update_status("")
+                return
+            retryable_only = not messagebox.askyesno(
+                "Re-run Errors",
+                "Also re-send rows that failed permanently (rejected requests, authentication errors)?\n\n"
+                "Rows that failed temporarily or were never answered are always re-sent."
+            )
+            self.create_engine()
+
+            def work(post):
+                try:
+                    return rerun_errors(
+                        file_path,
+                        columns_to_analyze,
+                        instructions,
+                        self.engine,
+                        'template',
+                        retryable_only,
+                        progress_callback=lambda completed, total: post('progress', completed, total)
+                    )
+                finally:
+                    self.cache.close()
+                    export_telemetry(self.engine, get_metrics_path(file_path), prometheus_textfile)
+
+            self.start_analysis(work, lambda result: self.on_rerun_done(file_path, result))
+
+        except Exception as e:
+            logging.error(f"An unexpected error occurred: {e}")
+            messagebox.showerror("Error", f"An unexpected error occurred:\n{e}")
+            self.update_status("")
+            self.reset_progress()
+
+    def analyze_files(self, folder, files, instructions):
+        # Every file goes through one engine, so they share the concurrency budget, the cache and the connections
+        try:
+            logging.info(f"Analyzing {len(files)} files in {folder}")
+            self.file_label.config(text=f"{folder} ({len(files)} files)")
+            self.update_status("Reading file header...")
+            self.update()
+
+            # The columns are chosen once, from the first file; every file must have them
+            header = self.read_file_header(files[0])
+            if not header:
+                return
+            columns_to_analyze = self.select_columns(header)
+            if not columns_to_analyze:
+                messagebox.showwarning("Warning", "No columns were selected for analysis.")
+                self.update_status("")
+                return
+
+            resume = True
+            interrupted = [file_path for file_path in files if os.path.exists(get_journal_path(file_path))]
+            if interrupted:
+                resume = messagebox.askyesno(
+                    "Resume",
+                    f"Previous runs of {len(interrupted)} of these files stopped early.\n\n"
+                    "Resume them and analyze only the missing rows?"
+                )
+            output_format = self.output_format_var.get()
+            results_only = self.results_only_var.get()
+            self.create_engine()
+
+            def work(post):
+                try:
+                    return run_files(
+                        files,
+                        columns_to_analyze,
+                        instructions,
+                        self.engine,
+                        'template',
+                        output_format,
+                        results_only,
+                        resume,
+                        progress_callback=lambda completed, total: post('progress', completed, total),
+                        status_callback=lambda message: post('status', message)
+                    )
+                finally:
+                    self.cache.close()
+                    export_telemetry(self.engine, get_files_metrics_path(folder), prometheus_textfile)
+
+            self.start_analysis(work, self.on_files_done)
+
+        except Exception as e:
+            logging.error(f"An unexpected error occurred: {e}")
+            messagebox.showerror("Error", f"An unexpected error occurred:\n{e}")
+            self.update_status("")
+            self.reset_progress()
+
     def analyze_file(self, file_path, instructions):
         try:
             logging.info(f"Analyzing file: {file_path}")
-            self.update_status("Reading data file...")
+            self.update_status("Reading file header...")
             self.update()
 
-            df = self.read_data_file(file_path)
-            if df is None or df.empty:
+            # Only the header is read before the columns are chosen; the sheet is then loaded for those columns only
+            header = self.read_file_header(file_path)
+            if not header:
                 return
 
             # Selecting columns
-            columns_to_analyze = self.select_columns(df.columns)
+            columns_to_analyze = self.select_columns(header)
             if not columns_to_analyze:
                 messagebox.showwarning("Warning", "No columns were selected for analysis.")
                 self.update_status("")
                 return
 
-            # Initialize DataProcessor
-            processor = DataProcessor(df)
-            selected_data = processor.select_data(columns_to_analyze)
+            self.update_status("Reading data file...")
+            self.update()
+            df = self.read_data_file(file_path, columns_to_analyze)
+            if df is None or df.empty:
+                return
 
             # Prompt preparation using the user's instructions
-            instructions_template = self.instruction_entry.get("1.0", tk.END).strip()
-            prompts = processor.prepare_prompts(instructions_template, selected_data)
-            if not prompts:
+            instructions_template = instructions
+            try:
+                previous = self.load_previous(file_path, columns_to_analyze, 'template')
+                prompt_set = prepare_prompt_set(
+                    df, columns_to_analyze, instructions_template, 'template', self.batch_size_var.get(), previous
+                )
+                output_path = self.get_output_path(file_path)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
                 self.update_status("No prompts to process.")
                 return
-            # Calling the API
-            self.call_api_and_process_responses(prompts, df, file_path)
+
+            use_batch_api = self.batch_api_var.get()
+            self.create_engine()
+
+            def start_run():
+                if use_batch_api:
+                    journal = self.open_batch_job(file_path, instructions_template, columns_to_analyze)
+                else:
+                    journal = self.open_journal(file_path, instructions_template, columns_to_analyze)
+
+                # Calling the API
+                self.call_api_and_process_responses(prompt_set, df, file_path, output_path, journal, use_batch_api)
+
+            if self.plan_var.get():
+                self.estimate_then(prompt_set, start_run)
+            else:
+                start_run()
 
         except Exception as e:
             logging.error(f"An unexpected error occurred: {e}")
@@ -199,69 +399,288 @@ class ExcelAnalyzerApp(tk.Tk):
             self.update_status("")
             self.reset_progress()
 
-    def call_api_and_process_responses(self, prompts, df, file_path):
-        total = len(prompts)
-        self.reset_progress()
-        self.update_status("Analyzing...")
-        self.update()
-        self.pool = Pool()
+    def analyze_file_streaming(self, file_path, instructions):
+        try:
+            logging.info(f"Streaming file: {file_path}")
+            self.update_status("Reading file header...")
+            self.update()
 
-        manager = multiprocessing.Manager()
-        return_dict = manager.dict()
-        jobs = []
+            # Only the header is read up front, rows are processed one chunk at a time
+            header = self.read_file_header(file_path)
+            if not header:
+                return
+            columns_to_analyze = self.select_columns(header)
+            if not columns_to_analyze:
+                messagebox.showwarning("Warning", "No columns were selected for analysis.")
+                self.update_status("")
+                return
 
-        model_name = self.model_var.get()
+            # A placeholder with no matching column fails here, not on the first chunk
+            try:
+                validate_template(instructions, columns_to_analyze)
+                output_path = self.get_output_path(file_path)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                self.update_status("")
+                return
+            results_only = self.results_only_var.get()
+
+            self.create_engine()
+            journal = self.open_journal(file_path, instructions, columns_to_analyze, mode='streaming')
+
+            def work(post):
+                try:
+                    rows_written = run_streaming(
+                        file_path,
+                        columns_to_analyze,
+                        instructions,
+                        self.engine,
+                        journal,
+                        output_path,
+                        progress_callback=lambda completed, total: post('progress', completed, total),
+                        status_callback=lambda message: post('status', message),
+                        results_only=results_only
+                    )
+                finally:
+                    journal.close()
+                    self.cache.close()
+                    export_telemetry(self.engine, get_metrics_path(output_path), prometheus_textfile)
+                if rows_written and not self.engine.cancelled:
+                    journal.remove()
+                return output_path if rows_written else None
+
+            self.start_analysis(work)
 
-        for idx, prompt in enumerate(prompts):
-            prompt = prompt[:MAX_INPUT_TOKENS]
-            job = self.pool.apply_async(
-                self.call_openai_api,
-                args=(idx, prompt, return_dict, model_name)
-            )
-            jobs.append(job)
+        except Exception as e:
+            logging.error(f"An unexpected error occurred: {e}")
+            messagebox.showerror("Error", f"An unexpected error occurred:\n{e}")
+            self.update_status("")
+            self.reset_progress()
 
-        # Progress tracking
-        while any(not job.ready() for job in jobs):
-            completed = sum(1 for job in jobs if job.ready())
-            progress_percent = (completed / total) * 100
-            self.update_progress(progress_percent)
-            self.update()
-            time.sleep(0.1)
+    def load_previous(self, file_path, columns, mode):
+        # Answered rows of an earlier output picked by the user; None analyzes every row
+        if not self.previous_var.get():
+            return None
+        default_path = get_output_path(file_path, self.output_format_var.get())
+        previous_path = filedialog.askopenfilename(
+            initialdir=os.path.dirname(file_path), initialfile=os.path.basename(default_path),
+            title="Select the previous analyzed file",
+            filetypes=[("Analyzed files", "*_analyzed.*"), ("Data files", "*.xlsx *.csv *.parquet *.feather *.jsonl")]
+        )
+        if not previous_path:
+            return None
+        self.update_status("Reading the previous output...")
+        self.update()
+        return load_previous_analysis(previous_path, columns, mode)
+
+    def estimate_then(self, prompt_set, start_run):
+        # A few sampled requests measure reply length and latency, so the plan is made on the worker thread;
+        # start_run is called once the estimate is confirmed
+        self.update_status("Estimating cost and time...")
+        self.select_button.config(state=tk.DISABLED)
+        self.select_folder_button.config(state=tk.DISABLED)
+        self.rerun_button.config(state=tk.DISABLED)
+        self.task = BackgroundTask(
+            self, lambda post: plan_run(self.engine, prompt_set, PLAN_SAMPLE_ROWS), self.on_task_event,
+            lambda plan: self.on_plan_ready(plan, start_run), self.on_plan_error
+        ).start()
+
+    def on_plan_ready(self, plan, start_run):
+        self.finish_analysis()
+        logging.info(f"Run plan:\n{plan.text()}")
+        if not messagebox.askyesno("Estimate", f"{plan.text()}\n\nStart the analysis?"):
+            self.cache.close()
+            self.update_status("Analysis not started.")
+            return
+        try:
+            start_run()
+        except Exception as e:
+            self.cache.close()
+            self.on_analysis_error(e)
+
+    def on_plan_error(self, error):
+        self.cache.close()
+        self.on_analysis_error(error)
+
+    def create_engine(self):
+        self.engine = build_engine(
+            self.model_var.get(),
+            api_key=api_key,
+            concurrency=self.concurrency_var.get(),
+            batch_size=self.batch_size_var.get(),
+            requests_per_minute=self.rpm_var.get(),
+            tokens_per_minute=self.tpm_var.get(),
+            bypass_cache=self.bypass_cache_var.get(),
+            fallback_model=self.get_fallback_model(),
+            min_confidence=self.min_confidence_var.get(),
+            labels=parse_labels(self.labels_var.get()) or self.template_labels,
+            session=self.session
+        )
+        self.cache = self.engine.api_client.cache
+        return self.engine
+
+    def call_api_and_process_responses(self, prompt_set, df, file_path, output_path, journal, use_batch_api=False):
+        results_only = self.results_only_var.get()
+
+        # Runs on the worker thread; it must not touch any widget
+        def work(post):
+            # Collect responses, journaling each one so an interrupted run can resume
+            try:
+                if use_batch_api:
+                    # journal is a BatchJob here; cancelling stops the polling, the batches keep running
+                    responses = run_prompt_set_batch(
+                        self.engine,
+                        prompt_set,
+                        journal,
+                        progress_callback=lambda completed, total: post('progress', completed, total),
+                        status_callback=lambda message: post('status', message)
+                    )
+                else:
+                    responses = run_prompt_set(
+                        self.engine,
+                        prompt_set,
+                        journal,
+                        progress_callback=lambda completed, total: post('progress', completed, total)
+                    )
+            finally:
+                journal.close()
+                self.cache.close()
+                export_telemetry(self.engine, get_metrics_path(output_path), prometheus_textfile)
+            df['Analysis'] = responses
+
+            post('status', "Saving output file...")
+            try:
+                save_analysis_output(file_path, df, output_path, results_only)
+            except Exception as e:
+                raise RuntimeError(f"Failed to save the output file:\n{e}") from e
+            if not self.engine.cancelled:
+                journal.remove()
+            return output_path
 
-        self.pool.close()
-        self.pool.join()
+        self.start_analysis(work)
 
-        # Collect responses
-        responses = [return_dict.get(i, 'Error') for i in range(total)]
-        df['Analysis'] = responses
+    def start_analysis(self, work, on_done=None):
+        self.reset_progress()
+        self.update_status("Analyzing...")
+        self.select_button.config(state=tk.DISABLED)
+        self.select_folder_button.config(state=tk.DISABLED)
+        self.rerun_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.meter = ThroughputMeter()
+        self.task = BackgroundTask(
+            self, work, self.on_task_event, on_done or self.on_analysis_done, self.on_analysis_error
+        ).start()
+
+    def on_task_event(self, kind, *args):
+        if kind == 'progress':
+            completed, total = args
+            self.update_progress((completed / total) * 100)
+            self.update_status(self.meter.describe(completed, total, self.engine.api_client.total_tokens))
+        elif kind == 'status':
+            self.update_status(args[0])
+
+    def on_analysis_done(self, output_path):
+        self.finish_analysis()
+        if output_path is None:
+            messagebox.showwarning("Warning", "The selected file is empty.")
+            self.update_status("")
+            return
+        if self.engine.cancelled:
+            messagebox.showinfo("Cancelled", f"Partial results were saved to {output_path}\n\n{self.engine.report_text()}")
+            self.update_status("Analysis cancelled. Select the same file again to resume.")
+        else:
+            messagebox.showinfo("Success", f"File has been analyzed and saved to {output_path}\n\n{self.engine.report_text()}")
+            self.update_status(f"Analysis complete. {self.cache.stats_text()}")
+        logging.info(f"Analysis finished. {self.engine.report_text()}")
+
+    def on_files_done(self, results):
+        self.finish_analysis()
+        failed = [result for result in results if result['error']]
+        lines = []
+        for result in results:
+            outcome = result['error'] or f"{result['rows']} rows saved to {os.path.basename(result['output_path'])}"
+            lines.append(f"{os.path.basename(result['file'])}: {outcome}")
+        summary = "\n".join(lines) + f"\n\n{self.engine.report_text()}"
+        if self.engine.cancelled:
+            messagebox.showinfo("Cancelled", f"{summary}\n\nSelect the same folder again to resume.")
+            self.update_status("Analysis cancelled. Select the same folder again to resume.")
+        elif failed:
+            messagebox.showwarning("Warning", f"{len(failed)} of {len(results)} files could not be analyzed.\n\n{summary}")
+            self.update_status(f"Analysis finished with {len(failed)} failed files. {self.cache.stats_text()}")
+        else:
+            messagebox.showinfo("Success", f"{len(results)} files have been analyzed.\n\n{summary}")
+            self.update_status(f"Analysis complete. {self.cache.stats_text()}")
+        logging.info(f"Analysis of {len(results)} files finished. {self.engine.report_text()}")
+
+    def on_rerun_done(self, file_path, result):
+        self.finish_analysis()
+        retried, failing = result
+        if not retried:
+            messagebox.showinfo("Re-run Errors", f"{os.path.basename(file_path)} has no failed rows.")
+            self.update_status("")
+            return
+        summary = f"{retried} failed rows were re-sent, {failing} are still failing.\n\n{self.engine.report_text()}"
+        if self.engine.cancelled:
+            messagebox.showinfo("Cancelled", f"{summary}\n\nRe-run the errors again to send the rest.")
+            self.update_status("Re-run cancelled.")
+        else:
+            messagebox.showinfo("Success", f"{file_path} has been updated.\n\n{summary}")
+            self.update_status(f"Re-run complete, {failing} rows still failing.")
+        logging.info(f"Re-run of {retried} failed rows finished. {self.engine.report_text()}")
+
+    def on_analysis_error(self, error):
+        self.finish_analysis()
+        logging.error(f"An unexpected error occurred: {error}")
+        messagebox.showerror("Error", f"An unexpected error occurred:\n{error}")
+        self.update_status("")
+
+    def finish_analysis(self):
+        self.task = None
+        self.select_button.config(state=tk.NORMAL)
+        self.select_folder_button.config(state=tk.NORMAL)
+        self.rerun_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.reset_progress()
 
-        output_path = self.get_output_path(file_path)
-        self.save_output_file(df, output_path)
+    def cancel_analysis(self):
+        if self.task is not None and self.engine is not None:
+            self.engine.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.update_status("Cancelling... waiting for requests in flight.")
 
-        messagebox.showinfo("Success", f"File has been analyzed and saved to {output_path}")
-        self.update_status("Analysis complete.")
-        logging.info("Analysis complete.")
-        self.reset_progress()
+    def on_close(self):
+        if self.task is not None and self.engine is not None:
+            self.engine.cancel()
+        self.session.close()
+        self.destroy()
 
-    def read_data_file(self, file_path):
-            file_ext = os.path.splitext(file_path)[1].lower()
+    def read_file_header(self, file_path):
+        try:
+            columns = read_header(file_path)
+        except Exception as e:
+            logging.error(f"Failed to read the file header: {e}")
+            messagebox.showerror("Error", f"Failed to read the data file:\n{e}")
+            self.update_status("")
+            return None
+        if not columns:
+            messagebox.showwarning("Warning", "The selected file is empty.")
+            self.update_status("")
+            return None
+        return columns
+
+    def read_data_file(self, file_path, columns=None):
             try:
-                if file_ext == '.xlsx':
-                    df = pd.read_excel(file_path, engine='openpyxl')
-                elif file_ext == '.xls':
-                    df = pd.read_excel(file_path, engine='xlrd')
-                elif file_ext == '.csv':
-                    df = pd.read_csv(file_path)
-                else:
-                    messagebox.showerror("Error", "Unsupported file format. Please select an Excel or CSV file.")
-                    self.update_status("")
-                    return None
+                df = load_data_file(file_path, columns)
                 if df.empty:
                     messagebox.showwarning("Warning", "The selected file is empty.")
                     self.update_status("")
                     return None
                 return df
             
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                self.update_status("")
+                return None
             except Exception as e:
                 error_message = traceback.format_exc()
                 logging.error(f"Failed to read the data file:\n{error_message}")
@@ -316,12 +735,37 @@ class ExcelAnalyzerApp(tk.Tk):
 
         window.geometry(f"+{pos_x}+{pos_y}")
 
-    @staticmethod
-    def call_openai_api(idx, prompt, return_dict, model_name):
-        api_client = OpenAIAPIClient(model_name)
-        reply = api_client.get_response(prompt)
-        logging.debug(f"Response for index {idx}:\n{reply}\n")
-        return_dict[idx] = reply
+    def get_fallback_model(self):
+        fallback_model = self.fallback_model_var.get()
+        return None if fallback_model == "none" else fallback_model
+
+    def open_journal(self, file_path, instructions, columns, mode=''):
+        # The cascade's name includes both models, so a cascade run never resumes a single-model journal
+        return open_journal(
+            file_path,
+            self.engine.api_client.model_name,
+            instructions,
+            columns,
+            mode,
+            confirm_resume=lambda rows: messagebox.askyesno(
+                "Resume",
+                f"A previous run of this file stopped after {rows} rows.\n\nResume it and analyze only the missing rows?"
+            )
+        )
+
+    def open_batch_job(self, file_path, instructions, columns, mode=''):
+        return open_batch_job(
+            file_path,
+            self.engine,
+            instructions,
+            columns,
+            mode,
+            confirm_resume=lambda batches: messagebox.askyesno(
+                "Resume",
+                f"{batches} batch job(s) from a previous run of this file were already submitted.\n\n"
+                "Collect their results instead of submitting the rows again? No cancels them."
+            )
+        )
 
     def update_status(self, message):
         self.status_label.config(text=message)
@@ -333,23 +777,13 @@ class ExcelAnalyzerApp(tk.Tk):
         self.progress['value'] = 0
 
     def get_output_path(self, file_path):
-        directory, filename = os.path.split(file_path)
-        name, ext = os.path.splitext(filename)
-        new_filename = f"{name}_analyzed{ext}"
-        return os.path.join(directory, new_filename)
-
-    def save_output_file(self, df, output_path):
-        file_ext = os.path.splitext(output_path)[1].lower()
-        try:
-            if file_ext in ['.xlsx', '.xls']:
-                df.to_excel(output_path, index=False)
-            elif file_ext == '.csv':
-                df.to_csv(output_path, index=False)
-            else:
-                pass
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save the output file:\n{e}")
-            self.update_status("")
+        if self.results_only_var.get():
+            output_path = get_results_path(file_path, self.output_format_var.get())
+        else:
+            output_path = get_output_path(file_path, self.output_format_var.get())
+        # Raises ValueError for formats that cannot be written, before any request is sent
+        validate_output_path(output_path)
+        return output_path
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+import time
+import queue
+import logging
+import threading
+
+POLL_INTERVAL_MS = 100
+
+
+class BackgroundTask:
+    # Runs work(post) on a worker thread; post(kind, *args) queues events that Tk drains via after()
+    def __init__(self, widget, work, on_event, on_done, on_error, poll_ms=POLL_INTERVAL_MS):
+        self.widget = widget
+        self.work = work
+        self.on_event = on_event
+        self.on_done = on_done
+        self.on_error = on_error
+        self.poll_ms = poll_ms
+        self.events = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.widget.after(self.poll_ms, self._drain)
+        return self
+
+    def post(self, kind, *args):
+        self.events.put((kind, args))
+
+    def _run(self):
+        try:
+            self.post('done', self.work(self.post))
+        except Exception as e:
+            logging.exception("Background task failed")
+            self.post('error', e)
+
+    def _drain(self):
+        # Only the newest progress event matters, older ones are skipped
+        latest_progress = None
+        while True:
+            try:
+                kind, args = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                latest_progress = args
+            elif kind == 'done':
+                self._flush(latest_progress)
+                self.on_done(*args)
+                return
+            elif kind == 'error':
+                self._flush(latest_progress)
+                self.on_error(*args)
+                return
+            else:
+                self.on_event(kind, *args)
+        self._flush(latest_progress)
+        self.widget.after(self.poll_ms, self._drain)
+
+    def _flush(self, latest_progress):
+        if latest_progress is not None:
+            self.on_event('progress', *latest_progress)
+
+
+class ThroughputMeter:
+    def __init__(self):
+        self.started = time.monotonic()
+
+    def describe(self, completed, total, tokens):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rate = completed / elapsed
+        eta = (total - completed) / rate if rate > 0 else None
+        eta_text = f"{int(eta // 60)}m {int(eta % 60)}s" if eta is not None else "--"
+        return f"{completed}/{total} requests, {rate:.1f} req/s, {tokens / elapsed:.0f} tokens/s, ETA {eta_text}"
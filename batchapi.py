@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from labels import match_label, parse_label_reply
+from engine import error_text, error_kind, cache_get, cache_put, ERROR_RETRYABLE, ERROR_PERMANENT, RETRYABLE_STATUS_CODES
+
+# OpenAI Batch API limits: 50,000 requests and 200 MB per input file
+BATCH_MAX_REQUESTS = 50_000
+BATCH_MAX_BYTES = 190 * 1024 * 1024
+BATCH_POLL_SECONDS = 30
+BATCH_COMPLETION_WINDOW = '24h'
+# Batch API requests are billed at half the regular price
+BATCH_PRICE_RATIO = 0.5
+BATCH_ENDPOINT = '/v1/chat/completions'
+BATCH_STATE_SUFFIX = '.batch.json'
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def get_batch_state_path(file_path):
+    return f"{file_path}{BATCH_STATE_SUFFIX}"
+
+
+def make_custom_id(position):
+    return f"prompt-{position}"
+
+
+def parse_custom_id(custom_id):
+    return int(custom_id.rsplit('-', 1)[1])
+
+
+def build_request_line(api_client, position, prompt):
+    body = {
+        'model': api_client.model_name,
+        'messages': api_client.build_messages(prompt),
+        'temperature': api_client.temperature,
+    }
+    # The same label constraints as live requests, so both share cache entries
+    body.update(api_client.request_options())
+    line = {'custom_id': make_custom_id(position), 'method': 'POST', 'url': BATCH_ENDPOINT, 'body': body}
+    return json.dumps(line, ensure_ascii=False)
+
+
+def split_requests(lines, max_requests=BATCH_MAX_REQUESTS, max_bytes=BATCH_MAX_BYTES):
+    # Yields groups of JSONL lines that each fit in one batch input file
+    part = []
+    size = 0
+    for line in lines:
+        line_size = len(line.encode('utf-8')) + 1
+        if part and (len(part) >= max_requests or size + line_size > max_bytes):
+            yield part
+            part = []
+            size = 0
+        part.append(line)
+        size += line_size
+    if part:
+        yield part
+
+
+def parse_output_line(line):
+    # Returns (position, reply, usage); failed requests get a classified "Error (...)" reply like the live path
+    entry = json.loads(line)
+    position = parse_custom_id(entry['custom_id'])
+    response = entry.get('response') or {}
+    body = response.get('body') or {}
+    status = response.get('status_code')
+    if status == 200 and body.get('choices'):
+        return position, body['choices'][0]['message']['content'].strip(), body.get('usage')
+    error = entry.get('error') or body.get('error') or {}
+    retryable = status is None or status == 429 or status >= 500 or status in RETRYABLE_STATUS_CODES
+    kind = ERROR_RETRYABLE if retryable else ERROR_PERMANENT
+    return position, error_text(kind, error.get('message', 'batch request failed')), None
+
+
+class BatchJob:
+    # Submitted batch ids are kept in a state file next to the input, so polling survives a restart
+    def __init__(self, api_client, state_path, fingerprint, poll_seconds=BATCH_POLL_SECONDS, cancel_event=None):
+        self.api_client = api_client
+        self.state_path = state_path
+        self.fingerprint = fingerprint
+        self.poll_seconds = poll_seconds
+        self.cancel_event = cancel_event
+        self.batches = []
+        # Digest of the unique prompts the batch positions refer to (see match_prompts)
+        self.prompts_digest = None
+        self.client = None
+
+    def open(self):
+        if self.client is None:
+            from openai import OpenAI
+            self.client = OpenAI(api_key=self.api_client.api_key, base_url=self.api_client.base_url)
+        return self.client
+
+    def load(self):
+        # Returns the number of batches submitted by an earlier run with the same fingerprint
+        if not os.path.exists(self.state_path):
+            return 0
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as handle:
+                state = json.load(handle)
+        except ValueError:
+            logging.info(f"Ignoring unreadable batch state: {self.state_path}")
+            return 0
+        if state.get('fingerprint') != self.fingerprint:
+            logging.info(f"Ignoring batch state for a different run: {self.state_path}")
+            return 0
+        self.batches = state.get('batches', [])
+        self.prompts_digest = state.get('prompts')
+        return len(self.batches)
+
+    def discard(self):
+        # Batches left running would still be billed, so they are cancelled before they are forgotten
+        self.cancel()
+        self.batches = []
+        self.remove()
+
+    def cancel(self):
+        running = [batch['batch_id'] for batch in self.batches if batch['status'] not in TERMINAL_STATUSES]
+        if not running:
+            return
+        client = self.open()
+        for batch_id in running:
+            try:
+                client.batches.cancel(batch_id)
+                logging.info(f"Cancelled batch {batch_id}")
+            except Exception as e:
+                logging.warning(f"Failed to cancel batch {batch_id}, cancel it in the OpenAI dashboard: {e}")
+
+    def match_prompts(self, prompts, labels=()):
+        # Batch positions index the ordered unique prompts, which can change while the file and settings do not,
+        # e.g. an incremental run that reuses other rows. Batches submitted for another list are not merged.
+        encoded = [list(prompt) if isinstance(prompt, tuple) else prompt for prompt in prompts]
+        payload = json.dumps([list(labels), encoded], ensure_ascii=False)
+        digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        if self.batches and self.prompts_digest != digest:
+            logging.warning(
+                f"Not resuming {len(self.batches)} submitted batch job(s), they were made for other prompts: "
+                f"{', '.join(batch['batch_id'] for batch in self.batches)}"
+            )
+            self.discard()
+        self.prompts_digest = digest
+
+    def save(self):
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            state = {'fingerprint': self.fingerprint, 'prompts': self.prompts_digest, 'batches': self.batches}
+            json.dump(state, handle)
+        os.replace(temp_path, self.state_path)
+
+    def remove(self):
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def submit(self, prompts, positions):
+        # Positions already covered by a batch from an earlier, interrupted submission are skipped
+        submitted = {position for batch in self.batches for position in batch['positions']}
+        pending = [position for position in positions if position not in submitted]
+        if not pending:
+            return 0
+        client = self.open()
+        lines = [build_request_line(self.api_client, position, prompts[position]) for position in pending]
+        offset = 0
+        for part in split_requests(lines):
+            part_positions = pending[offset:offset + len(part)]
+            offset += len(part)
+            upload = client.files.create(
+                file=(f"batch_{len(self.batches)}.jsonl", ('\n'.join(part) + '\n').encode('utf-8')),
+                purpose='batch'
+            )
+            batch = client.batches.create(
+                input_file_id=upload.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=BATCH_COMPLETION_WINDOW
+            )
+            self.batches.append({
+                'batch_id': batch.id,
+                'input_file_id': upload.id,
+                'status': batch.status,
+                'positions': part_positions,
+                'output_file_id': None,
+                'error_file_id': None,
+                'completed': 0,
+                'failed': 0,
+            })
+            # Saved after every batch, so a crash mid-submission does not submit the same rows twice
+            self.save()
+            logging.info(f"Submitted batch {batch.id} with {len(part)} requests")
+        return len(pending)
+
+    @property
+    def finished(self):
+        return all(batch['status'] in TERMINAL_STATUSES for batch in self.batches)
+
+    def poll(self):
+        client = self.open()
+        for entry in self.batches:
+            if entry['status'] in TERMINAL_STATUSES:
+                continue
+            batch = client.batches.retrieve(entry['batch_id'])
+            entry['status'] = batch.status
+            entry['output_file_id'] = batch.output_file_id
+            entry['error_file_id'] = batch.error_file_id
+            counts = batch.request_counts
+            if counts is not None:
+                entry['completed'] = counts.completed
+                entry['failed'] = counts.failed
+        self.save()
+
+    def wait(self, progress_callback=None, status_callback=None):
+        # Returns False if cancelled; the batches keep running and a later run picks them up
+        total = sum(len(batch['positions']) for batch in self.batches)
+        while True:
+            self.poll()
+            if progress_callback:
+                progress_callback(sum(batch['completed'] + batch['failed'] for batch in self.batches), total)
+            if self.finished:
+                return True
+            if status_callback:
+                statuses = ', '.join(batch['status'] for batch in self.batches)
+                status_callback(f"Waiting for {len(self.batches)} batch job(s): {statuses}")
+            if self.cancel_event is not None:
+                if self.cancel_event.wait(self.poll_seconds):
+                    return False
+            else:
+                time.sleep(self.poll_seconds)
+
+    def collect(self):
+        # Returns {position: (reply, usage)} from the output and error files of every batch
+        client = self.open()
+        replies = {}
+        for entry in self.batches:
+            if entry['status'] != 'completed':
+                logging.warning(f"Batch {entry['batch_id']} ended as {entry['status']}")
+            for file_id in (entry['output_file_id'], entry['error_file_id']):
+                if not file_id:
+                    continue
+                for line in client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        position, reply, usage = parse_output_line(line)
+                        replies[position] = (reply, usage)
+        return replies
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+def run_batch(engine, job, prompts, progress_callback=None, status_callback=None, row_ids=None):
+    # Batch API counterpart of engine.run: dedups, answers from the cache, submits the rest and waits
+    api_client = engine.api_client
+    start = time.monotonic()
+    row_ids = [int(row) for row in row_ids] if row_ids is not None else list(range(len(prompts)))
+    row_groups = {}
+    for idx, prompt in enumerate(prompts):
+        row_groups.setdefault(prompt, []).append(idx)
+    unique_prompts = list(row_groups)
+
+    def rows_of(position):
+        return [row_ids[idx] for idx in row_groups[unique_prompts[position]]]
+
+    job.match_prompts(unique_prompts, api_client.labels)
+    engine.count('rows', len(prompts))
+    engine.count('requests', len(unique_prompts))
+
+    replies = {}
+    cache_keys = {}
+    if api_client.cache is not None:
+        for position, prompt in enumerate(unique_prompts):
+            key = api_client.cache_key(prompt, api_client.request_options())
+            cache_keys[position] = key
+            cached = None if api_client.bypass_cache else cache_get(api_client.cache, key)
+            if cached is not None:
+                replies[position] = cached
+                api_client.record_request(rows_of(position), start, cache_hit=True)
+
+    pending = [position for position in range(len(unique_prompts)) if position not in replies]
+    if api_client.telemetry is not None:
+        api_client.telemetry.price_ratio = BATCH_PRICE_RATIO
+    finished = True
+    try:
+        if pending:
+            engine.count('batch_api_requests', job.submit(unique_prompts, pending))
+            engine.count('batch_jobs', len(job.batches))
+            finished = job.wait(progress_callback, status_callback)
+            if finished:
+                for position, (reply, usage) in job.collect().items():
+                    if api_client.labels and not reply.startswith('Error'):
+                        # Off-label replies cannot be re-asked inside a batch; they are kept as written and not cached
+                        reply = parse_label_reply(reply)
+                        label = match_label(reply, api_client.labels)
+                        if label is None:
+                            api_client.off_label += 1
+                            cache_keys.pop(position, None)
+                        else:
+                            reply = label
+                    replies[position] = reply
+                    usage = usage or {}
+                    prompt_tokens = usage.get('prompt_tokens') or 0
+                    completion_tokens = usage.get('completion_tokens') or 0
+                    cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+                    api_client.prompt_tokens += prompt_tokens
+                    api_client.completion_tokens += completion_tokens
+                    api_client.cached_tokens += cached_tokens
+                    # One telemetry record per reply, like live requests; its latency is the batch turnaround
+                    api_client.record_request(
+                        rows_of(position), start, prompt_tokens, completion_tokens, error=error_kind(reply),
+                        cached_tokens=cached_tokens
+                    )
+                    if position in cache_keys and not reply.startswith('Error'):
+                        cache_put(api_client.cache, cache_keys[position], reply)
+    finally:
+        job.close()
+
+    results = [None] * len(prompts)
+    for position, prompt in enumerate(unique_prompts):
+        reply = replies.get(position)
+        if reply is None and finished:
+            reply = error_text(ERROR_RETRYABLE, "no result in the batch output")
+        for idx in row_groups[prompt]:
+            results[idx] = reply
+    return results
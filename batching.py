@@ -0,0 +1,45 @@
+import re
+import json
+from prompts import split_prompts
+
+BATCH_FORMAT_INSTRUCTIONS = (
+    "Apply the instructions above to each numbered item below independently. "
+    "Respond with only a JSON object that maps every item number to its answer, "
+    "for example {\"1\": \"answer\", \"2\": \"answer\"}."
+)
+
+
+def chunk(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def build_batch_prompt(instructions, items):
+    # Instructions and format rules are the same for every batch, so when long enough they form the cacheable prefix
+    numbered = '\n\n'.join(f"{number}. {item}" for number, item in enumerate(items, start=1))
+    return split_prompts(f"{instructions}\n\n{BATCH_FORMAT_INSTRUCTIONS}", [numbered])[0]
+
+
+def parse_batch_reply(reply, count):
+    # Returns {position: answer} for every well-formed answer; anything missing is retried on its own
+    match = re.search(r"\{.*\}", reply or '', re.DOTALL)
+    if not match:
+        return {}
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    answers = {}
+    for key, value in data.items():
+        try:
+            position = int(str(key).strip().rstrip('.')) - 1
+        except ValueError:
+            continue
+        if not 0 <= position < count or isinstance(value, (dict, list)) or value is None:
+            continue
+        answer = str(value).strip()
+        if answer:
+            answers[position] = answer
+    return answers
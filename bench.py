@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import statistics
+
+# Throughput benchmark: drives the real processing pipeline against mock_server.py, no network or API key needed
+BENCH_MODES = ('row_analysis', 'column_analysis')
+BENCH_INSTRUCTIONS = {
+    'row_analysis': "Classify the ticket as 'incident' or 'service request'. Reply with the label only.",
+    'column_analysis': "Reply '<name>: True' if the name appears in the list of names, otherwise '<name>: False'.\n"
+                       "#match-reply: {name}: True\n#no-match-reply: {name}: False",
+}
+FIRST_NAMES = ['Anna', 'Boris', 'Carla', 'Dimitar', 'Elena', 'Felix', 'Georgi', 'Hana', 'Ivan', 'Julia', 'Kiril', 'Lena']
+LAST_NAMES = ['Petrova', 'Ivanov', 'Schmidt', 'Nowak', 'Rossi', 'Dimitrov', 'Keller', 'Georgieva', 'Novak', 'Marin']
+TICKET_WORDS = ['printer', 'VPN', 'password', 'laptop', 'access', 'outage', 'email', 'license', 'slow', 'error',
+                'request', 'install', 'database', 'timeout', 'badge', 'monitor', 'crash', 'upgrade', 'account']
+
+
+def make_sentence(rng, words):
+    return ' '.join(rng.choice(TICKET_WORDS) for _ in range(words)).capitalize()
+
+
+def make_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.randint(1, 999)}"
+
+
+def vary_name(rng, name):
+    # Mostly exact or reordered copies, some typos so a share of rows still needs the API
+    roll = rng.random()
+    if roll < 0.6:
+        return name
+    if roll < 0.8:
+        return ' '.join(reversed(name.split()))
+    position = rng.randrange(len(name))
+    return name[:position] + rng.choice('aeiou') + name[position + 1:]
+
+
+def generate_sheet(path, rows, seed=0):
+    import pandas as pd
+    rng = random.Random(seed)
+    # Tickets repeat like real exports do, so dedup has something to find
+    summaries = [make_sentence(rng, 4) for _ in range(max(1, rows // 4))]
+    names = [make_name(rng) for _ in range(rows)]
+    df = pd.DataFrame({
+        'Summary': [rng.choice(summaries) for _ in range(rows)],
+        'Description': [make_sentence(rng, 20) for _ in range(rows)],
+        'Name': [vary_name(rng, name) for name in names],
+        'Directory': rng.sample(names, len(names)),
+    })
+    df.to_csv(path, index=False)
+    return path
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def record_latencies(api_client, latencies):
+    send = api_client.send
+
+    async def timed_send(messages, request_options):
+        started = time.perf_counter()
+        try:
+            return await send(messages, request_options)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    api_client.send = timed_send
+
+
+def run_benchmark(file_path, mode, base_url, concurrency, batch_size, session=None):
+    import processing
+
+    columns = ['Summary', 'Description'] if mode == 'row_analysis' else ['Name', 'Directory']
+    instructions = BENCH_INSTRUCTIONS[mode]
+    stages = {}
+    latencies = []
+
+    started = time.perf_counter()
+    df = processing.load_data_file(file_path, columns)
+    stages['load'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    prompt_set = processing.prepare_prompt_set(df, columns, instructions, mode, batch_size)
+    stages['prepare_prompts'] = time.perf_counter() - started
+
+    engine = processing.build_engine(
+        'mock-model', api_key='mock', concurrency=concurrency, batch_size=batch_size,
+        requests_per_minute=10_000_000, tokens_per_minute=10_000_000_000, use_cache=False, base_url=base_url,
+        session=session
+    )
+    record_latencies(engine.api_client, latencies)
+    journal = processing.open_journal(file_path, 'mock-model', instructions, columns, mode, confirm_resume=lambda rows: False)
+    started = time.perf_counter()
+    try:
+        df['Analysis'] = processing.run_prompt_set(engine, prompt_set, journal)
+    finally:
+        journal.remove()
+    stages['dispatch'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    processing.save_analysis_output(file_path, df, processing.get_output_path(file_path))
+    stages['save_output'] = time.perf_counter() - started
+
+    total = sum(stages.values())
+    errors = int(df['Analysis'].astype(str).str.startswith('Error').sum())
+    return {
+        'mode': mode,
+        'rows': len(df),
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'batch_size': batch_size,
+        'rows_per_second': round(len(df) / total, 1) if total else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99': round(percentile(latencies, 0.99) * 1000, 1),
+            'mean': round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        },
+        'stage_seconds': {name: round(seconds, 3) for name, seconds in stages.items()},
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'report': engine.report_text(),
+    }
+
+
+def print_result(result):
+    latency = result['latency_ms']
+    stages = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in result['stage_seconds'].items())
+    print(f"{result['mode']}: {result['rows']} rows, {result['requests']} requests, {result['errors']} errors")
+    print(f"  {result['rows_per_second']} rows/s, latency p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms")
+    print(f"  {stages}")
+    print(f"  peak RSS {result['peak_rss_mb']} MB")
+    if 'server' in result:
+        print(f"  server: {result['server']['requests']} requests, {result['server']['throttled']} throttled")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline against the offline mock server.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000], help="Sheet sizes to generate, e.g. 1000 100000")
+    parser.add_argument('--modes', nargs='+', choices=BENCH_MODES, default=list(BENCH_MODES))
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="Median mock latency")
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of mock requests answered with 429")
+    parser.add_argument('--base-url', default=None, help="Use an already running server instead of starting one")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from mock_server import spawn_mock_server, fetch_stats
+    from session import ClientSession
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = spawn_mock_server(
+            latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, error_rate=args.error_rate, seed=args.seed
+        )
+
+    # Like the GUI, all runs share one connection pool; the report shows how many connections each run opened
+    session = ClientSession(api_key='mock', base_url=base_url)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix='bench_') as work_dir:
+            for rows in args.rows:
+                file_path = generate_sheet(os.path.join(work_dir, f"sheet_{rows}.csv"), rows, args.seed)
+                for mode in args.modes:
+                    before = fetch_stats(base_url)
+                    result = run_benchmark(file_path, mode, base_url, args.concurrency, args.batch_size, session)
+                    after = fetch_stats(base_url)
+                    result['server'] = {name: after[name] - before[name] for name in after}
+                    results.append(result)
+                    print_result(result)
+    finally:
+        session.close()
+        if server is not None:
+            server.terminate()
+            server.join()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as handle:
+            json.dump(results, handle, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
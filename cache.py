@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+CACHE_PATH = './cache/responses.sqlite'
+CACHE_MAX_ENTRIES = 1_000_000
+CACHE_MAX_AGE_DAYS = 90
+# How long a write waits for another process holding the cache's write lock
+CACHE_BUSY_TIMEOUT_SECONDS = 30.0
+
+
+def make_cache_key(model_name, messages, temperature, options=None):
+    request = {'model': model_name, 'messages': messages, 'temperature': temperature}
+    if options:
+        request['options'] = options
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, max_age_days=CACHE_MAX_AGE_DAYS, commit_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        # Keys read since the last flush, whose accessed_at is updated in one short write
+        self._touched = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=CACHE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self.conn.execute(f"PRAGMA busy_timeout={int(CACHE_BUSY_TIMEOUT_SECONDS * 1000)}")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self.evict()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched[key] = time.time()
+        if len(self._touched) >= self.commit_every:
+            self.flush()
+        return row[0]
+
+    def contains(self, key):
+        # Unlike get(), leaves the hit counters and the LRU order alone
+        return self.conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, response):
+        # Each reply is its own short transaction, so the write lock is never held between requests and other
+        # processes sharing the file (shard workers, a second run) only wait for a single insert
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+
+    def flush(self):
+        touched = list(self._touched.items())
+        self._touched = {}
+        if touched:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", [(at, key) for key, at in touched]
+                )
+
+    def evict(self):
+        with self.conn:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self.conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+            if self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def stats_text(self):
+        return f"Cache: {self.hits} hits, {self.misses} misses"
+
+    def close(self):
+        try:
+            self.flush()
+            self.conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to close response cache: {e}")
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+
+JOURNAL_SUFFIX = '.journal.jsonl'
+JOURNAL_FLUSH_ROWS = 50
+JOURNAL_FLUSH_SECONDS = 2.0
+
+
+def get_journal_path(file_path):
+    return f"{file_path}{JOURNAL_SUFFIX}"
+
+
+def run_fingerprint(file_path, model_name, instructions, columns, mode=''):
+    # A journal is only reused for the same input file and the same analysis settings
+    stat = os.stat(file_path)
+    payload = json.dumps(
+        [os.path.abspath(file_path), stat.st_size, int(stat.st_mtime), model_name, instructions, list(columns), mode],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RunJournal:
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.completed = {}
+        self.handle = None
+        # Replies are written and fsynced by a writer thread, so a slow disk never stalls the event loop
+        self.lines = None
+        self.writer = None
+
+    def load(self):
+        # Returns the number of journaled rows from an earlier run with the same fingerprint
+        if not os.path.exists(self.path):
+            return 0
+        completed = {}
+        with open(self.path, 'r', encoding='utf-8') as handle:
+            for line_number, line in enumerate(handle):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line may be torn if the process died mid-write
+                    continue
+                if line_number == 0:
+                    if entry.get('fingerprint') != self.fingerprint:
+                        logging.info(f"Ignoring journal for a different run: {self.path}")
+                        return 0
+                    continue
+                completed[entry['row']] = entry['response']
+        self.completed = completed
+        return len(completed)
+
+    def open(self, resume):
+        if not resume:
+            self.completed = {}
+        exists = resume and os.path.exists(self.path)
+        self.handle = open(self.path, 'a' if exists else 'w', encoding='utf-8')
+        if not exists:
+            self.handle.write(json.dumps({'fingerprint': self.fingerprint}) + '\n')
+            self.flush()
+        self.lines = queue.Queue()
+        self.writer = threading.Thread(target=self.write_lines, name='journal-writer', daemon=True)
+        self.writer.start()
+
+    def record(self, row, response):
+        # Errors are left out so a resumed run retries them
+        if response is None or str(response).startswith('Error'):
+            return
+        self.completed[row] = response
+        self.lines.put(json.dumps({'row': row, 'response': response}, ensure_ascii=False) + '\n')
+
+    def write_lines(self):
+        # Runs on the writer thread until close() queues None; syncs every JOURNAL_FLUSH_ROWS rows or
+        # JOURNAL_FLUSH_SECONDS, whichever comes first, and close() syncs the rest
+        unflushed = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                line = self.lines.get(timeout=JOURNAL_FLUSH_SECONDS)
+            except queue.Empty:
+                line = ''
+            if line is None:
+                break
+            try:
+                if line:
+                    self.handle.write(line)
+                    unflushed += 1
+                due = unflushed >= JOURNAL_FLUSH_ROWS or time.monotonic() - last_flush >= JOURNAL_FLUSH_SECONDS
+                if unflushed and due:
+                    self.flush()
+                    unflushed = 0
+                    last_flush = time.monotonic()
+            except OSError as e:
+                logging.error(f"Failed to write checkpoint journal {self.path}: {e}")
+            finally:
+                if line:
+                    self.lines.task_done()
+
+    def flush(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        if self.handle is not None:
+            if self.writer is not None:
+                self.lines.put(None)
+                self.writer.join()
+                self.writer = None
+            self.flush()
+            self.handle.close()
+            self.handle = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def run_resumable(engine, journal, prompts, row_ids=None, progress_callback=None, batch_items=None, batch_instructions=None):
+    # Dispatches only rows missing from the journal and journals each reply as it arrives
+    row_ids = [int(row) for row in row_ids] if row_ids is not None else list(range(len(prompts)))
+    pending = [position for position, row in enumerate(row_ids) if row not in journal.completed]
+    results = [journal.completed.get(row) for row in row_ids]
+    if pending:
+        replies = engine.run(
+            [prompts[position] for position in pending],
+            progress_callback=progress_callback,
+            batch_items=[batch_items[position] for position in pending] if batch_items is not None else None,
+            batch_instructions=batch_instructions,
+            result_callback=lambda idx, reply: journal.record(row_ids[pending[idx]], reply),
+            row_ids=[row_ids[position] for position in pending]
+        )
+        for position, reply in zip(pending, replies):
+            results[position] = reply
+    engine.count('resumed_rows', len(results) - len(pending))
+    return results
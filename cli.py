@@ -0,0 +1,439 @@
+import os
+import sys
+import time
+import argparse
+
+# Heavy modules (pandas, openai) are imported inside main() so --help and argument errors stay instant
+START_TIME = time.perf_counter()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a CSV or Excel file with an OpenAI model without the GUI.")
+    parser.add_argument('file', help="Input .csv, .xlsx, .xls, .parquet, .feather or .jsonl file, "
+                                     "or a directory or quoted glob pattern to analyze many files in one run")
+    parser.add_argument('--template', required=True, help="Analysis instructions, or @path to read them from a file")
+    parser.add_argument('--columns', required=True, help="Comma-separated list of columns to analyze")
+    parser.add_argument('--mode', choices=('template', 'row_analysis', 'column_analysis'), default='template',
+                        help="template fills {Column} placeholders (appv2), row_analysis and column_analysis match app.py")
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--escalate-to', default=None, metavar='MODEL',
+                        help="Cascade: re-send rows --model is unsure about to this model, e.g. gpt-4o")
+    parser.add_argument('--min-confidence', type=float, default=None,
+                        help="Cascade: escalate replies whose token probability is below this (default: 0.9)")
+    parser.add_argument('--labels', default=None,
+                        help="Comma-separated allowed answers (or a '#labels: a, b' line in the template); replies "
+                             "are constrained to them and off-label ones re-asked, in a cascade escalated")
+    parser.add_argument('--concurrency', type=int, default=None, help="Requests in flight at once (default: 200)")
+    parser.add_argument('--batch-size', type=int, default=1, help="Rows per request, 1 disables micro-batching")
+    parser.add_argument('--rpm', type=int, default=None, help="Requests-per-minute budget")
+    parser.add_argument('--tpm', type=int, default=None, help="Tokens-per-minute budget")
+    parser.add_argument('--base-url', default=None, help="OpenAI-compatible endpoint, e.g. a local mock_server.py")
+    parser.add_argument('--max-connections', type=int, default=None, help="HTTP connection pool size (default: 1000)")
+    parser.add_argument('--keepalive-connections', type=int, default=None,
+                        help="Idle connections kept open for reuse (default: 200)")
+    parser.add_argument('--keepalive-seconds', type=float, default=None, help="Idle connection lifetime (default: 60)")
+    parser.add_argument('--connect-timeout', type=float, default=None, help="Connect timeout in seconds (default: 10)")
+    parser.add_argument('--read-timeout', type=float, default=None, help="Read timeout in seconds (default: 120)")
+    parser.add_argument('--http1', action='store_true', help="Do not use HTTP/2 even if the h2 package is installed")
+    parser.add_argument('--output', default=None, help="Output path (default: <input>_analyzed.<ext>)")
+    parser.add_argument('--output-format', choices=('same', 'csv', 'xlsx', 'parquet', 'feather', 'jsonl'), default='same',
+                        help="Format of the default output path; parquet and feather need pyarrow")
+    parser.add_argument('--results-only', action='store_true',
+                        help="Write only (row, Analysis) to <input>_results.<ext> instead of the full sheet")
+    parser.add_argument('--stream', action='store_true', help="Read, analyze and write the file in chunks")
+    parser.add_argument('--batch-api', action='store_true',
+                        help="Submit through the OpenAI Batch API (half price, results within 24 h) and wait for them")
+    parser.add_argument('--poll-seconds', type=float, default=None, help="Batch API polling interval (default: 30)")
+    parser.add_argument('--shard', action='store_true',
+                        help="Coordinate: queue the prompts in <input>.queue.sqlite for workqueue.py workers, "
+                             "wait for them and merge the results")
+    parser.add_argument('--shard-rows', type=int, default=None, help="Prompts per shard (default: 1000)")
+    parser.add_argument('--local-workers', type=int, default=0,
+                        help="With --shard, also start this many worker processes here; they split --rpm/--tpm")
+    parser.add_argument('--lease-seconds', type=float, default=None,
+                        help="With --shard, a shard whose worker stops renewing it for this long is reassigned (default: 300)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Print the estimated tokens, cost and wall time of each execution mode and exit")
+    parser.add_argument('--plan-sample', type=int, default=0,
+                        help="Prompts sent to measure reply length and latency for --dry-run, e.g. 20; the replies are "
+                             "cached for the run, so it needs the response cache (default: 0, nothing is sent)")
+    parser.add_argument('--previous', default=None, metavar='ANALYZED_FILE',
+                        help="An earlier _analyzed output of this file: rows whose selected columns are unchanged "
+                             "keep their Analysis, only new or changed rows are sent")
+    parser.add_argument('--rerun-errors', action='store_true',
+                        help="The file is an earlier _analyzed output: re-send only its failed or empty rows and "
+                             "rewrite it in place")
+    parser.add_argument('--retryable-only', action='store_true',
+                        help="With --rerun-errors, leave rows that failed permanently (bad request, auth) alone")
+    parser.add_argument('--no-cache', action='store_true', help="Do not use the response cache at all")
+    parser.add_argument('--bypass-cache', action='store_true', help="Ignore cached replies but refresh the cache")
+    parser.add_argument('--no-resume', action='store_true', help="Start over even if a matching journal exists")
+    parser.add_argument('--metrics-json', default=None, help="Run summary path (default: <output>.metrics.json)")
+    parser.add_argument('--prometheus-textfile', default=None,
+                        help="Write run metrics for the node_exporter textfile collector (default: $PROMETHEUS_TEXTFILE)")
+    parser.add_argument('--request-log', default=None, help="Append one JSON record per API request to this file")
+    parser.add_argument('--quiet', action='store_true', help="Do not print progress")
+    return parser.parse_args(argv)
+
+
+def read_template(value):
+    if value.startswith('@'):
+        with open(value[1:], 'r', encoding='utf-8') as handle:
+            return handle.read().strip()
+    return value
+
+
+def load_previous(args, columns):
+    import processing
+
+    if not args.previous:
+        return None
+    previous = processing.load_previous_analysis(args.previous, columns, args.mode)
+    if not args.quiet:
+        print(f"Loaded {len(previous)} answered rows from {args.previous}", file=sys.stderr)
+    return previous
+
+
+def make_progress_printer(quiet):
+    last_update = 0
+
+    def on_progress(completed, total):
+        nonlocal last_update
+        now = time.monotonic()
+        if not quiet and (completed == total or now - last_update >= 1.0):
+            last_update = now
+            print(f"\r{completed}/{total} requests", end='\n' if completed == total else '', file=sys.stderr, flush=True)
+
+    return on_progress
+
+
+def run_multi_file(args, files, columns, instructions, engine, session):
+    # All files share the engine, so one concurrency and rate budget, cache and connection pool cover the run
+    import processing
+
+    engine.report['startup_seconds'] = time.perf_counter() - START_TIME
+    try:
+        results = processing.run_files(
+            files, columns, instructions, engine, args.mode, args.output_format, args.results_only,
+            resume=not args.no_resume,
+            progress_callback=make_progress_printer(args.quiet),
+            status_callback=None if args.quiet else lambda text: print(text, file=sys.stderr, flush=True)
+        )
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        session.close()
+        if engine.api_client.cache is not None:
+            engine.api_client.cache.close()
+        processing.export_telemetry(
+            engine,
+            args.metrics_json or processing.get_files_metrics_path(os.path.dirname(files[0])),
+            args.prometheus_textfile or os.getenv('PROMETHEUS_TEXTFILE')
+        )
+
+    for result in results:
+        if result['error']:
+            print(f"Failed {result['file']}: {result['error']}")
+        else:
+            print(f"Saved {result['output_path']} ({result['rows']} rows)")
+    print(engine.report_text())
+    return 1 if any(result['error'] for result in results) else 0
+
+
+def run_coordinator(args, columns, instructions, labels, output_path):
+    # No requests are sent from here; workqueue.py workers on this and other hosts lease the shards
+    import processing
+    import workqueue
+    from engine import CASCADE_MIN_CONFIDENCE
+    from ratelimit import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+
+    settings = {
+        'model': args.model,
+        'fallback_model': args.escalate_to,
+        'min_confidence': CASCADE_MIN_CONFIDENCE if args.min_confidence is None else args.min_confidence,
+        'labels': list(labels),
+        'batch_size': args.batch_size
+    }
+    lease_seconds = args.lease_seconds or workqueue.LEASE_SECONDS
+    try:
+        df = processing.load_data_file(args.file, columns)
+        prompt_set = processing.prepare_prompt_set(
+            df, columns, instructions, args.mode, args.batch_size, load_previous(args, columns)
+        )
+        queue = processing.open_work_queue(
+            args.file, prompt_set, settings, instructions, columns, args.mode,
+            shard_rows=args.shard_rows or workqueue.SHARD_ROWS, resume=not args.no_resume
+        )
+    except (ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    progress = queue.progress()
+    print(
+        f"Queued {progress['rows']} unique prompts in {progress['shards']} shards ({progress['done']} done). "
+        f"Start workers with: python workqueue.py {queue.path}",
+        file=sys.stderr
+    )
+
+    workers = []
+    if args.local_workers:
+        # Local workers share this host's API key, so its rate budget is split between them
+        worker_args = [
+            '--lease-seconds', str(lease_seconds),
+            '--rpm', str((args.rpm or DEFAULT_REQUESTS_PER_MINUTE) // args.local_workers),
+            '--tpm', str((args.tpm or DEFAULT_TOKENS_PER_MINUTE) // args.local_workers)
+        ]
+        if args.concurrency:
+            worker_args += ['--concurrency', str(max(1, args.concurrency // args.local_workers))]
+        if args.base_url:
+            worker_args += ['--base-url', args.base_url]
+        if args.no_cache:
+            worker_args.append('--no-cache')
+        if args.quiet:
+            worker_args.append('--quiet')
+        workers = workqueue.spawn_workers(queue.path, args.local_workers, worker_args)
+    try:
+        progress = workqueue.wait_for_queue(queue, workers, make_progress_printer(args.quiet))
+        df['Analysis'] = processing.collect_queue_results(queue, prompt_set)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("\nStopped waiting; the queue is kept, rerun the same command to continue", file=sys.stderr)
+        return 130
+    finally:
+        workqueue.stop_workers(workers)
+
+    processing.save_analysis_output(args.file, df, output_path, args.results_only)
+    shards_by_worker = ', '.join(f"{worker}: {count}" for worker, count in queue.shards_by_worker().items())
+    queue.remove()
+    print(
+        f"Saved {output_path}\n"
+        f"Rows: {prompt_set.total}, unique prompts: {progress['rows']} in {progress['shards']} shards, "
+        f"errors: {progress['errors']}, tokens: {progress['tokens']}\n"
+        f"Shards per worker: {shards_by_worker}"
+    )
+    return 0
+
+
+def run_dry(args, columns, instructions, engine, session):
+    import processing
+    from planner import plan_run
+
+    try:
+        df = processing.load_data_file(args.file, columns)
+        prompt_set = processing.prepare_prompt_set(
+            df, columns, instructions, args.mode, args.batch_size, load_previous(args, columns)
+        )
+        plan = plan_run(engine, prompt_set, args.plan_sample)
+    except (ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        session.close()
+        if engine.api_client.cache is not None:
+            engine.api_client.cache.close()
+    print(plan.text())
+    return 0
+
+
+def run_rerun(args, columns, instructions, engine, session):
+    # No journal: only the failed rows are sent, and the file itself records which ones are still failing
+    import processing
+    from telemetry import get_metrics_path
+
+    engine.report['startup_seconds'] = time.perf_counter() - START_TIME
+    try:
+        retried, failing = processing.rerun_errors(
+            args.file, columns, instructions, engine, args.mode, args.retryable_only,
+            progress_callback=make_progress_printer(args.quiet)
+        )
+    except (ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        session.close()
+        if engine.api_client.cache is not None:
+            engine.api_client.cache.close()
+        processing.export_telemetry(
+            engine,
+            args.metrics_json or get_metrics_path(args.file),
+            args.prometheus_textfile or os.getenv('PROMETHEUS_TEXTFILE')
+        )
+    if not retried:
+        print(f"No failed rows in {args.file}")
+        return 0
+    print(f"Re-sent {retried} failed rows, {failing} still failing; saved {args.file}\n{engine.report_text()}")
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from dotenv import load_dotenv
+    from logconfig import setup_json_logging
+    import processing
+    from telemetry import get_metrics_path
+    from engine import MAX_CONCURRENT_REQUESTS, CASCADE_MIN_CONFIDENCE
+    from labels import parse_labels, extract_labels
+    from session import (
+        ClientSession, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_SECONDS,
+        HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+    )
+    from ratelimit import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+
+    setup_json_logging()
+    load_dotenv(dotenv_path='./config/.env')
+
+    if args.batch_api and args.stream:
+        print("Error: --batch-api cannot be combined with --stream", file=sys.stderr)
+        return 1
+    if args.batch_api and args.escalate_to:
+        print("Error: --batch-api cannot be combined with --escalate-to", file=sys.stderr)
+        return 1
+    if args.dry_run and args.stream:
+        print("Error: --dry-run cannot be combined with --stream", file=sys.stderr)
+        return 1
+    if args.shard and (args.batch_api or args.stream):
+        print("Error: --shard cannot be combined with --batch-api or --stream", file=sys.stderr)
+        return 1
+    if args.previous and (args.stream or args.rerun_errors):
+        print("Error: --previous cannot be combined with --stream or --rerun-errors", file=sys.stderr)
+        return 1
+    if args.previous and not os.path.exists(args.previous):
+        print(f"File not found: {args.previous}", file=sys.stderr)
+        return 1
+    if args.rerun_errors and (args.batch_api or args.stream or args.shard or args.dry_run or args.output):
+        print("Error: --rerun-errors cannot be combined with --batch-api, --stream, --shard, --dry-run or --output",
+              file=sys.stderr)
+        return 1
+    # --labels wins over a "#labels:" line in the template, which is never sent to the model
+    instructions, template_labels = extract_labels(read_template(args.template))
+    labels = parse_labels(args.labels) or template_labels
+    columns = [column.strip() for column in args.columns.split(',') if column.strip()]
+    files = None
+    output_path = None
+    if os.path.isdir(args.file) or any(char in args.file for char in '*?['):
+        if args.output or args.stream or args.batch_api or args.shard or args.dry_run or args.rerun_errors or args.previous:
+            print("Error: --output, --stream, --batch-api, --shard, --dry-run, --rerun-errors and --previous need a "
+                  "single input file", file=sys.stderr)
+            return 1
+        files = processing.list_input_files(args.file)
+        if not files:
+            print(f"No data files found: {args.file}", file=sys.stderr)
+            return 1
+    elif not os.path.exists(args.file):
+        print(f"File not found: {args.file}", file=sys.stderr)
+        return 1
+    elif not args.rerun_errors:
+        if args.results_only:
+            output_path = args.output or processing.get_results_path(args.file, args.output_format)
+        else:
+            output_path = args.output or processing.get_output_path(args.file, args.output_format)
+        try:
+            processing.validate_output_path(output_path)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+    if files is None and os.path.splitext(args.file)[1].lower() in ('.xlsx', '.xls'):
+        # Excel headers keep their cell values, so "--columns 2023" has to name the numeric header 2023
+        header = {str(column): column for column in processing.read_header(args.file)}
+        columns = [header.get(column, column) for column in columns]
+    if args.shard and not args.dry_run:
+        return run_coordinator(args, columns, instructions, labels, output_path)
+
+    base_url = args.base_url or os.getenv('OPENAI_BASE_URL')
+    session = ClientSession(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        base_url=base_url,
+        max_connections=args.max_connections or HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=args.keepalive_connections or HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_seconds=args.keepalive_seconds or HTTP_KEEPALIVE_SECONDS,
+        connect_timeout=args.connect_timeout or HTTP_CONNECT_TIMEOUT,
+        read_timeout=args.read_timeout or HTTP_READ_TIMEOUT,
+        http2=False if args.http1 else None
+    )
+    engine = processing.build_engine(
+        args.model,
+        api_key=os.getenv('OPENAI_API_KEY'),
+        concurrency=args.concurrency or MAX_CONCURRENT_REQUESTS,
+        batch_size=args.batch_size,
+        requests_per_minute=args.rpm or DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute=args.tpm or DEFAULT_TOKENS_PER_MINUTE,
+        use_cache=not args.no_cache,
+        bypass_cache=args.bypass_cache,
+        base_url=base_url,
+        request_log_path=args.request_log,
+        fallback_model=args.escalate_to,
+        min_confidence=CASCADE_MIN_CONFIDENCE if args.min_confidence is None else args.min_confidence,
+        labels=labels,
+        session=session
+    )
+    if files is not None:
+        return run_multi_file(args, files, columns, instructions, engine, session)
+    if args.rerun_errors:
+        return run_rerun(args, columns, instructions, engine, session)
+    if args.dry_run:
+        return run_dry(args, columns, instructions, engine, session)
+    journal_mode = 'streaming' if args.stream else ('' if args.mode == 'template' else args.mode)
+    if args.batch_api:
+        # Batches already submitted keep running on OpenAI's side, so a rerun collects them instead of paying twice
+        journal = processing.open_batch_job(
+            args.file, engine, instructions, columns, journal_mode,
+            confirm_resume=lambda batches: not args.no_resume,
+            poll_seconds=args.poll_seconds or processing.BATCH_POLL_SECONDS
+        )
+    else:
+        journal = processing.open_journal(
+            args.file, engine.api_client.model_name, instructions, columns, journal_mode,
+            confirm_resume=lambda rows: not args.no_resume
+        )
+    progress_callback = make_progress_printer(args.quiet)
+
+    try:
+        if args.stream:
+            engine.report['startup_seconds'] = time.perf_counter() - START_TIME
+            processing.run_streaming(
+                args.file, columns, instructions, engine, journal, output_path, args.mode,
+                progress_callback=progress_callback, results_only=args.results_only
+            )
+        else:
+            df = processing.load_data_file(args.file, columns)
+            prompt_set = processing.prepare_prompt_set(
+                df, columns, instructions, args.mode, args.batch_size, load_previous(args, columns)
+            )
+            engine.report['startup_seconds'] = time.perf_counter() - START_TIME
+            if args.batch_api:
+                df['Analysis'] = processing.run_prompt_set_batch(
+                    engine, prompt_set, journal, progress_callback,
+                    status_callback=None if args.quiet else lambda text: print(text, file=sys.stderr, flush=True)
+                )
+            else:
+                df['Analysis'] = processing.run_prompt_set(engine, prompt_set, journal, progress_callback)
+            processing.save_analysis_output(args.file, df, output_path, args.results_only)
+    except (ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        if not args.batch_api:
+            raise
+        print("\nStopped waiting; rerun the same command to collect the batches", file=sys.stderr)
+        return 130
+    finally:
+        journal.close()
+        session.close()
+        if engine.api_client.cache is not None:
+            engine.api_client.cache.close()
+        processing.export_telemetry(
+            engine,
+            args.metrics_json or get_metrics_path(output_path),
+            args.prometheus_textfile or os.getenv('PROMETHEUS_TEXTFILE')
+        )
+
+    journal.remove()
+    print(f"Saved {output_path}\n{engine.report_text()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
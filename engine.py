@@ -0,0 +1,616 @@
+import math
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from cache import make_cache_key
+from batching import chunk, build_batch_prompt, parse_batch_reply
+from labels import match_label, parse_label_reply, label_request_options, label_reask_message
+from prompts import build_messages
+from session import ConnectionStats, start_request_timing, finish_request_timing
+from ratelimit import estimate_tokens, parse_reset_seconds, CircuitOpenError
+
+MAX_CONCURRENT_REQUESTS = 200
+MAX_RETRY_ATTEMPTS = 8
+MAX_RETRY_WAIT_SECONDS = 60
+CASCADE_MIN_CONFIDENCE = 0.9
+# Timeouts and conflicts on the server's side, retried like 429 and 5xx
+RETRYABLE_STATUS_CODES = (408, 409)
+ERROR_RETRYABLE = 'retryable'
+ERROR_PERMANENT = 'permanent'
+# Row ids named in a report line before the rest are only counted
+REPORT_LISTED_ROWS = 10
+
+
+def is_retryable(exc):
+    import openai
+    if getattr(exc, 'status_code', None) in RETRYABLE_STATUS_CODES:
+        return True
+    return isinstance(exc, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+
+def is_outage_error(exc):
+    # Failures that say the API is down or overloaded; 429s are paced by the limiter instead
+    import openai
+    return isinstance(exc, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def error_text(kind, message):
+    return f"Error ({kind}): {message}"
+
+
+def error_reply(exc):
+    # Retryable failures may succeed on a rerun; permanent ones (bad request, auth, context length) fail every time
+    kind = ERROR_RETRYABLE if is_retryable(exc) or isinstance(exc, CircuitOpenError) else ERROR_PERMANENT
+    return error_text(kind, exc)
+
+
+def error_kind(reply):
+    # None for replies that are not errors; errors written before they were classified count as retryable
+    if reply is None or not str(reply).startswith('Error'):
+        return None
+    return ERROR_PERMANENT if str(reply).startswith(error_text(ERROR_PERMANENT, '')) else ERROR_RETRYABLE
+
+
+def is_rate_limit_error(exc):
+    import openai
+    return isinstance(exc, openai.RateLimitError)
+
+
+def retry_after_seconds(exc):
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return parse_reset_seconds(headers.get('x-ratelimit-reset-requests') or headers.get('x-ratelimit-reset-tokens'))
+
+
+backoff_wait = wait_random_exponential(multiplier=1, max=MAX_RETRY_WAIT_SECONDS)
+
+
+def retry_wait(retry_state):
+    # A throttled request waits what the server asked for, with jitter so retries do not arrive together;
+    # other failures back off exponentially
+    exc = retry_state.outcome.exception()
+    retry_after = retry_after_seconds(exc) if is_rate_limit_error(exc) else None
+    if retry_after:
+        return min(MAX_RETRY_WAIT_SECONDS, retry_after * random.uniform(1.0, 1.5))
+    return backoff_wait(retry_state)
+
+
+def cache_get(cache, key):
+    # The cache only saves requests: one that cannot be read (e.g. locked by another process for too long)
+    # counts as a miss instead of failing the row
+    try:
+        return cache.get(key)
+    except sqlite3.Error as e:
+        logging.warning(f"Response cache lookup failed: {e}")
+        return None
+
+
+def cache_put(cache, key, reply):
+    try:
+        cache.put(key, reply)
+    except sqlite3.Error as e:
+        logging.warning(f"Response cache write failed, the reply is kept but not cached: {e}")
+
+
+def reply_confidence(choice):
+    # Probability of the whole reply, the product of its token probabilities; None without logprobs
+    content = getattr(getattr(choice, 'logprobs', None), 'content', None)
+    if not content:
+        return None
+    return math.exp(sum(token.logprob for token in content))
+
+
+class OpenAIAPIClient:
+    def __init__(self, model_name, api_key=None, client=None, cache=None, bypass_cache=False, limiter=None,
+                 base_url=None, telemetry=None, labels=(), breaker=None, retry_budget=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.client = client
+        self.owns_client = client is None
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.limiter = limiter
+        # Shared by the clients of one engine, since an outage hits every model behind the same API
+        self.breaker = breaker
+        self.retry_budget = retry_budget
+        self.telemetry = telemetry
+        self.temperature = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Prompt tokens the provider served from its prefix cache (billed at a discount)
+        self.cached_tokens = 0
+        # With allowed labels, replies are constrained and normalized; off-label ones are asked again once
+        self.labels = tuple(labels)
+        self.reasked = 0
+        self.off_label = 0
+        self.failed = {ERROR_RETRYABLE: 0, ERROR_PERMANENT: 0}
+
+    def open(self):
+        # The async client is bound to the event loop it is first used on
+        if self.client is None:
+            from openai import AsyncOpenAI
+            # Retries are handled below so throttling feeds back into the limiter
+            self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self.client
+
+    async def close(self):
+        # Injected clients belong to the caller and outlive a single run
+        if self.owns_client and self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    def build_messages(self, prompt):
+        return build_messages(prompt)
+
+    def cache_key(self, prompt, request_options=None):
+        return make_cache_key(self.model_name, self.build_messages(prompt), self.temperature, request_options)
+
+    async def get_response(self, prompt, rows=None, **request_options):
+        reply, _ = await self.get_scored_response(prompt, rows, **request_options)
+        return reply
+
+    async def get_scored_response(self, prompt, rows=None, **request_options):
+        # Returns (reply, confidence); confidence is only known for fresh replies requested with logprobs=True
+        # rows only labels the telemetry record, it is not sent to the API
+        start = time.monotonic()
+        messages = self.build_messages(prompt)
+        # Single-row requests are held to the allowed labels; micro-batched ones bring their own response_format
+        constrained = bool(self.labels) and 'response_format' not in request_options
+        if constrained:
+            request_options = dict(self.request_options(), **request_options)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache_key(prompt, request_options)
+            # Bypassing skips the lookup only, fresh replies still refresh the cache
+            if not self.bypass_cache:
+                cached = cache_get(self.cache, cache_key)
+                if cached is not None:
+                    self.record_request(rows, start, cache_hit=True)
+                    return cached, None
+        retries = {'count': 0}
+        try:
+            response = await self.send_with_retries(messages, request_options, retries)
+            prompt_tokens, completion_tokens, cached_tokens = self.record_usage(response)
+            reply = response.choices[0].message.content.strip()
+            label = match_label(parse_label_reply(reply), self.labels) if constrained else reply
+            if label is None:
+                # An off-label reply is asked once more, with the allowed labels spelled out
+                self.reasked += 1
+                messages = messages + [
+                    {"role": "assistant", "content": reply},
+                    {"role": "user", "content": label_reask_message(self.labels)}
+                ]
+                response = await self.send_with_retries(messages, request_options, retries)
+                usage = self.record_usage(response)
+                prompt_tokens, completion_tokens, cached_tokens = (
+                    prompt_tokens + usage[0], completion_tokens + usage[1], cached_tokens + usage[2]
+                )
+                reply = response.choices[0].message.content.strip()
+                label = match_label(parse_label_reply(reply), self.labels)
+        except Exception as e:
+            logging.error(f"OpenAI API error: {e}")
+            self.record_request(rows, start, retries=retries['count'], error=type(e).__name__)
+            reply = error_reply(e)
+            self.failed[error_kind(reply)] += 1
+            return reply, None
+        self.record_request(rows, start, prompt_tokens, completion_tokens, retries=retries['count'],
+                            cached_tokens=cached_tokens)
+        if label is None:
+            # Still off-label: kept as written but not cached, so a rerun asks again
+            self.off_label += 1
+            return parse_label_reply(reply), reply_confidence(response.choices[0])
+        if cache_key is not None:
+            cache_put(self.cache, cache_key, label)
+        return label, reply_confidence(response.choices[0])
+
+    async def send_with_retries(self, messages, request_options, retries):
+        # retries['count'] is kept up to date for the telemetry record, also when the last attempt fails
+        if self.retry_budget is not None:
+            self.retry_budget.deposit()
+        async for attempt in AsyncRetrying(
+            retry=retry_if_exception(self.should_retry),
+            wait=retry_wait,
+            stop=stop_after_attempt(MAX_RETRY_ATTEMPTS),
+            reraise=True
+        ):
+            if attempt.retry_state.attempt_number > 1:
+                retries['count'] += 1
+            with attempt:
+                return await self.send(messages, request_options)
+
+    def should_retry(self, exc):
+        if not is_retryable(exc):
+            return False
+        # Throttled requests are paced by the limiter; only failures spend the retry budget
+        if self.retry_budget is None or is_rate_limit_error(exc):
+            return True
+        return self.retry_budget.withdraw()
+
+    def request_options(self, count=None):
+        # Without labels only micro-batched requests (count rows) ask for a JSON object
+        if not self.labels:
+            return {} if count is None else {'response_format': {'type': 'json_object'}}
+        return label_request_options(self.labels, self.model_name, count)
+
+    def record_usage(self, response):
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return 0, 0, 0
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        cached_tokens = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None) or 0
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        return prompt_tokens, completion_tokens, cached_tokens
+
+    def record_request(self, rows, start, prompt_tokens=0, completion_tokens=0, retries=0, cache_hit=False, error=None,
+                       cached_tokens=0):
+        if self.telemetry is not None:
+            self.telemetry.record(
+                rows, time.monotonic() - start, prompt_tokens, completion_tokens, retries, cache_hit, error,
+                model=self.model_name, cached_tokens=cached_tokens
+            )
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    async def send(self, messages, request_options):
+        # While the circuit is open requests wait here, so an outage does not turn every row into an error
+        if self.breaker is None:
+            return await self.post(messages, request_options)
+        await self.breaker.wait()
+        try:
+            response = await self.post(messages, request_options)
+        except Exception as e:
+            if is_outage_error(e):
+                self.breaker.on_failure()
+            else:
+                # Any answer from the API, even a rejection, shows it is reachable
+                self.breaker.on_success()
+            raise
+        except BaseException:
+            self.breaker.on_abandoned()
+            raise
+        self.breaker.on_success()
+        return response
+
+    async def post(self, messages, request_options):
+        if self.limiter is None:
+            timing = start_request_timing()
+            response = await self.open().chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=self.temperature,
+                **request_options
+            )
+            finish_request_timing(timing)
+            return response
+
+        await self.limiter.acquire(sum(estimate_tokens(message['content']) for message in messages))
+        try:
+            # Timed after the limiter let the request through, so the overhead covers the client only
+            timing = start_request_timing()
+            raw = await self.open().chat.completions.with_raw_response.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=self.temperature,
+                **request_options
+            )
+            self.limiter.on_success(time.perf_counter() - timing['started'], raw.headers)
+            response = raw.parse()
+            finish_request_timing(timing)
+            return response
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.limiter.on_throttled()
+            raise
+        finally:
+            await self.limiter.release()
+
+
+class CascadeClient:
+    # Asks the cheap primary model first and re-sends only uncertain or off-label replies to the fallback model
+    def __init__(self, primary, fallback, min_confidence=CASCADE_MIN_CONFIDENCE, labels=(), cache=None,
+                 bypass_cache=False):
+        self.primary = primary
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+        self.labels = tuple(labels)
+        # Final answers are cached under the cascade's own key; the fallback model keeps its regular cache entries
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self.model_name = f"{primary.model_name}>{fallback.model_name}"
+        self.limiter = primary.limiter
+        self.breaker = primary.breaker
+        self.retry_budget = primary.retry_budget
+        self.telemetry = primary.telemetry
+        self.temperature = primary.temperature
+        self.rows = 0
+        self.escalated = {'low_confidence': 0, 'off_label': 0, 'error': 0}
+
+    def build_messages(self, prompt):
+        return self.primary.build_messages(prompt)
+
+    def cache_key(self, prompt, request_options=None):
+        options = dict(request_options or {}, min_confidence=self.min_confidence, labels=list(self.labels))
+        return make_cache_key(self.model_name, self.build_messages(prompt), self.temperature, options)
+
+    @property
+    def prompt_tokens(self):
+        return self.primary.prompt_tokens + self.fallback.prompt_tokens
+
+    @property
+    def completion_tokens(self):
+        return self.primary.completion_tokens + self.fallback.completion_tokens
+
+    @property
+    def cached_tokens(self):
+        return self.primary.cached_tokens + self.fallback.cached_tokens
+
+    @property
+    def failed(self):
+        return {kind: self.primary.failed[kind] + self.fallback.failed[kind] for kind in self.primary.failed}
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    async def close(self):
+        await self.primary.close()
+        await self.fallback.close()
+
+    def escalation_reason(self, reply, confidence):
+        if reply.startswith('Error'):
+            return 'error'
+        if self.labels and match_label(reply, self.labels) is None:
+            return 'off_label'
+        if confidence is None or confidence < self.min_confidence:
+            return 'low_confidence'
+        return None
+
+    async def get_response(self, prompt, rows=None, **request_options):
+        start = time.monotonic()
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache_key(prompt, request_options)
+            if not self.bypass_cache:
+                cached = cache_get(self.cache, cache_key)
+                if cached is not None:
+                    if self.telemetry is not None:
+                        self.telemetry.record(rows, time.monotonic() - start, cache_hit=True, model=self.model_name)
+                    return cached
+        reply, confidence = await self.primary.get_scored_response(prompt, rows, logprobs=True, **request_options)
+        row_count = len(rows) if rows else 1
+        self.rows += row_count
+        reason = self.escalation_reason(reply, confidence)
+        if reason is not None:
+            self.escalated[reason] += row_count
+            reply = await self.fallback.get_response(prompt, rows, **request_options)
+        if cache_key is not None and not reply.startswith('Error'):
+            cache_put(self.cache, cache_key, reply)
+        return reply
+
+    def stats_text(self):
+        escalated = sum(self.escalated.values())
+        share = escalated / self.rows if self.rows else 0.0
+        return (
+            f"Cascade {self.primary.model_name} -> {self.fallback.model_name}: {escalated} of {self.rows} rows "
+            f"escalated ({share:.1%}); low confidence: {self.escalated['low_confidence']}, "
+            f"outside the labels: {self.escalated['off_label']}, errors: {self.escalated['error']}"
+        )
+
+
+class AsyncRequestEngine:
+    def __init__(self, api_client, concurrency=MAX_CONCURRENT_REQUESTS, batch_size=1, session=None):
+        self.api_client = api_client
+        # With a ClientSession, runs execute on its long-lived loop and connection pool instead of a fresh one
+        self.session = session
+        self.connections = ConnectionStats() if session is not None else None
+        self.concurrency = max(1, int(concurrency))
+        self.batch_size = max(1, int(batch_size))
+        self.report = {}
+        # Several files may report into one engine from different threads
+        self.report_lock = threading.Lock()
+        # Set from any thread; workers stop taking new jobs and in-flight requests finish
+        self.cancel_event = threading.Event()
+        if getattr(api_client, 'breaker', None) is not None:
+            api_client.breaker.cancel_event = self.cancel_event
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    async def run_async(self, prompts, progress_callback=None, batch_items=None, batch_instructions=None,
+                        result_callback=None, row_ids=None):
+        # Identical prompts are sent once and the reply is copied back to every row
+        row_ids = list(row_ids) if row_ids is not None else list(range(len(prompts)))
+        row_groups = {}
+        for idx, prompt in enumerate(prompts):
+            row_groups.setdefault(prompt, []).append(idx)
+        unique_prompts = list(row_groups)
+        # Counters accumulate so one engine can report over several chunks
+        self.count('rows', len(prompts))
+        self.count('requests', len(unique_prompts))
+
+        results = [None] * len(prompts)
+        advance = self.make_progress(len(unique_prompts), progress_callback)
+
+        def rows_of(position):
+            return [row_ids[idx] for idx in row_groups[unique_prompts[position]]]
+
+        def deliver(position, reply):
+            for idx in row_groups[unique_prompts[position]]:
+                results[idx] = reply
+                if result_callback:
+                    result_callback(idx, reply)
+            advance()
+
+        try:
+            if self.batch_size > 1 and batch_items is not None:
+                unique_items = [batch_items[row_groups[prompt][0]] for prompt in unique_prompts]
+                await self.dispatch_batched(unique_prompts, unique_items, batch_instructions, deliver, rows_of)
+            else:
+                await self.dispatch(unique_prompts, deliver, rows_of)
+        finally:
+            await self.api_client.close()
+        return results
+
+    def count(self, name, amount):
+        with self.report_lock:
+            self.report[name] = self.report.get(name, 0) + amount
+
+    def list_rows(self, name, rows):
+        # Keeps the first REPORT_LISTED_ROWS row ids for the report; count() keeps the total
+        with self.report_lock:
+            listed = self.report.setdefault(name, [])
+            listed.extend(rows[:max(0, REPORT_LISTED_ROWS - len(listed))])
+
+    async def run_workers(self, jobs, handler):
+        # Workers share one iterator, so at most `concurrency` requests are in flight
+        pending = iter(jobs)
+
+        async def worker():
+            for job in pending:
+                if self.cancelled:
+                    break
+                await handler(job)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(jobs)))))
+
+    def make_progress(self, total, progress_callback):
+        completed = 0
+
+        def advance():
+            nonlocal completed
+            completed += 1
+            if progress_callback:
+                progress_callback(completed, total)
+
+        return advance
+
+    async def dispatch(self, prompts, deliver, rows_of):
+        async def send(idx):
+            reply = await self.api_client.get_response(prompts[idx], rows=rows_of(idx))
+            logging.debug(f"Response for index {idx}:\n{reply}\n")
+            deliver(idx, reply)
+
+        await self.run_workers(range(len(prompts)), send)
+
+    async def dispatch_batched(self, prompts, items, instructions, deliver, rows_of):
+        batches = list(chunk(range(len(prompts)), self.batch_size))
+        fallback = []
+
+        async def send_batch(positions):
+            batch_prompt = build_batch_prompt(instructions, [items[idx] for idx in positions])
+            rows = [row for idx in positions for row in rows_of(idx)]
+            reply = await self.api_client.get_response(
+                batch_prompt, rows=rows, **self.api_client.request_options(len(positions))
+            )
+            answers = parse_batch_reply(reply, len(positions))
+            if self.api_client.labels:
+                # Off-label answers are retried on their own, where they are re-asked if needed
+                answers = {offset: match_label(answer, self.api_client.labels) for offset, answer in answers.items()}
+                answers = {offset: answer for offset, answer in answers.items() if answer is not None}
+            for offset, idx in enumerate(positions):
+                if offset in answers:
+                    deliver(idx, answers[offset])
+                else:
+                    fallback.append(idx)
+
+        async def send_single(idx):
+            deliver(idx, await self.api_client.get_response(prompts[idx], rows=rows_of(idx)))
+
+        await self.run_workers(batches, send_batch)
+        # Rows missing from or malformed in a batch reply are retried on their own
+        if fallback:
+            logging.info(f"Retrying {len(fallback)} rows individually after batch replies")
+            await self.run_workers(fallback, send_single)
+        self.count('batch_requests', len(batches))
+        self.count('batch_fallbacks', len(fallback))
+
+    def run(self, prompts, progress_callback=None, batch_items=None, batch_instructions=None, result_callback=None,
+            row_ids=None):
+        coroutine = self.run_async(prompts, progress_callback, batch_items, batch_instructions, result_callback, row_ids)
+        if self.session is not None:
+            return self.session.run(coroutine, self.connections)
+        return asyncio.run(coroutine)
+
+    def report_text(self):
+        lines = []
+        rows = self.report.get('rows', 0)
+        requests = self.report.get('requests', 0)
+        if rows:
+            ratio = rows / requests if requests else 0
+            lines.append(f"Rows: {rows}, unique prompts: {requests} (dedup ratio {ratio:.2f}x)")
+        if 'batch_requests' in self.report:
+            lines.append(
+                f"Batched requests: {self.report['batch_requests']} of up to {self.batch_size} rows, "
+                f"rows retried individually: {self.report['batch_fallbacks']}"
+            )
+        if isinstance(self.api_client, CascadeClient) and self.api_client.rows:
+            lines.append(self.api_client.stats_text())
+        if isinstance(self.api_client, OpenAIAPIClient) and (self.api_client.reasked or self.api_client.off_label):
+            lines.append(
+                f"Labels: {self.api_client.reasked} off-label replies re-asked, "
+                f"{self.api_client.off_label} still off-label"
+            )
+        failed = self.api_client.failed
+        if any(failed.values()):
+            lines.append(
+                f"Failed requests: {failed[ERROR_RETRYABLE]} retryable, {failed[ERROR_PERMANENT]} permanent"
+            )
+        if self.api_client.retry_budget is not None and self.api_client.retry_budget.retries:
+            lines.append(self.api_client.retry_budget.stats_text())
+        if self.api_client.breaker is not None and self.api_client.breaker.opened:
+            lines.append(self.api_client.breaker.stats_text())
+        if 'batch_jobs' in self.report:
+            lines.append(
+                f"Batch API jobs: {self.report['batch_jobs']}, "
+                f"requests submitted this run: {self.report.get('batch_api_requests', 0)}"
+            )
+        if self.cancelled:
+            lines.append("Cancelled: rows that were not dispatched are left empty and can be resumed")
+        if self.api_client.total_tokens:
+            cached = ''
+            if self.api_client.cached_tokens:
+                share = self.api_client.cached_tokens / self.api_client.prompt_tokens
+                cached = f" ({self.api_client.cached_tokens} from the provider's prompt cache, {share:.0%})"
+            lines.append(
+                f"Tokens used: {self.api_client.prompt_tokens} prompt{cached}, "
+                f"{self.api_client.completion_tokens} completion"
+            )
+        if 'startup_seconds' in self.report:
+            lines.append(f"Startup before the first request: {self.report['startup_seconds']:.2f} s")
+        if self.report.get('reused_rows'):
+            reused = self.report['reused_rows']
+            listed = ', '.join(str(row) for row in self.report.get('reused_row_ids', []))
+            more = f" and {reused - REPORT_LISTED_ROWS} more" if reused > REPORT_LISTED_ROWS else ''
+            lines.append(
+                f"Reused from the previous output: {reused} unchanged rows ({listed}{more}), "
+                f"{rows} new or changed rows analyzed"
+            )
+        if self.report.get('resumed_rows'):
+            lines.append(f"Rows restored from the checkpoint journal: {self.report['resumed_rows']}")
+        if self.api_client.telemetry is not None and self.api_client.telemetry.latency.count:
+            lines.append(self.api_client.telemetry.stats_text())
+        if self.connections is not None and self.connections.requests:
+            lines.append(self.connections.stats_text())
+        if self.api_client.limiter is not None:
+            lines.append(self.api_client.limiter.stats_text())
+        if 'resolved_locally' in self.report:
+            lines.append(f"Resolved locally without an API call: {self.report['resolved_locally']}")
+        if self.api_client.cache is not None:
+            lines.append(self.api_client.cache.stats_text())
+        return '\n'.join(lines)
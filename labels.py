@@ -0,0 +1,94 @@
+import re
+import json
+import math
+
+# Quotes, brackets and sentence punctuation models tend to wrap a bare label in
+LABEL_STRIP_CHARS = ' \t\r\n\'"`.,;:!()[]{}*'
+# A template line such as "#labels: incident, service request" declares the allowed answers
+LABELS_DIRECTIVE = re.compile(r"^[ \t]*#labels:(.*)$\n?", re.IGNORECASE | re.MULTILINE)
+# max_tokens is sized from the longest label at a conservative 3 characters per token, plus a small margin;
+# JSON replies add the braces, quotes and keys around each label
+LABEL_CHARS_PER_TOKEN = 3
+LABEL_MAX_TOKENS_MARGIN = 3
+LABEL_JSON_OVERHEAD_TOKENS = 6
+# Models that accept a strict json_schema response format (dated snapshots included)
+STRUCTURED_OUTPUT_MODELS = ('gpt-4o', 'gpt-4.1', 'gpt-5')
+LABEL_REASK_TEMPLATE = "Reply with exactly one of these labels and nothing else: {labels}"
+
+
+def parse_labels(text):
+    # "incident, service request" -> ('incident', 'service request')
+    if not text:
+        return ()
+    return tuple(label.strip() for label in text.split(',') if label.strip())
+
+
+def extract_labels(template):
+    # Returns the template without its #labels: line, and the labels that line declares
+    match = LABELS_DIRECTIVE.search(template)
+    if match is None:
+        return template, ()
+    return LABELS_DIRECTIVE.sub('', template, count=1).strip(), parse_labels(match.group(1))
+
+
+def normalize_label(text):
+    return re.sub(r'\s+', ' ', str(text).strip(LABEL_STRIP_CHARS)).lower()
+
+
+def match_label(reply, labels):
+    # Returns the allowed label the reply spells, ignoring case, spacing and wrapping punctuation, or None
+    normalized = normalize_label(reply)
+    for label in labels:
+        if normalize_label(label) == normalized:
+            return label
+    return None
+
+
+def supports_structured_output(model_name):
+    return any(model_name == name or model_name.startswith(f"{name}-") for name in STRUCTURED_OUTPUT_MODELS)
+
+
+def label_tokens(labels):
+    return max(math.ceil(len(label) / LABEL_CHARS_PER_TOKEN) for label in labels)
+
+
+def label_request_options(labels, model_name, count=None):
+    # Options that keep replies to the labels: one label, or with count a JSON object of count numbered labels.
+    # Models without structured outputs still get the tight max_tokens; their replies are matched afterwards.
+    structured = supports_structured_output(model_name)
+    if count is None:
+        if not structured:
+            return {'max_tokens': label_tokens(labels) + LABEL_MAX_TOKENS_MARGIN}
+        properties = {'label': {'type': 'string', 'enum': list(labels)}}
+        max_tokens = label_tokens(labels) + LABEL_JSON_OVERHEAD_TOKENS + LABEL_MAX_TOKENS_MARGIN
+    else:
+        properties = {str(number): {'type': 'string', 'enum': list(labels)} for number in range(1, count + 1)}
+        max_tokens = count * (label_tokens(labels) + LABEL_JSON_OVERHEAD_TOKENS) + LABEL_MAX_TOKENS_MARGIN
+        if not structured:
+            return {'response_format': {'type': 'json_object'}, 'max_tokens': max_tokens}
+    schema = {
+        'type': 'object',
+        'properties': properties,
+        'required': list(properties),
+        'additionalProperties': False,
+    }
+    return {
+        'response_format': {'type': 'json_schema', 'json_schema': {'name': 'labels', 'strict': True, 'schema': schema}},
+        'max_tokens': max_tokens,
+    }
+
+
+def parse_label_reply(reply):
+    # Structured replies look like {"label": "incident"}; anything else is taken as the bare answer
+    if reply.startswith('{'):
+        try:
+            data = json.loads(reply)
+        except ValueError:
+            return reply
+        if isinstance(data, dict) and 'label' in data:
+            return str(data['label'])
+    return reply
+
+
+def label_reask_message(labels):
+    return LABEL_REASK_TEMPLATE.format(labels=', '.join(labels))
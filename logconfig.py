@@ -0,0 +1,33 @@
+import sys
+import json
+import logging
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        log_record = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        # Structured fields passed with extra={'telemetry': {...}} are merged into the record
+        telemetry = getattr(record, 'telemetry', None)
+        if telemetry:
+            log_record.update(telemetry)
+        return json.dumps(log_record)
+
+
+def setup_json_logging():
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    console_handler = logging.StreamHandler(sys.stdout)
+    
+    console_handler.setLevel(logging.INFO)
+    
+    json_formatter = JSONFormatter()
+    console_handler.setFormatter(json_formatter)
+    logger.addHandler(console_handler)
+    # openai and httpx log every request at DEBUG/INFO, which floods stdout on large runs
+    for name in ('openai', 'httpx'):
+        logging.getLogger(name).setLevel(logging.WARNING)
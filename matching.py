@@ -0,0 +1,96 @@
+import re
+import heapq
+import unicodedata
+from collections import defaultdict
+
+MATCH_TOP_K = 10
+NGRAM_SIZE = 3
+# Instruction lines such as "#match-reply: {name}: True" say how rows resolved without the model are written.
+# Without them those rows go to the model too, so every reply follows the format the instructions ask for.
+MATCH_REPLY_DIRECTIVE = re.compile(r"^[ \t]*#match-reply:[ \t]*(.*)$\n?", re.IGNORECASE | re.MULTILINE)
+NO_MATCH_REPLY_DIRECTIVE = re.compile(r"^[ \t]*#no-match-reply:[ \t]*(.*)$\n?", re.IGNORECASE | re.MULTILINE)
+
+
+def extract_local_replies(instructions):
+    # Returns the instructions without their reply lines, and (match_reply, no_match_reply); None where not declared
+    replies = []
+    for directive in (MATCH_REPLY_DIRECTIVE, NO_MATCH_REPLY_DIRECTIVE):
+        match = directive.search(instructions)
+        replies.append((match.group(1).strip() or None) if match else None)
+        instructions = directive.sub('', instructions, count=1)
+    return instructions.strip(), tuple(replies)
+
+
+def normalize_name(name):
+    # Case, accents, punctuation and repeated whitespace do not make two names different
+    text = unicodedata.normalize('NFKD', str(name))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", ' ', text.casefold())
+    return ' '.join(text.split())
+
+
+def name_key(name):
+    # Sorting the tokens makes "Doe John" and "John Doe" share a key
+    return ' '.join(sorted(normalize_name(name).split()))
+
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    padded = f" {text} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class NameIndex:
+    def __init__(self, names, top_k=MATCH_TOP_K):
+        self.top_k = top_k
+        self.names = []
+        self.exact = set()
+        self.by_key = {}
+        self.ngram_sizes = []
+        self.postings = defaultdict(list)
+
+        for name in dict.fromkeys(names):
+            key = name_key(name)
+            if not key:
+                continue
+            self.exact.add(name)
+            self.by_key.setdefault(key, name)
+            name_id = len(self.names)
+            self.names.append(name)
+            grams = char_ngrams(key)
+            self.ngram_sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(name_id)
+
+    def match(self, name):
+        if name in self.exact:
+            return name
+        return self.by_key.get(name_key(name))
+
+    def candidates(self, name):
+        grams = char_ngrams(name_key(name))
+        shared = defaultdict(int)
+        for gram in grams:
+            for name_id in self.postings.get(gram, ()):
+                shared[name_id] += 1
+        if not shared:
+            return []
+        # Dice similarity over character n-grams of the token-sorted key
+        scored = (
+            (2 * count / (len(grams) + self.ngram_sizes[name_id]), name_id)
+            for name_id, count in shared.items()
+        )
+        return [self.names[name_id] for _, name_id in heapq.nlargest(self.top_k, scored)]
+
+    def resolve(self, name, match_reply=None, no_match_reply=None):
+        # Returns (local_reply, candidates); local_reply is None when the model has to decide. Without a declared
+        # reply, a sure match is sent with only the matching name and a sure miss with no candidates. Replies come from
+        # the user's instructions, so only the literal {name} is filled in and other braces (JSON examples) are kept.
+        match = self.match(name)
+        if match is not None:
+            return (match_reply.replace('{name}', name), []) if match_reply else (None, [match])
+        candidates = self.candidates(name)
+        if not candidates and no_match_reply:
+            return no_match_reply.replace('{name}', name), []
+        return None, candidates
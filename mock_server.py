@@ -0,0 +1,498 @@
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import urllib.request
+import threading
+import multiprocessing
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A local stand-in for the OpenAI chat completions endpoint, used for offline benchmarks and tuning
+DEFAULT_LABELS = ('incident', 'service request')
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def pick_label(text, labels):
+    # Deterministic: the same prompt always gets the same answer
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return labels[digest[0] % len(labels)]
+
+
+class MockPrefixCache:
+    # Mimics OpenAI's automatic prompt caching: a repeated system prefix of 1024+ tokens is served
+    # from cache in 128-token increments
+    min_tokens = 1024
+    increment = 128
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seen = set()
+
+    def cached_tokens(self, body):
+        messages = body.get('messages') or []
+        if not messages or messages[0].get('role') != 'system':
+            return 0
+        prefix = str(messages[0].get('content', ''))
+        tokens = count_tokens(prefix)
+        if tokens < self.min_tokens:
+            return 0
+        key = hashlib.sha256(prefix.encode('utf-8')).digest()
+        with self.lock:
+            if key not in self.seen:
+                self.seen.add(key)
+                return 0
+        return tokens // self.increment * self.increment
+
+
+def mock_logprobs(prompt, content):
+    # A deterministic confidence between 0.5 and 1.0, spread evenly over the reply's tokens
+    digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+    confidence = 0.5 + 0.5 * digest[1] / 255
+    tokens = content.split(' ')
+    logprob = math.log(confidence) / len(tokens)
+    return {'content': [{'token': token, 'logprob': logprob, 'bytes': None, 'top_logprobs': []} for token in tokens]}
+
+
+class MockConfig:
+    def __init__(self, latency_ms=200.0, latency_sigma=0.5, error_rate=0.0, retry_after=1.0,
+                 requests_per_minute=1_000_000, tokens_per_minute=1_000_000_000, labels=DEFAULT_LABELS, seed=0,
+                 batch_seconds=2.0, chatty_rate=0.0, outage_after=None, outage_seconds=0.0, invalid_rate=0.0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.labels = tuple(labels)
+        # Batch jobs report in_progress for this long, then complete all at once
+        self.batch_seconds = batch_seconds
+        # Share of unconstrained replies that wrap the label in a sentence
+        self.chatty_rate = chatty_rate
+        # Every request fails with 503 from outage_after seconds after start, for outage_seconds
+        self.outage_after = outage_after
+        self.outage_seconds = outage_seconds
+        # Share of prompts rejected with 400 every time they are sent
+        self.invalid_rate = invalid_rate
+        self.started = time.monotonic()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample_latency(self):
+        # Log-normal around the median, which is how real completion latencies are skewed
+        with self.lock:
+            if self.latency_sigma <= 0:
+                return self.latency_ms / 1000.0
+            return self.random.lognormvariate(math.log(max(self.latency_ms, 0.001)), self.latency_sigma) / 1000.0
+
+    def in_outage(self):
+        if self.outage_after is None:
+            return False
+        elapsed = time.monotonic() - self.started
+        return self.outage_after <= elapsed < self.outage_after + self.outage_seconds
+
+    def should_throttle(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.batch_requests = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, amount in counts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'failed': self.failed,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cached_tokens': self.cached_tokens,
+                'batch_requests': self.batch_requests,
+            }
+
+
+def is_invalid(body, invalid_rate):
+    text = json.dumps(body.get('messages'), sort_keys=True)
+    return invalid_rate > 0 and hashlib.sha256(text.encode('utf-8')).digest()[3] / 256 < invalid_rate
+
+
+def is_chatty(prompt, chatty_rate):
+    digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+    return chatty_rate > 0 and digest[2] / 256 < chatty_rate
+
+
+def answer_for(body, labels, chatty_rate=0.0):
+    prompt = '\n'.join(str(message.get('content', '')) for message in body.get('messages', []))
+    response_format = body.get('response_format') or {}
+    if response_format.get('type') == 'json_schema':
+        # Structured outputs: every answer is taken from the schema's enum
+        properties = response_format['json_schema']['schema']['properties']
+        if 'label' in properties:
+            return json.dumps({'label': pick_label(prompt, properties['label']['enum'])}), prompt
+        items = dict(re.findall(r"^(\d+)\. (.*)$", prompt, re.MULTILINE))
+        return json.dumps({
+            number: pick_label(items.get(number, prompt), spec['enum']) for number, spec in properties.items()
+        }), prompt
+    if response_format.get('type') == 'json_object':
+        # Micro-batched prompts: answer every numbered item
+        items = re.findall(r"^(\d+)\. (.*)$", prompt, re.MULTILINE)
+        return json.dumps({number: pick_label(item, labels) for number, item in items}), prompt
+    label = pick_label(prompt, labels)
+    if is_chatty(prompt, chatty_rate):
+        # Free-form answers wrap the label in a sentence, as models without output constraints often do
+        return f"Based on the text provided, this is best described as a {label.title()}.", prompt
+    return label, prompt
+
+
+def build_completion(body, labels, completion_id, cached_tokens=0, chatty_rate=0.0):
+    content, prompt = answer_for(body, labels, chatty_rate)
+    finish_reason = 'stop'
+    max_tokens = body.get('max_tokens')
+    if max_tokens and count_tokens(content) > max_tokens:
+        content = content[:max_tokens * 4]
+        finish_reason = 'length'
+    prompt_tokens = count_tokens(prompt)
+    completion_tokens = count_tokens(content)
+    payload = {
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'mock'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': finish_reason,
+            'logprobs': mock_logprobs(prompt, content) if body.get('logprobs') else None,
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        },
+    }
+    return payload, prompt_tokens, completion_tokens
+
+
+class MockBatchStore:
+    # Minimal /v1/files and /v1/batches: batches finish batch_seconds after creation
+    def __init__(self, config, stats):
+        self.config = config
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.files = {}
+        self.batches = {}
+
+    def add_file(self, content, filename, purpose):
+        with self.lock:
+            file_id = f"file-mock-{len(self.files) + 1}"
+            self.files[file_id] = {
+                'id': file_id,
+                'object': 'file',
+                'bytes': len(content),
+                'created_at': int(time.time()),
+                'filename': filename,
+                'purpose': purpose,
+                'status': 'processed',
+                'content': content,
+            }
+            return self.file_info(file_id)
+
+    def file_info(self, file_id):
+        return {name: value for name, value in self.files[file_id].items() if name != 'content'}
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        with self.lock:
+            lines = [line for line in self.files[input_file_id]['content'].decode('utf-8').splitlines() if line.strip()]
+            batch_id = f"batch-mock-{len(self.batches) + 1}"
+            self.batches[batch_id] = {
+                'id': batch_id,
+                'object': 'batch',
+                'endpoint': endpoint,
+                'input_file_id': input_file_id,
+                'completion_window': completion_window,
+                'status': 'validating',
+                'created_at': int(time.time()),
+                'created': time.monotonic(),
+                'output_file_id': None,
+                'error_file_id': None,
+                'request_counts': {'total': len(lines), 'completed': 0, 'failed': 0},
+            }
+        return self.batch_info(batch_id)
+
+    def batch_info(self, batch_id):
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch['status'] in ('validating', 'in_progress'):
+                if time.monotonic() - batch['created'] >= self.config.batch_seconds:
+                    self.complete(batch)
+                else:
+                    batch['status'] = 'in_progress'
+            return {name: value for name, value in batch.items() if name != 'created'}
+
+    def cancel_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch['status'] in ('validating', 'in_progress'):
+                batch['status'] = 'cancelled'
+        return self.batch_info(batch_id)
+
+    def complete(self, batch):
+        outputs = []
+        errors = []
+        lines = self.files[batch['input_file_id']]['content'].decode('utf-8').splitlines()
+        for number, line in enumerate(filter(str.strip, lines)):
+            request = json.loads(line)
+            result = {'id': f"batch_req_{number}", 'custom_id': request['custom_id'], 'error': None}
+            if self.config.should_throttle():
+                result['response'] = {'status_code': 500, 'body': {'error': {'message': "Internal error (mock)"}}}
+                errors.append(result)
+                continue
+            payload, prompt_tokens, completion_tokens = build_completion(
+                request['body'], self.config.labels, f"chatcmpl-mock-batch-{number}", chatty_rate=self.config.chatty_rate
+            )
+            self.stats.add(batch_requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            result['response'] = {'status_code': 200, 'request_id': f"req_{number}", 'body': payload}
+            outputs.append(result)
+        for kind, results in (('output_file_id', outputs), ('error_file_id', errors)):
+            if results:
+                content = ''.join(json.dumps(result) + '\n' for result in results).encode('utf-8')
+                file_id = f"file-mock-{len(self.files) + 1}"
+                self.files[file_id] = {
+                    'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                    'filename': f"{batch['id']}_{kind}.jsonl", 'purpose': 'batch_output', 'status': 'processed',
+                    'content': content,
+                }
+                batch[kind] = file_id
+        batch['status'] = 'completed'
+        batch['request_counts'] = {'total': len(outputs) + len(errors), 'completed': len(outputs), 'failed': len(errors)}
+
+
+def parse_multipart(content_type, body):
+    # Returns {field name: (filename, bytes)} for a multipart/form-data upload
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def read_json(self):
+        return json.loads(self.read_body() or b'{}')
+
+    def send_not_found(self):
+        self.send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        store = self.server.batch_store
+        parts = path.split('/')
+        if path.endswith('/stats'):
+            self.send_json(200, self.server.stats.as_dict())
+        elif len(parts) >= 2 and parts[-2] == 'batches' and parts[-1] in store.batches:
+            self.send_json(200, store.batch_info(parts[-1]))
+        elif len(parts) >= 3 and parts[-1] == 'content' and parts[-2] in store.files:
+            content = store.files[parts[-2]]['content']
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        elif len(parts) >= 2 and parts[-2] == 'files' and parts[-1] in store.files:
+            self.send_json(200, store.file_info(parts[-1]))
+        else:
+            self.send_not_found()
+
+    def do_POST(self):
+        path = self.path.split('?')[0].rstrip('/')
+        store = self.server.batch_store
+        parts = path.split('/')
+        if path.endswith('/files'):
+            fields = parse_multipart(self.headers.get('Content-Type', ''), self.read_body())
+            filename, content = fields['file']
+            purpose = fields.get('purpose', (None, b'batch'))[1].decode('utf-8')
+            self.send_json(200, store.add_file(content, filename or 'upload.jsonl', purpose))
+            return
+        if path.endswith('/batches'):
+            body = self.read_json()
+            if body.get('input_file_id') not in store.files:
+                self.send_json(400, {'error': {'message': "Unknown input_file_id"}})
+                return
+            self.send_json(200, store.create_batch(body['input_file_id'], body.get('endpoint'), body.get('completion_window')))
+            return
+        if len(parts) >= 3 and parts[-1] == 'cancel' and parts[-2] in store.batches:
+            self.read_body()
+            self.send_json(200, store.cancel_batch(parts[-2]))
+            return
+        if not path.endswith('/chat/completions'):
+            self.send_not_found()
+            return
+        config = self.server.config
+        body = self.read_json()
+        time.sleep(config.sample_latency())
+
+        if config.in_outage():
+            self.server.stats.add(requests=1, failed=1)
+            self.send_json(503, {'error': {'message': "Service unavailable (mock outage)", 'type': 'server_error'}})
+            return
+        if is_invalid(body, config.invalid_rate):
+            self.server.stats.add(requests=1, failed=1)
+            self.send_json(400, {'error': {'message': "Invalid request (mock)", 'type': 'invalid_request_error'}})
+            return
+
+        if config.should_throttle():
+            self.server.stats.add(requests=1, throttled=1)
+            self.send_json(429, {'error': {'message': "Rate limit reached (mock)", 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                           {'retry-after': config.retry_after, 'x-ratelimit-remaining-requests': 0})
+            return
+
+        cached_tokens = self.server.prefix_cache.cached_tokens(body)
+        payload, prompt_tokens, completion_tokens = build_completion(
+            body, config.labels, f"chatcmpl-mock-{self.server.stats.requests + 1}", cached_tokens, config.chatty_rate
+        )
+        self.server.stats.add(requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                              cached_tokens=cached_tokens)
+        self.send_json(200, payload, {
+            'x-ratelimit-limit-requests': config.requests_per_minute,
+            'x-ratelimit-limit-tokens': config.tokens_per_minute,
+        })
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, config):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.stats = MockStats()
+        self.batch_store = MockBatchStore(config, self.stats)
+        self.prefix_cache = MockPrefixCache()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_mock_server(config=None, host='127.0.0.1', port=0):
+    return MockServer((host, port), config or MockConfig()).start()
+
+
+def serve_in_child(ready, host, port, config_options):
+    server = MockServer((host, port), MockConfig(**config_options))
+    ready.put(server.base_url)
+    server.serve_forever()
+
+
+def spawn_mock_server(host='127.0.0.1', port=0, **config_options):
+    # A separate process keeps the server off the client's GIL, so benchmarks measure the client only
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_in_child, args=(ready, host, port, config_options), daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def fetch_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline stand-in for the OpenAI chat completions API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency-ms', type=float, default=200.0, help="Median response latency")
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help="Log-normal spread, 0 for fixed latency")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Share of requests answered with 429 (or failed, in batch jobs)")
+    parser.add_argument('--batch-seconds', type=float, default=2.0, help="Time until a batch job completes")
+    parser.add_argument('--rpm', type=int, default=1_000_000, help="Requests-per-minute limit advertised in headers")
+    parser.add_argument('--tpm', type=int, default=1_000_000_000, help="Tokens-per-minute limit advertised in headers")
+    parser.add_argument('--labels', default=','.join(DEFAULT_LABELS), help="Comma-separated answers to choose from")
+    parser.add_argument('--chatty-rate', type=float, default=0.0,
+                        help="Share of replies without a response format that wrap the label in a sentence")
+    parser.add_argument('--outage-after', type=float, default=None,
+                        help="Seconds after start when every request starts failing with 503")
+    parser.add_argument('--outage-seconds', type=float, default=30.0, help="Length of the --outage-after outage")
+    parser.add_argument('--invalid-rate', type=float, default=0.0,
+                        help="Share of prompts always rejected with 400, as a permanent failure")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        batch_seconds=args.batch_seconds,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        labels=[label.strip() for label in args.labels.split(',')],
+        chatty_rate=args.chatty_rate,
+        outage_after=args.outage_after,
+        outage_seconds=args.outage_seconds,
+        invalid_rate=args.invalid_rate,
+    )
+    server = MockServer((args.host, args.port), config)
+    print(f"Mock OpenAI API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import math
+import time
+import asyncio
+import statistics
+from prompts import SplitPrompt, build_messages
+from ratelimit import estimate_tokens
+from telemetry import estimate_cost
+from batching import BATCH_FORMAT_INSTRUCTIONS
+from batchapi import BATCH_PRICE_RATIO, BATCH_COMPLETION_WINDOW
+from engine import CascadeClient, cache_put
+
+# Prompts sent to measure reply length and latency when sampling is asked for (--plan-sample, the GUI estimate)
+PLAN_SAMPLE_ROWS = 20
+# Rows per request the plan suggests when micro-batching is off
+PLAN_BATCH_SIZE = 10
+# Used when nothing could be sampled
+PLAN_DEFAULT_OUTPUT_TOKENS = 16
+PLAN_DEFAULT_LATENCY_SECONDS = 1.0
+# Decoding time added to a request per extra output token, for micro-batched replies
+SECONDS_PER_OUTPUT_TOKEN = 0.01
+# Per-message framing and the per-item '"12": "...", ' of a micro-batched JSON reply
+MESSAGE_OVERHEAD_TOKENS = 4
+BATCH_ITEM_OVERHEAD_TOKENS = 6
+# OpenAI caches a repeated prefix of 1024+ tokens in 128-token steps
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+PLAN_LISTED_ROWS = 10
+
+
+def load_encoder(model_name):
+    # tiktoken counts exactly when installed; otherwise the limiter's four-characters-per-token estimate is used
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+
+class TokenCounter:
+    def __init__(self, model_name):
+        self.encoder = load_encoder(model_name)
+        self.prefixes = {}
+
+    @property
+    def exact(self):
+        return self.encoder is not None
+
+    def count(self, text):
+        if self.encoder is None:
+            return estimate_tokens(text)
+        return len(self.encoder.encode(text, disallowed_special=()))
+
+    def prefix_tokens(self, prompt):
+        # Shared prefixes repeat on every row, so each distinct one is counted once
+        if not isinstance(prompt, SplitPrompt):
+            return 0
+        if prompt.prefix not in self.prefixes:
+            self.prefixes[prompt.prefix] = self.count(prompt.prefix)
+        return self.prefixes[prompt.prefix]
+
+    def suffix_tokens(self, prompt):
+        return self.count(prompt.suffix if isinstance(prompt, SplitPrompt) else prompt)
+
+    def prompt_tokens(self, prompt):
+        messages = len(build_messages(prompt))
+        return self.prefix_tokens(prompt) + self.suffix_tokens(prompt) + messages * MESSAGE_OVERHEAD_TOKENS
+
+
+def cached_prefix_tokens(prefix_tokens):
+    if prefix_tokens < PROMPT_CACHE_MIN_TOKENS:
+        return 0
+    return prefix_tokens // PROMPT_CACHE_INCREMENT * PROMPT_CACHE_INCREMENT
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m {int(seconds % 60)}s"
+    return f"{int(seconds // 3600)}h {int(seconds % 3600 // 60)}m"
+
+
+def predict_seconds(requests, latency, tokens_per_request, concurrency, requests_per_minute, tokens_per_minute):
+    # Returns (seconds, limit): the slowest of the concurrency, request-rate and token-rate bounds
+    bounds = {
+        'concurrency': requests * latency / concurrency,
+        'requests per minute': requests / requests_per_minute * 60,
+        'tokens per minute': requests * tokens_per_request / tokens_per_minute * 60,
+    }
+    limit = max(bounds, key=bounds.get)
+    return bounds[limit], limit
+
+
+async def sample_replies(api_client, prompts):
+    # Returns [(reply, seconds, escalated)]; the replies are cached, so the run does not pay for them again
+    cascade = isinstance(api_client, CascadeClient)
+
+    async def timed(prompt):
+        started = time.perf_counter()
+        if not cascade:
+            reply = await api_client.get_response(prompt)
+            return reply, time.perf_counter() - started, False
+        # Asked through the primary model directly, so the cascade's row and escalation counters only count the
+        # run. Replies the cascade would accept are cached as its answer; escalated rows are left to the run.
+        reply, confidence = await api_client.primary.get_scored_response(prompt, logprobs=True)
+        seconds = time.perf_counter() - started
+        escalated = api_client.escalation_reason(reply, confidence) is not None
+        if not escalated:
+            cache_put(api_client.cache, api_client.cache_key(prompt), reply)
+        return reply, seconds, escalated
+
+    try:
+        return await asyncio.gather(*(timed(prompt) for prompt in prompts))
+    finally:
+        await api_client.close()
+
+
+class RunPlan:
+    def __init__(self, model_name, rows, unique, cached, local, truncated, exact_tokens, reused=0):
+        self.model_name = model_name
+        self.rows = rows
+        self.unique = unique
+        self.cached = cached
+        self.local = local
+        self.reused = reused
+        self.truncated = truncated
+        self.exact_tokens = exact_tokens
+        self.sampled = 0
+        # A micro-batched run only reuses cached replies to whole batches, so per-row cache hits are not counted
+        self.micro_batched = False
+        # Why sampling was asked for but not done
+        self.sample_skipped = None
+        self.output_tokens = PLAN_DEFAULT_OUTPUT_TOKENS
+        self.latency = PLAN_DEFAULT_LATENCY_SECONDS
+        self.escalated_share = None
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+        # One dict per execution mode: name, requests, prompt_tokens, completion_tokens, cost, seconds, limit
+        self.modes = []
+
+    def add_mode(self, name, requests, prompt_tokens, completion_tokens, cost, seconds=None, limit=None):
+        self.modes.append({
+            'name': name, 'requests': requests, 'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens, 'cost': cost, 'seconds': seconds, 'limit': limit
+        })
+
+    def fastest(self):
+        timed = [mode for mode in self.modes if mode['seconds'] is not None]
+        return min(timed, key=lambda mode: mode['seconds']) if timed else None
+
+    def cheapest(self):
+        priced = [mode for mode in self.modes if mode['cost'] is not None]
+        return min(priced, key=lambda mode: mode['cost']) if priced else None
+
+    def text(self):
+        to_send = self.unique - self.cached
+        lines = [f"Plan for {self.rows} rows with {self.model_name}: {self.unique} unique prompts, "
+                 f"{self.cached} already cached, {to_send} to send"]
+        if self.micro_batched:
+            lines.append("Cache: not counted, a micro-batched run looks up whole batches, not replies cached per row")
+        if self.local:
+            lines.append(f"Resolved locally without a request: {self.local} rows")
+        if self.reused:
+            lines.append(f"Reused from the previous output: {self.reused} unchanged rows")
+        counted = "counted with tiktoken" if self.exact_tokens else "estimated at 4 characters per token"
+        if to_send:
+            lines.append(
+                f"Input: ~{self.input_tokens // to_send} tokens per prompt, {self.input_tokens} in total ({counted})"
+            )
+        if self.cached_input_tokens:
+            lines.append(f"Shared prefix: ~{self.cached_input_tokens} input tokens expected from the provider's prompt cache")
+        if self.sampled:
+            source = f"measured on {self.sampled} sampled requests"
+        else:
+            source = f"assumed, {self.sample_skipped or 'nothing was sampled'}"
+        lines.append(f"Output: ~{self.output_tokens} tokens per reply, latency {self.latency:.2f} s ({source})")
+        if self.escalated_share is not None:
+            lines.append(f"Cascade: {self.escalated_share:.0%} of the sampled rows were escalated")
+        if self.truncated:
+            listed = ', '.join(str(row) for row in self.truncated[:PLAN_LISTED_ROWS])
+            more = f" and {len(self.truncated) - PLAN_LISTED_ROWS} more" if len(self.truncated) > PLAN_LISTED_ROWS else ''
+            lines.append(f"Cut off at MAX_INPUT_TOKENS: {len(self.truncated)} rows ({listed}{more})")
+        for mode in self.modes:
+            cost = f"${mode['cost']:.4f}" if mode['cost'] is not None else "cost unknown"
+            if mode['seconds'] is None:
+                duration = f"results within {BATCH_COMPLETION_WINDOW}"
+            else:
+                duration = f"~{format_duration(mode['seconds'])} (limited by {mode['limit']})"
+            lines.append(f"{mode['name']}: {mode['requests']} requests, {cost}, {duration}")
+        fastest = self.fastest()
+        cheapest = self.cheapest()
+        if fastest is not None and cheapest is not None and len(self.modes) > 1:
+            lines.append(f"Fastest: {fastest['name']}; cheapest: {cheapest['name']}")
+        return '\n'.join(lines)
+
+
+def plan_run(engine, prompt_set, sample_rows=0):
+    # Predicts tokens, cost and wall time of a prepared prompt set without running it. With sample_rows, up to
+    # that many uncached prompts are sent to measure reply length and latency. Sampling needs the response
+    # cache, which keeps the sampled replies for the run; without it the plan stays offline.
+    api_client = engine.api_client
+    cascade = isinstance(api_client, CascadeClient)
+    primary = api_client.primary if cascade else api_client
+    counter = TokenCounter(primary.model_name)
+
+    # Mirrors AsyncRequestEngine.run_async: micro-batched runs look up and store only the key of each batch prompt
+    micro_batched = engine.batch_size > 1 and prompt_set.batch_items is not None
+    unique = list(dict.fromkeys(prompt_set.prompts))
+    cache = api_client.cache
+    if cache is not None and not api_client.bypass_cache and not micro_batched:
+        # A cascade adds its own options to the key; a single model keys on its label constraints
+        options = {} if cascade else api_client.request_options()
+        to_send = [prompt for prompt in unique if not cache.contains(api_client.cache_key(prompt, options))]
+    else:
+        to_send = unique
+    truncated = [int(prompt_set.row_ids[position]) for position in prompt_set.truncated]
+    plan = RunPlan(
+        api_client.model_name, prompt_set.total, len(unique), len(unique) - len(to_send),
+        len(prompt_set.local_results), truncated, counter.exact, len(prompt_set.reused)
+    )
+    plan.micro_batched = micro_batched
+
+    if sample_rows and to_send and (cache is None or api_client.bypass_cache):
+        plan.sample_skipped = "not sampled without the response cache, which would keep the replies for the run"
+    elif sample_rows and to_send and micro_batched:
+        plan.sample_skipped = "not sampled, a micro-batched run would send the sampled rows again"
+    elif sample_rows and to_send:
+        step = max(1, len(to_send) // sample_rows)
+        sample = to_send[::step][:sample_rows]
+        coroutine = sample_replies(api_client, sample)
+        if engine.session is not None:
+            replies = engine.session.run(coroutine)
+        else:
+            replies = asyncio.run(coroutine)
+        answered = [(reply, seconds) for reply, seconds, _ in replies if not reply.startswith('Error')]
+        if answered:
+            plan.sampled = len(answered)
+            plan.output_tokens = max(1, round(statistics.mean(counter.count(reply) for reply, _ in answered)))
+            plan.latency = statistics.median(seconds for _, seconds in answered)
+        if cascade:
+            plan.escalated_share = sum(escalated for _, _, escalated in replies) / len(sample)
+        # Sampled replies are cached now, so the run will not send them again
+        done = {
+            prompt for prompt, (reply, _, escalated) in zip(sample, replies)
+            if not reply.startswith('Error') and not escalated
+        }
+        to_send = [prompt for prompt in to_send if prompt not in done]
+        plan.cached += len(done)
+
+    limiter = primary.limiter
+    requests_per_minute = limiter.requests.capacity if limiter is not None else math.inf
+    tokens_per_minute = limiter.tokens.capacity if limiter is not None else math.inf
+    requests = len(to_send)
+    if not requests:
+        plan.add_mode("Live", 0, 0, 0, 0.0, 0.0, 'nothing to send')
+        return plan
+
+    seen_prefixes = set()
+    for prompt in to_send:
+        plan.input_tokens += counter.prompt_tokens(prompt)
+        if isinstance(prompt, SplitPrompt):
+            # The first request with a prefix writes it to the provider's cache, later ones read it
+            if prompt.prefix in seen_prefixes:
+                plan.cached_input_tokens += cached_prefix_tokens(counter.prefix_tokens(prompt))
+            seen_prefixes.add(prompt.prefix)
+    output_tokens = requests * plan.output_tokens
+
+    def cost(prompt_tokens, completion_tokens, cached_tokens):
+        if not cascade:
+            return estimate_cost(primary.model_name, prompt_tokens, completion_tokens, cached_tokens)
+        # Every row goes to the primary model, the escalated share again to the fallback model
+        primary_cost = estimate_cost(primary.model_name, prompt_tokens, completion_tokens, cached_tokens)
+        fallback_cost = estimate_cost(api_client.fallback.model_name, prompt_tokens, completion_tokens, cached_tokens)
+        if primary_cost is None or fallback_cost is None:
+            return None
+        return primary_cost + (plan.escalated_share or 0.0) * fallback_cost
+
+    live_seconds, live_limit = predict_seconds(
+        requests, plan.latency, (plan.input_tokens + output_tokens) / requests,
+        engine.concurrency, requests_per_minute, tokens_per_minute
+    )
+    plan.add_mode(
+        "Live, 1 row per request", requests, plan.input_tokens, output_tokens,
+        cost(plan.input_tokens, output_tokens, plan.cached_input_tokens), live_seconds, live_limit
+    )
+    if cascade:
+        # A cascade scores each reply on its own, so it has no micro-batched or Batch API variant
+        return plan
+
+    # Micro-batching sends the instructions once per request and lists the rows under them
+    batch_size = engine.batch_size if engine.batch_size > 1 else PLAN_BATCH_SIZE
+    batch_requests = math.ceil(requests / batch_size)
+    # The same instructions and numbered items dispatch_batched sends. Template prompts prepared without
+    # micro-batching have no items, so their whole prompts stand in, which overstates the input by the template text.
+    batch_prefix_tokens = counter.count(f"{prompt_set.batch_instructions}\n\n{BATCH_FORMAT_INSTRUCTIONS}")
+    if prompt_set.batch_items is not None:
+        item_of = {}
+        for prompt, item in zip(prompt_set.prompts, prompt_set.batch_items):
+            item_of.setdefault(prompt, item)
+        item_tokens = sum(counter.count(item_of[prompt]) + 2 for prompt in to_send)
+    else:
+        item_tokens = sum(counter.suffix_tokens(prompt) + 2 for prompt in to_send)
+    batch_input = batch_requests * (batch_prefix_tokens + 2 * MESSAGE_OVERHEAD_TOKENS) + item_tokens
+    batch_output = requests * (plan.output_tokens + BATCH_ITEM_OVERHEAD_TOKENS)
+    reply_tokens = batch_output / batch_requests
+    batch_latency = plan.latency + max(0.0, reply_tokens - plan.output_tokens) * SECONDS_PER_OUTPUT_TOKEN
+    batch_seconds, batch_limit = predict_seconds(
+        batch_requests, batch_latency, (batch_input + batch_output) / batch_requests,
+        engine.concurrency, requests_per_minute, tokens_per_minute
+    )
+    batch_cached = (batch_requests - 1) * cached_prefix_tokens(batch_prefix_tokens)
+    plan.add_mode(
+        f"Micro-batched, {batch_size} rows per request", batch_requests, batch_input, batch_output,
+        cost(batch_input, batch_output, batch_cached), batch_seconds, batch_limit
+    )
+
+    live_cost = cost(plan.input_tokens, output_tokens, 0)
+    plan.add_mode(
+        "Batch API", requests, plan.input_tokens, output_tokens,
+        live_cost * BATCH_PRICE_RATIO if live_cost is not None else None
+    )
+    return plan
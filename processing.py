@@ -0,0 +1,732 @@
+import os
+import glob
+import string
+import logging
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from cache import ResponseCache, CACHE_PATH
+from matching import NameIndex, extract_local_replies
+from ratelimit import RateLimiter, CircuitBreaker, RetryBudget, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+from engine import (
+    OpenAIAPIClient, CascadeClient, AsyncRequestEngine, MAX_CONCURRENT_REQUESTS, CASCADE_MIN_CONFIDENCE,
+    ERROR_PERMANENT, error_kind
+)
+from checkpoint import RunJournal, get_journal_path, run_fingerprint, run_resumable
+from streaming import (
+    iter_chunks, import_pyarrow, validate_output_path, read_header, ChunkWriter, STREAM_CHUNK_ROWS, READABLE_EXTENSIONS
+)
+from telemetry import Telemetry, get_metrics_path
+from prompts import split_prompts, is_shared_prefix
+from batchapi import BatchJob, get_batch_state_path, run_batch, BATCH_POLL_SECONDS
+from workqueue import WorkQueue, get_queue_path, unique_prompts, SHARD_ROWS
+
+MAX_INPUT_TOKENS = 2048
+
+ANALYSIS_MODES = ('template', 'row_analysis', 'column_analysis')
+OUTPUT_SUFFIX = '_analyzed'
+RESULTS_SUFFIX = '_results'
+RESULTS_ROW_COLUMN = 'row'
+CATEGORY_MAX_RATIO = 0.5
+# Files loaded and prepared at the same time in multi-file runs; their requests share one engine
+FILE_WORKERS = 3
+
+CONVERSIONS = {'s': str, 'r': repr, 'a': ascii}
+
+
+def render_column(series, format_spec='', conversion=None):
+    # Values are turned into text column by column; missing values become empty strings in every mode
+    missing = series.isna()
+    if format_spec or conversion:
+        convert = CONVERSIONS[conversion] if conversion else (lambda value: value)
+        values = series.astype(object).map(lambda value: format(convert(value), format_spec), na_action='ignore')
+    else:
+        values = series.astype(str)
+    return values.astype(object).where(~missing, '')
+
+
+def render_fields(df, columns):
+    # "Column: value" lines for each row
+    text = None
+    for col in columns:
+        line = f"{col}: " + render_column(df[col])
+        text = line if text is None else text + '\n' + line
+    return text if text is not None else pd.Series('', index=df.index, dtype=object)
+
+
+def truncate(texts):
+    return texts.str.slice(0, MAX_INPUT_TOKENS)
+
+
+def truncated_positions(texts):
+    # Positions of the texts truncate() cuts short
+    lengths = texts.str.len().to_numpy()
+    return [int(position) for position in (lengths > MAX_INPUT_TOKENS).nonzero()[0]]
+
+
+class PromptTemplate:
+    # The template is parsed once; prompts are then assembled for all rows at once
+    def __init__(self, template):
+        self.template = template
+        self.parts = []
+        try:
+            parsed = list(string.Formatter().parse(template))
+        except ValueError as e:
+            raise ValueError(f"Invalid template: {e}. Use double braces for literal {{ and }}.")
+        for literal, field, format_spec, conversion in parsed:
+            if field is not None and (field == '' or field.isdigit()):
+                raise ValueError("Placeholders must name a column, e.g. {Summary}.")
+            if field is not None and ('{' in (format_spec or '')):
+                raise ValueError(f"Nested placeholders are not supported: {{{field}:{format_spec}}}")
+            self.parts.append((literal, field, format_spec or '', conversion))
+
+    @property
+    def fields(self):
+        return list(dict.fromkeys(field for _, field, _, _ in self.parts if field is not None))
+
+    def validate(self, columns):
+        missing = [field for field in self.fields if field not in set(columns)]
+        if len(missing) == 1:
+            raise ValueError(f"Column '{missing[0]}' not found in the selected data.")
+        if missing:
+            names = ', '.join(f"'{field}'" for field in missing)
+            raise ValueError(f"Columns {names} not found in the selected data.")
+
+    @property
+    def prefix(self):
+        # The literal text before the first placeholder, up to its last line break, is the same for every row;
+        # a label such as "Summary: " right before the placeholder stays with the row's values
+        if self.parts and self.parts[0][1] is not None:
+            literal = self.parts[0][0]
+            return literal[:literal.rfind('\n') + 1]
+        return ''
+
+    def render(self, df, include_prefix=True):
+        prompts = pd.Series('', index=df.index, dtype=object)
+        skipped = 0 if include_prefix else len(self.prefix)
+        for position, (literal, field, format_spec, conversion) in enumerate(self.parts):
+            if position == 0:
+                literal = literal[skipped:]
+            if literal:
+                prompts = prompts + literal
+            if field is not None:
+                prompts = prompts + render_column(df[field], format_spec, conversion)
+        return prompts
+
+
+def validate_template(template, columns):
+    PromptTemplate(template).validate(columns)
+
+
+class DataProcessor:
+    def __init__(self, df):
+        self.df = df
+        self.truncated = []
+
+    def select_data(self, selected_columns):
+        if selected_columns:
+            return self.df[selected_columns]
+        return self.df
+
+    def prepare_prompts(self, instructions, selected_data):
+        # Placeholders are checked against the columns before any prompt is built
+        template = PromptTemplate(instructions)
+        template.validate(selected_data.columns)
+        # A long instruction block before the first placeholder becomes a shared prefix, and only the rest is
+        # truncated per row; otherwise each row's whole prompt is one message, as it always was
+        split = is_shared_prefix(template.prefix)
+        rendered = template.render(selected_data, include_prefix=not split)
+        self.truncated = truncated_positions(rendered)
+        prompts = truncate(rendered).tolist()
+        logging.debug(f"Prepared {len(prompts)} prompts for placeholders {template.fields}")
+        return split_prompts(template.prefix, prompts, separator='') if split else prompts
+
+    def prepare_batch_items(self, selected_data):
+        # One "Column: value" block per row, packed under a single copy of the template
+        return truncate(render_fields(selected_data, selected_data.columns)).tolist()
+
+    def prepare_batch_instructions(self, instructions):
+        return f"{instructions}\n\nPlaceholders in curly braces refer to the fields of the same name in each item."
+
+
+class PromptSet:
+    def __init__(self, total, prompts, positions, row_ids, batch_items=None, batch_instructions=None, local_results=None,
+                 truncated=None, reused=None, reused_row_ids=None):
+        self.total = total
+        self.prompts = prompts
+        self.positions = positions
+        self.row_ids = row_ids
+        self.batch_items = batch_items
+        self.batch_instructions = batch_instructions
+        self.local_results = local_results or {}
+        # Indexes into prompts whose row text was cut at MAX_INPUT_TOKENS characters
+        self.truncated = truncated or []
+        # {position: reply} carried over from a previous output for unchanged rows (see reuse_previous)
+        self.reused = reused or {}
+        # Input row ids of the reused rows, in row order, for the run report
+        self.reused_row_ids = reused_row_ids or []
+
+    def initial_results(self):
+        # Rows answered without a request: resolved locally or reused from a previous output
+        results = [None] * self.total
+        for answered in (self.local_results, self.reused):
+            for position, reply in answered.items():
+                results[position] = reply
+        return results
+
+
+def prepare_template_prompts(df, columns, template, batch_size=1):
+    # Template mode (appv2): {Column} placeholders are filled from each row
+    processor = DataProcessor(df)
+    selected_data = processor.select_data(columns)
+    prompts = processor.prepare_prompts(template, selected_data)
+    # The instructions are kept even without micro-batching, so a plan can price it; the items cost a pass over
+    # every row and are only built for a micro-batched run
+    batch_items = None
+    batch_instructions = processor.prepare_batch_instructions(template)
+    if batch_size > 1:
+        batch_items = processor.prepare_batch_items(selected_data)
+    return PromptSet(
+        len(df), prompts, list(range(len(df))), list(df.index), batch_items, batch_instructions,
+        truncated=processor.truncated
+    )
+
+
+def prepare_row_prompts(df, columns, instructions):
+    # Row mode (app.py): the selected values are listed under the instructions
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise ValueError(f"Column '{missing[0]}' not found in the selected data.")
+    rendered = render_fields(df, columns).str.strip()
+    input_texts = truncate(rendered)
+    prompts = split_prompts(instructions, input_texts.tolist())
+    return PromptSet(
+        len(df), prompts, list(range(len(df))), list(df.index), input_texts.tolist(), instructions,
+        truncated=truncated_positions(rendered)
+    )
+
+
+def prepare_column_prompts(df, columns, instructions):
+    # Column mode (app.py): names from the first column are looked up in the second
+    instructions, (match_reply, no_match_reply) = extract_local_replies(instructions)
+    names1 = render_column(df[columns[0]]).tolist()
+    names2 = render_column(df[columns[1]]).tolist()
+
+    # Index the second column so most names are matched without an API call
+    name_index = NameIndex(names2)
+
+    # Prepare input prompts with only the nearest candidates from names2
+    local_results = {}
+    input_items = []
+    prompt_rows = []
+    for idx, name1 in enumerate(names1):
+        local_reply, candidates = name_index.resolve(name1, match_reply, no_match_reply)
+        if local_reply is not None:
+            local_results[idx] = local_reply
+            continue
+        names2_list = ', '.join(candidates) or '(none)'
+        item = f"Name: {name1}\nList of names: {names2_list}"
+        input_items.append(item)
+        prompt_rows.append(idx)
+    row_ids = [df.index[idx] for idx in prompt_rows]
+    # The candidate lists differ per row, so only long instructions can be a shared prefix
+    return PromptSet(len(df), split_prompts(instructions, input_items), prompt_rows, row_ids, input_items, instructions, local_results)
+
+
+def prepare_prompt_set(df, columns, instructions, mode='template', batch_size=1, previous=None):
+    # previous is a load_previous_analysis map; rows unchanged since then are not sent again
+    if mode == 'row_analysis':
+        prompt_set = prepare_row_prompts(df, columns, instructions)
+    elif mode == 'column_analysis':
+        if len(columns) < 2:
+            raise ValueError("Column-wise analysis needs two columns.")
+        prompt_set = prepare_column_prompts(df, columns, instructions)
+    else:
+        prompt_set = prepare_template_prompts(df, columns, instructions, batch_size)
+    if previous:
+        prompt_set = reuse_previous(prompt_set, df, columns, previous, mode)
+    return prompt_set
+
+
+def row_hashes(df, columns, mode='template'):
+    # One 64-bit digest per row over the selected columns, as the text the prompts are built from
+    rendered = pd.DataFrame({col: render_column(df[col]) for col in columns}, index=df.index)
+    hashes = pd.util.hash_pandas_object(rendered, index=False)
+    if mode == 'column_analysis' and len(columns) > 1:
+        # Each prompt lists candidates from the whole second column, so any change there changes every row
+        candidates = pd.util.hash_pandas_object(rendered[columns[1]], index=False).sum()
+        hashes = hashes ^ candidates
+    return hashes
+
+
+def load_previous_analysis(previous_path, columns, mode='template'):
+    # {row hash: Analysis} from an earlier _analyzed output; rows that failed or were never answered are left out
+    missing = [column for column in list(columns) + ['Analysis'] if column not in read_header(previous_path)]
+    if missing:
+        raise ValueError(f"The previous output has no column {', '.join(missing)}. Select an earlier _analyzed file.")
+    previous = load_data_file(previous_path, list(columns) + ['Analysis'])
+    analysis = previous['Analysis'].astype(object)
+    answered = ~analysis.map(is_failed_reply).astype(bool)
+    return dict(zip(row_hashes(previous, columns, mode)[answered].tolist(), analysis[answered].tolist()))
+
+
+def reuse_previous(prompt_set, df, columns, previous, mode='template'):
+    # Returns a PromptSet without the prompts of rows whose selected columns are unchanged since the previous
+    # output; their earlier replies are carried over in reused
+    reused = {}
+    for position, digest in enumerate(row_hashes(df, columns, mode).tolist()):
+        if digest in previous and position not in prompt_set.local_results:
+            reused[position] = previous[digest]
+    if not reused:
+        return prompt_set
+    keep = [idx for idx, position in enumerate(prompt_set.positions) if position not in reused]
+    index_of = {idx: new_idx for new_idx, idx in enumerate(keep)}
+    return PromptSet(
+        prompt_set.total,
+        [prompt_set.prompts[idx] for idx in keep],
+        [prompt_set.positions[idx] for idx in keep],
+        [prompt_set.row_ids[idx] for idx in keep],
+        [prompt_set.batch_items[idx] for idx in keep] if prompt_set.batch_items is not None else None,
+        prompt_set.batch_instructions,
+        prompt_set.local_results,
+        [index_of[idx] for idx in prompt_set.truncated if idx in index_of],
+        reused,
+        [int(df.index[position]) for position in sorted(reused)]
+    )
+
+
+def build_engine(model_name, api_key=None, concurrency=MAX_CONCURRENT_REQUESTS, batch_size=1,
+                 requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 use_cache=True, bypass_cache=False, client=None, base_url=None, request_log_path=None,
+                 fallback_model=None, min_confidence=CASCADE_MIN_CONFIDENCE, labels=(), session=None,
+                 cache_path=CACHE_PATH):
+    # With labels, replies are held to those answers (see OpenAIAPIClient.request_options)
+    # With fallback_model set, model_name answers first and uncertain rows are escalated (see CascadeClient)
+    # With a ClientSession, requests share its long-lived connection pool across runs
+    if session is not None and client is None:
+        client = session.open_client()
+    cache = ResponseCache(cache_path) if use_cache else None
+    run_model_name = f"{model_name}>{fallback_model}" if fallback_model else model_name
+    telemetry = Telemetry(run_model_name, request_log_path)
+    breaker = CircuitBreaker()
+    retry_budget = RetryBudget()
+
+    def make_client(name, client_cache):
+        # Each model gets its own limiter, since OpenAI's rate limits are per model
+        limiter = RateLimiter(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            max_concurrency=concurrency
+        )
+        return OpenAIAPIClient(
+            name,
+            api_key=api_key,
+            client=client,
+            cache=client_cache,
+            bypass_cache=bypass_cache,
+            limiter=limiter,
+            base_url=base_url,
+            telemetry=telemetry,
+            labels=labels,
+            breaker=breaker,
+            retry_budget=retry_budget
+        )
+
+    if not fallback_model:
+        return AsyncRequestEngine(
+            make_client(model_name, cache), concurrency=concurrency, batch_size=batch_size, session=session
+        )
+    if batch_size > 1:
+        # Confidence is scored per reply, so a cascade sends one row per request
+        logging.info("Micro-batching is disabled in cascade mode")
+    # The primary model is always asked with logprobs, so its replies are not cached on their own
+    api_client = CascadeClient(
+        make_client(model_name, None),
+        make_client(fallback_model, cache),
+        min_confidence=min_confidence,
+        labels=labels,
+        cache=cache,
+        bypass_cache=bypass_cache
+    )
+    return AsyncRequestEngine(api_client, concurrency=concurrency, batch_size=1, session=session)
+
+
+def open_journal(file_path, model_name, instructions, columns, mode='', confirm_resume=None):
+    # confirm_resume(rows) decides whether a matching journal is resumed or started over
+    journal = RunJournal(get_journal_path(file_path), run_fingerprint(file_path, model_name, instructions, columns, mode))
+    resumable = journal.load()
+    resume = resumable > 0 and (confirm_resume is None or confirm_resume(resumable))
+    journal.open(resume)
+    return journal
+
+
+def count_answered(engine, prompt_set):
+    if prompt_set.local_results:
+        engine.count('resolved_locally', len(prompt_set.local_results))
+    if prompt_set.reused:
+        engine.count('reused_rows', len(prompt_set.reused))
+        engine.list_rows('reused_row_ids', prompt_set.reused_row_ids)
+
+
+def run_prompt_set(engine, prompt_set, journal, progress_callback=None):
+    results = prompt_set.initial_results()
+    count_answered(engine, prompt_set)
+    responses = run_resumable(
+        engine,
+        journal,
+        prompt_set.prompts,
+        row_ids=prompt_set.row_ids,
+        progress_callback=progress_callback,
+        batch_items=prompt_set.batch_items,
+        batch_instructions=prompt_set.batch_instructions
+    )
+    for position, reply in zip(prompt_set.positions, responses):
+        results[position] = reply
+    return results
+
+
+def open_batch_job(file_path, engine, instructions, columns, mode='', confirm_resume=None,
+                   poll_seconds=BATCH_POLL_SECONDS):
+    # confirm_resume(batches) decides whether batches from an earlier run are collected or submitted again
+    if isinstance(engine.api_client, CascadeClient):
+        raise ValueError("The Batch API cannot be combined with a model cascade")
+    fingerprint = run_fingerprint(file_path, engine.api_client.model_name, instructions, columns, f"batch:{mode}")
+    job = BatchJob(engine.api_client, get_batch_state_path(file_path), fingerprint, poll_seconds, engine.cancel_event)
+    submitted = job.load()
+    if submitted and confirm_resume is not None and not confirm_resume(submitted):
+        job.discard()
+    return job
+
+
+def run_prompt_set_batch(engine, prompt_set, job, progress_callback=None, status_callback=None):
+    # Batch API counterpart of run_prompt_set; micro-batching does not apply, every prompt is its own request
+    results = prompt_set.initial_results()
+    count_answered(engine, prompt_set)
+    responses = run_batch(engine, job, prompt_set.prompts, progress_callback, status_callback, prompt_set.row_ids)
+    for position, reply in zip(prompt_set.positions, responses):
+        results[position] = reply
+    return results
+
+
+def open_work_queue(file_path, prompt_set, settings, instructions, columns, mode='', shard_rows=SHARD_ROWS,
+                    resume=True):
+    # Coordinator side of a sharded run: the unique prompts go into <input>.queue.sqlite for workers to lease.
+    # settings holds the model options every worker must share: model, fallback_model, min_confidence, labels
+    # and batch_size. A queue left by the same run is kept, so a rerun only waits for its open shards.
+    model_name = settings['model']
+    if settings.get('fallback_model'):
+        model_name = f"{model_name}>{settings['fallback_model']}"
+    # The prompt count also tells an incremental run's queue apart from a full one
+    fingerprint = run_fingerprint(file_path, model_name, instructions, columns, f"shard:{mode}:{len(prompt_set.prompts)}")
+    queue = WorkQueue(get_queue_path(file_path))
+    if resume and queue.get_meta().get('fingerprint') == fingerprint:
+        logging.info(f"Resuming work queue {queue.path}")
+        return queue
+    prompts, batch_items, row_ids, _ = unique_prompts(prompt_set.prompts, prompt_set.batch_items, prompt_set.row_ids)
+    meta = dict(settings, fingerprint=fingerprint, batch_instructions=prompt_set.batch_instructions)
+    queue.fill(meta, prompts, batch_items, row_ids, shard_rows)
+    return queue
+
+
+def collect_queue_results(queue, prompt_set):
+    # Merges the replies of every shard back into the original row order
+    results = prompt_set.initial_results()
+    replies = queue.results()
+    _, _, _, prompt_map = unique_prompts(prompt_set.prompts)
+    for position, index in zip(prompt_set.positions, prompt_map):
+        results[position] = replies[index]
+    return results
+
+
+def export_telemetry(engine, summary_path=None, prometheus_path=None):
+    telemetry = engine.api_client.telemetry
+    if telemetry is None:
+        return
+    telemetry.close()
+    if summary_path:
+        telemetry.write_summary(summary_path)
+        logging.info(f"Wrote run metrics to {summary_path}")
+    if prometheus_path:
+        telemetry.write_prometheus(prometheus_path)
+
+
+def load_data_file(file_path, columns=None):
+    # With columns given only those are read, which is most of the load time and memory on wide sheets
+    file_ext = os.path.splitext(file_path)[1].lower()
+    usecols = list(columns) if columns else None
+    # Excel headers keep their cell values, and a list of numbers would be taken as column positions
+    excel_usecols = (lambda column: column in usecols) if usecols else None
+    if file_ext == '.xlsx':
+        df = pd.read_excel(file_path, engine='openpyxl', usecols=excel_usecols)
+    elif file_ext == '.xls':
+        df = pd.read_excel(file_path, engine='xlrd', usecols=excel_usecols)
+    elif file_ext == '.csv':
+        df = pd.read_csv(file_path, usecols=usecols)
+    elif file_ext == '.parquet':
+        import_pyarrow()
+        df = pd.read_parquet(file_path, columns=usecols)
+    elif file_ext == '.feather':
+        pa = import_pyarrow()
+        # Memory-mapped, so unselected columns are never read from disk
+        df = pa.feather.read_table(file_path, columns=usecols, memory_map=True).to_pandas()
+    elif file_ext == '.jsonl':
+        chunks = pd.read_json(file_path, lines=True, chunksize=STREAM_CHUNK_ROWS)
+        df = pd.concat([chunk.reindex(columns=usecols) if usecols else chunk for chunk in chunks])
+    else:
+        raise ValueError("Unsupported file format. Please select an Excel, CSV, Parquet, Feather or JSONL file.")
+    return compact_dtypes(df) if columns else df
+
+
+def compact_dtypes(df):
+    # Repeated strings become categoricals and integers the smallest type that holds them
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_integer_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            if len(series) and series.nunique(dropna=True) <= len(series) * CATEGORY_MAX_RATIO:
+                df[col] = series.astype('category')
+    return df
+
+
+def get_output_extension(file_path, output_format='same'):
+    if output_format and output_format != 'same':
+        return f".{output_format}"
+    ext = os.path.splitext(file_path)[1]
+    # Legacy .xls cannot be written by current pandas/openpyxl, so it becomes .xlsx
+    return '.xlsx' if ext.lower() == '.xls' else ext
+
+
+def get_output_path(file_path, output_format='same', suffix=OUTPUT_SUFFIX):
+    directory, filename = os.path.split(file_path)
+    name = os.path.splitext(filename)[0]
+    new_filename = f"{name}{suffix}{get_output_extension(file_path, output_format)}"
+    return os.path.join(directory, new_filename)
+
+
+def get_results_path(file_path, output_format='same'):
+    return get_output_path(file_path, output_format, RESULTS_SUFFIX)
+
+
+def results_frame(df):
+    # Results-only output: the input row id and the reply, joined back with join_results
+    return pd.DataFrame({RESULTS_ROW_COLUMN: df.index, 'Analysis': df['Analysis']})
+
+
+def write_output_file(df, output_path, results_only=False):
+    writer = ChunkWriter(output_path)
+    try:
+        writer.write(results_frame(df) if results_only else df)
+    finally:
+        writer.close()
+
+
+def save_analysis_output(file_path, df, output_path, results_only=False):
+    # df holds only the analyzed columns; the full sheet is re-read chunk by chunk to add the other columns
+    if results_only:
+        write_output_file(df, output_path, results_only=True)
+        return
+    writer = ChunkWriter(output_path)
+    try:
+        for chunk in iter_analyzed_chunks(file_path, df['Analysis']):
+            writer.write(chunk)
+    finally:
+        writer.close()
+
+
+def iter_analyzed_chunks(file_path, analysis, chunksize=STREAM_CHUNK_ROWS):
+    # analysis is indexed by row id, the same ids iter_chunks gives each chunk
+    for chunk in iter_chunks(file_path, chunksize):
+        chunk['Analysis'] = analysis.reindex(chunk.index).to_numpy()
+        yield chunk
+
+
+def join_results(file_path, results_path):
+    # Row ids in the results file are the input's row positions, as written by results_frame
+    results = load_data_file(results_path).set_index(RESULTS_ROW_COLUMN)
+    return load_data_file(file_path).join(results, how='left')
+
+
+def iter_joined_chunks(file_path, results_path, chunksize=STREAM_CHUNK_ROWS):
+    # The input is read in chunks, so only the small results file is held in memory
+    results = load_data_file(results_path).set_index(RESULTS_ROW_COLUMN)
+    yield from iter_analyzed_chunks(file_path, results['Analysis'], chunksize)
+
+
+def run_streaming(file_path, columns, instructions, engine, journal, output_path, mode='template',
+                  progress_callback=None, status_callback=None, results_only=False):
+    # Rows are read, analyzed and appended to the output one chunk at a time
+    if mode == 'column_analysis':
+        raise ValueError("Column-wise analysis needs the whole second column and cannot be streamed.")
+    if mode == 'template':
+        validate_template(instructions, columns)
+    writer = ChunkWriter(output_path)
+    try:
+        for chunk in iter_chunks(file_path):
+            if status_callback:
+                status_callback(f"Analyzing rows {writer.rows_written + 1}-{writer.rows_written + len(chunk)}...")
+            prompt_set = prepare_prompt_set(chunk, columns, instructions, mode, engine.batch_size)
+            chunk['Analysis'] = run_prompt_set(engine, prompt_set, journal, progress_callback)
+            writer.write(results_frame(chunk) if results_only else chunk)
+            logging.info(f"Wrote {writer.rows_written} analyzed rows to {output_path}")
+            if engine.cancelled:
+                break
+    finally:
+        writer.close()
+    return writer.rows_written
+
+
+def is_failed_reply(reply, retryable_only=False):
+    # Rows never answered (cancelled or lost) are empty; failed ones hold an "Error ..." reply
+    if reply is None or pd.isna(reply) or not str(reply).strip():
+        return True
+    kind = error_kind(str(reply))
+    return kind is not None and not (retryable_only and kind == ERROR_PERMANENT)
+
+
+def rewrite_analysis(file_path, analysis):
+    # The file is read chunk by chunk while the new one is written, so it is written next to it and swapped in
+    root, file_ext = os.path.splitext(file_path)
+    temp_path = f"{root}.rerun{file_ext}"
+    writer = ChunkWriter(temp_path)
+    try:
+        for chunk in iter_analyzed_chunks(file_path, analysis):
+            writer.write(chunk)
+    except BaseException:
+        writer.close()
+        os.remove(temp_path)
+        raise
+    writer.close()
+    os.replace(temp_path, file_path)
+
+
+def rerun_errors(analyzed_path, columns, instructions, engine, mode='template', retryable_only=False,
+                 progress_callback=None):
+    # Re-sends only the rows of an _analyzed file whose Analysis is empty or an error, and rewrites the file in
+    # place. Returns (rows re-sent, rows still failing).
+    if mode == 'template':
+        validate_template(instructions, columns)
+    if 'Analysis' not in read_header(analyzed_path):
+        raise ValueError("Re-running errors needs an _analyzed file with its input columns and an Analysis column.")
+    df = load_data_file(analyzed_path, list(columns) + ['Analysis'])
+    analysis = df.pop('Analysis').astype(object).tolist()
+    failed = {position for position, reply in enumerate(analysis) if is_failed_reply(reply, retryable_only)}
+    if not failed:
+        return 0, 0
+    # Prompts are built for every row, since column mode matches against the whole second column
+    prompt_set = prepare_prompt_set(df, columns, instructions, mode, engine.batch_size)
+    for position, reply in prompt_set.local_results.items():
+        if position in failed:
+            analysis[position] = reply
+    selected = [idx for idx, position in enumerate(prompt_set.positions) if position in failed]
+    replies = engine.run(
+        [prompt_set.prompts[idx] for idx in selected],
+        progress_callback,
+        batch_items=[prompt_set.batch_items[idx] for idx in selected] if prompt_set.batch_items is not None else None,
+        batch_instructions=prompt_set.batch_instructions,
+        row_ids=[prompt_set.row_ids[idx] for idx in selected]
+    )
+    for idx, reply in zip(selected, replies):
+        # Rows left undispatched by a cancel keep their old error
+        if reply is not None:
+            analysis[prompt_set.positions[idx]] = reply
+    rewrite_analysis(analyzed_path, pd.Series(analysis, dtype=object))
+    return len(failed), sum(1 for position in failed if is_failed_reply(analysis[position]))
+
+
+def get_files_metrics_path(directory):
+    # A directory or glob run writes one metrics file for all its input files
+    return get_metrics_path(os.path.join(directory, 'analysis_run'))
+
+
+def list_input_files(path):
+    # A directory or a glob pattern; earlier outputs in the same folder are skipped
+    if os.path.isdir(path):
+        candidates = [os.path.join(path, name) for name in os.listdir(path)]
+    else:
+        candidates = glob.glob(path)
+    files = []
+    for candidate in candidates:
+        stem, file_ext = os.path.splitext(os.path.basename(candidate))
+        if (os.path.isfile(candidate) and file_ext.lower() in READABLE_EXTENSIONS
+                and not stem.endswith((OUTPUT_SUFFIX, RESULTS_SUFFIX))):
+            files.append(candidate)
+    # Largest first, so small files keep the connections busy while the big ones are still being dispatched
+    return sorted(files, key=os.path.getsize, reverse=True)
+
+
+def run_file(file_path, columns, instructions, engine, output_path, mode='template', results_only=False,
+             resume=True, progress_callback=None):
+    df = load_data_file(file_path, columns)
+    prompt_set = prepare_prompt_set(df, columns, instructions, mode, engine.batch_size)
+    journal_mode = '' if mode == 'template' else mode
+    journal = open_journal(
+        file_path, engine.api_client.model_name, instructions, columns, journal_mode, confirm_resume=lambda rows: resume
+    )
+    try:
+        df['Analysis'] = run_prompt_set(engine, prompt_set, journal, progress_callback)
+    finally:
+        journal.close()
+    save_analysis_output(file_path, df, output_path, results_only)
+    if not engine.cancelled:
+        journal.remove()
+    return len(df)
+
+
+def run_files(files, columns, instructions, engine, mode='template', output_format='same', results_only=False,
+              resume=True, progress_callback=None, status_callback=None, file_workers=FILE_WORKERS):
+    # Every file is dispatched through the same engine: one concurrency and rate budget, one response cache and
+    # one connection pool. Returns a list of {'file', 'output_path', 'rows', 'error'}, one per file.
+    if engine.session is None:
+        raise ValueError("Multi-file runs need an engine built with a ClientSession")
+    if mode == 'template':
+        validate_template(instructions, columns)
+    jobs = []
+    for file_path in files:
+        if results_only:
+            output_path = get_results_path(file_path, output_format)
+        else:
+            output_path = get_output_path(file_path, output_format)
+        validate_output_path(output_path)
+        jobs.append((file_path, output_path))
+
+    lock = threading.Lock()
+    progress = {}
+    finished = []
+
+    def track_progress(file_path):
+        def on_progress(completed, total):
+            with lock:
+                progress[file_path] = (completed, total)
+                completed_all = sum(done for done, _ in progress.values())
+                total_all = sum(count for _, count in progress.values())
+            if progress_callback:
+                progress_callback(completed_all, total_all)
+
+        return on_progress
+
+    def run_job(job):
+        file_path, output_path = job
+        result = {'file': file_path, 'output_path': None, 'rows': 0, 'error': None}
+        if engine.cancelled:
+            result['error'] = "Cancelled"
+            return result
+        try:
+            result['rows'] = run_file(
+                file_path, columns, instructions, engine, output_path, mode, results_only, resume,
+                track_progress(file_path)
+            )
+            result['output_path'] = output_path
+        except Exception as e:
+            # One bad file does not stop the others
+            logging.error(f"Failed to analyze {file_path}: {e}")
+            result['error'] = str(e)
+        with lock:
+            finished.append(file_path)
+            count = len(finished)
+        if status_callback:
+            status_callback(f"Finished {count} of {len(jobs)} files ({os.path.basename(file_path)})")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, file_workers)) as pool:
+        return list(pool.map(run_job, jobs))
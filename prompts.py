@@ -0,0 +1,30 @@
+from collections import namedtuple
+from ratelimit import estimate_tokens
+
+# A prompt whose prefix is identical for every row. The prefix goes first as its own system message, so the
+# provider's automatic prompt caching can reuse it; only the per-row suffix is new input on each request.
+SplitPrompt = namedtuple('SplitPrompt', ['prefix', 'suffix'])
+
+# The provider only caches prefixes of this many tokens or more
+PROMPT_PREFIX_MIN_TOKENS = 1024
+
+
+def is_shared_prefix(prefix):
+    # Only a complete instruction block (ending at a line break) that is long enough to be cached gets its own
+    # message; anything shorter would change how the model reads the prompt for no saving
+    return prefix.endswith('\n') and estimate_tokens(prefix.strip()) >= PROMPT_PREFIX_MIN_TOKENS
+
+
+def split_prompts(prefix, suffixes, separator='\n\n'):
+    # prefix + separator + suffix is the prompt as a single user message, which is what is sent unless
+    # the prefix is a shared instruction block
+    head = prefix + separator
+    if not is_shared_prefix(head):
+        return [head + suffix for suffix in suffixes]
+    return [SplitPrompt(prefix.rstrip(), suffix) for suffix in suffixes]
+
+
+def build_messages(prompt):
+    if isinstance(prompt, SplitPrompt):
+        return [{"role": "system", "content": prompt.prefix}, {"role": "user", "content": prompt.suffix}]
+    return [{"role": "user", "content": prompt}]
@@ -0,0 +1,262 @@
+import re
+import time
+import asyncio
+import logging
+
+DEFAULT_REQUESTS_PER_MINUTE = 5000
+DEFAULT_TOKENS_PER_MINUTE = 2_000_000
+THROTTLE_COOLDOWN_SECONDS = 2.0
+# Concurrency is halved only once this share of recent responses were 429s, so isolated 429s cost
+# nothing but their own retry
+THROTTLE_BACKOFF_SHARE = 0.15
+THROTTLE_SMOOTHING = 0.02
+LATENCY_BACKOFF_FACTOR = 3.0
+# Weight of each new latency in the running typical latency
+LATENCY_SMOOTHING = 0.05
+# Consecutive failed requests (connection errors, 5xx) that open the circuit and pause dispatch
+CIRCUIT_FAILURE_THRESHOLD = 10
+CIRCUIT_OPEN_SECONDS = 5.0
+CIRCUIT_MAX_OPEN_SECONDS = 120.0
+CIRCUIT_POLL_SECONDS = 0.5
+# Retries of failed requests may add this share of the requests sent, plus a small allowance
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_RETRIES = 20
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+def parse_reset_seconds(value):
+    # Reset headers look like "1s", "6m0s" or "120ms"
+    if not value:
+        return None
+    total = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", str(value)):
+        total += float(amount) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return total or None
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.capacity / 60.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self.refill()
+        # A request larger than the whole bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def resize(self, per_minute):
+        self.refill()
+        self.capacity = float(per_minute)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def sync_remaining(self, remaining):
+        self.refill()
+        self.tokens = min(self.tokens, float(remaining))
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_concurrency=200):
+        # The configured budgets are upper bounds; response headers can only lower them, so a share of the
+        # account's limit (e.g. a sharded run's local worker) stays within its share
+        self.requests_per_minute = float(requests_per_minute)
+        self.tokens_per_minute = float(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.last_throttle = 0.0
+        self.typical_latency = None
+        self.throttled = 0
+        self.throttle_share = 0.0
+        self._condition = None
+        self._loop = None
+
+    @property
+    def condition(self):
+        # Recreated per event loop, since each run may execute on a fresh loop
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+            self.in_flight = 0
+        return self._condition
+
+    async def acquire(self, estimated_tokens):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.concurrency_limit))
+            self.in_flight += 1
+        try:
+            while True:
+                delay = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        except BaseException:
+            await self.release()
+            raise
+        self.requests.take(1)
+        self.tokens.take(estimated_tokens)
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self, latency, headers=None):
+        if headers is not None:
+            self.apply_headers(headers)
+        self.throttle_share -= THROTTLE_SMOOTHING * self.throttle_share
+        # Compared with the running typical latency rather than the fastest reply seen, which a single
+        # lucky request would make unreachable for the rest of the run
+        if self.typical_latency is None:
+            self.typical_latency = latency
+        saturating = latency > self.typical_latency * LATENCY_BACKOFF_FACTOR
+        self.typical_latency += LATENCY_SMOOTHING * (latency - self.typical_latency)
+        # Additive increase, unless latency shows the service is already saturating
+        if not saturating:
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+
+    def on_throttled(self):
+        # Only the throttled request waits out its retry-after (see engine.retry_wait); the others carry on
+        self.throttled += 1
+        self.throttle_share += THROTTLE_SMOOTHING * (1.0 - self.throttle_share)
+        now = time.monotonic()
+        # Multiplicative decrease, once per burst of 429s
+        if self.throttle_share >= THROTTLE_BACKOFF_SHARE and now - self.last_throttle >= THROTTLE_COOLDOWN_SECONDS:
+            self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+            self.last_throttle = now
+            logging.info(f"Rate limited, concurrency lowered to {int(self.concurrency_limit)}")
+
+    def apply_headers(self, headers):
+        limit_requests = headers.get('x-ratelimit-limit-requests')
+        limit_tokens = headers.get('x-ratelimit-limit-tokens')
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        try:
+            if limit_requests:
+                capacity = min(float(limit_requests), self.requests_per_minute)
+                if capacity != self.requests.capacity:
+                    self.requests.resize(capacity)
+            if limit_tokens:
+                capacity = min(float(limit_tokens), self.tokens_per_minute)
+                if capacity != self.tokens.capacity:
+                    self.tokens.resize(capacity)
+            if remaining_requests is not None:
+                self.requests.sync_remaining(float(remaining_requests))
+            if remaining_tokens is not None:
+                self.tokens.sync_remaining(float(remaining_tokens))
+        except ValueError:
+            logging.debug(f"Ignoring malformed rate limit headers: {dict(headers)}")
+
+    def stats_text(self):
+        return f"Throttled responses: {self.throttled}, final concurrency: {int(self.concurrency_limit)}"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # After a run of failed requests the circuit opens: requests wait instead of failing, until one probe
+    # request gets through. A failed probe keeps it open twice as long, up to max_open_seconds.
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, open_seconds=CIRCUIT_OPEN_SECONDS,
+                 max_open_seconds=CIRCUIT_MAX_OPEN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.open_until = 0.0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.paused_seconds = 0.0
+        # Set by the engine, so a cancelled run does not wait for the API to come back
+        self.cancel_event = None
+
+    async def wait(self):
+        while self.open_until:
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                raise CircuitOpenError("Not sent: the API was failing and the run was cancelled")
+            if not self.probing and time.monotonic() >= self.open_until:
+                self.probing = True
+                return
+            await asyncio.sleep(CIRCUIT_POLL_SECONDS)
+
+    def on_success(self):
+        self.failures = 0
+        if self.open_until:
+            self.paused_seconds += time.monotonic() - self.opened_at
+            logging.info("Circuit closed, the API is answering again")
+        self.open_until = 0.0
+        self.open_seconds = self.base_open_seconds
+        self.probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        now = time.monotonic()
+        if self.probing:
+            self.probing = False
+            self.open_seconds = min(self.max_open_seconds, self.open_seconds * 2)
+            self.open_until = now + self.open_seconds
+            logging.warning(f"Probe request failed, dispatch stays paused for {self.open_seconds:.0f} s")
+        elif not self.open_until and self.failures >= self.failure_threshold:
+            self.opened += 1
+            self.opened_at = now
+            self.open_until = now + self.open_seconds
+            logging.warning(
+                f"Circuit opened after {self.failures} failed requests, dispatch paused for {self.open_seconds:.0f} s"
+            )
+
+    def on_abandoned(self):
+        # A request cancelled while probing lets the next waiting one probe instead
+        self.probing = False
+
+    def stats_text(self):
+        paused = self.paused_seconds + (time.monotonic() - self.opened_at if self.open_until else 0.0)
+        return f"Circuit breaker opened {self.opened} time(s), dispatch paused for {paused:.0f} s"
+
+
+class RetryBudget:
+    # Bounds retries across the run, so an outage does not multiply the load on an API that is already failing
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_retries=RETRY_BUDGET_MIN_RETRIES):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+        self.denied = 0
+
+    def deposit(self):
+        self.requests += 1
+
+    def withdraw(self):
+        if self.retries < self.min_retries + self.ratio * self.requests:
+            self.retries += 1
+            return True
+        self.denied += 1
+        return False
+
+    def stats_text(self):
+        return f"Retries: {self.retries} used, {self.denied} refused by the retry budget"
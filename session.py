@@ -0,0 +1,204 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+
+# Connection pool defaults; keep-alive covers the default 200 requests in flight so they all stay warm
+HTTP_MAX_CONNECTIONS = 1000
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 200
+HTTP_KEEPALIVE_SECONDS = 60.0
+HTTP_CONNECT_TIMEOUT = 10.0
+HTTP_READ_TIMEOUT = 120.0
+SHUTDOWN_TIMEOUT_SECONDS = 10.0
+
+# The stats of the run a request belongs to, and the timing of the request being sent by the current task
+current_stats = contextvars.ContextVar('connection_stats', default=None)
+request_timing = contextvars.ContextVar('request_timing', default=None)
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def session_options_from_env(environ=None):
+    # The GUIs are tuned through config/.env: HTTP_MAX_CONNECTIONS, HTTP_KEEPALIVE_CONNECTIONS,
+    # HTTP_KEEPALIVE_SECONDS, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT and HTTP2=0 to stay on HTTP/1.1
+    environ = os.environ if environ is None else environ
+    options = {}
+    for name, option, convert in (
+        ('HTTP_MAX_CONNECTIONS', 'max_connections', int),
+        ('HTTP_KEEPALIVE_CONNECTIONS', 'max_keepalive_connections', int),
+        ('HTTP_KEEPALIVE_SECONDS', 'keepalive_seconds', float),
+        ('HTTP_CONNECT_TIMEOUT', 'connect_timeout', float),
+        ('HTTP_READ_TIMEOUT', 'read_timeout', float),
+    ):
+        if environ.get(name):
+            options[option] = convert(environ[name])
+    if environ.get('HTTP2') == '0':
+        options['http2'] = False
+    return options
+
+
+def start_request_timing():
+    # Called by the task that sends a request; the trace hook adds the time spent on the wire
+    timing = {'started': time.perf_counter(), 'wire': None}
+    request_timing.set(timing)
+    return timing
+
+
+def finish_request_timing(timing):
+    stats = current_stats.get()
+    if stats is not None and timing['wire'] is not None:
+        stats.overhead_seconds += time.perf_counter() - timing['started'] - timing['wire']
+        stats.timed_requests += 1
+
+
+class ConnectionStats:
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.connect_seconds = 0.0
+        self.tls_seconds = 0.0
+        self.queued_seconds = 0.0
+        self.overhead_seconds = 0.0
+        self.timed_requests = 0
+
+    def observe(self, started, marks):
+        # marks maps httpcore trace events (without their http11./http2. prefix) to perf_counter times
+        self.requests += 1
+        if 'connect_tcp.complete' in marks:
+            self.connections += 1
+            self.connect_seconds += marks['connect_tcp.complete'] - marks['connect_tcp.started']
+        if 'start_tls.complete' in marks:
+            self.tls_handshakes += 1
+            self.tls_seconds += marks['start_tls.complete'] - marks['start_tls.started']
+        if 'send_request_headers.started' in marks:
+            self.queued_seconds += marks['send_request_headers.started'] - started
+
+    def stats_text(self):
+        reused = 1 - self.connections / self.requests if self.requests else 0.0
+        text = (
+            f"HTTP: {self.requests} requests over {self.connections} new connections ({reused:.0%} reused), "
+            f"TCP connect {self.average(self.connect_seconds, self.connections):.1f} ms"
+        )
+        if self.tls_handshakes:
+            text += f", TLS handshake {self.average(self.tls_seconds, self.tls_handshakes):.1f} ms"
+        text += f", wait before sending {self.average(self.queued_seconds, self.requests):.1f} ms"
+        if self.timed_requests:
+            text += f", client overhead {self.average(self.overhead_seconds, self.timed_requests):.1f} ms per request"
+        return text
+
+    @staticmethod
+    def average(seconds, count):
+        return seconds * 1000 / count if count else 0.0
+
+
+class ClientSession:
+    # One event loop thread and one HTTP connection pool for the lifetime of the app, shut down by close()
+    def __init__(self, api_key=None, base_url=None, max_connections=HTTP_MAX_CONNECTIONS,
+                 max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS, keepalive_seconds=HTTP_KEEPALIVE_SECONDS,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT, http2=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_seconds = keepalive_seconds
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # HTTP/2 needs the h2 package; without it requests fall back to pooled HTTP/1.1 keep-alive
+        self.http2 = http2_available() if http2 is None else http2
+        self.loop = None
+        self.thread = None
+        self.client = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name='client-session', daemon=True)
+                self.thread.start()
+        return self
+
+    def open_client(self):
+        # The AsyncOpenAI client is reused by every engine built for this session
+        with self.lock:
+            if self.client is None:
+                import openai
+                limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_seconds
+                )
+                http_client = openai.DefaultAsyncHttpxClient(
+                    limits=limits,
+                    timeout=openai.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    http2=self.http2,
+                    event_hooks={'request': [self.on_request]}
+                )
+                self.client = openai.AsyncOpenAI(
+                    api_key=self.api_key, base_url=self.base_url, max_retries=0, http_client=http_client
+                )
+        return self.client
+
+    async def on_request(self, request):
+        stats = current_stats.get()
+        if stats is None:
+            return
+        started = time.perf_counter()
+        timing = request_timing.get()
+        marks = {}
+
+        async def trace(event, info):
+            name = event.split('.', 1)[1]
+            marks[name] = time.perf_counter()
+            if name == 'response_closed.started':
+                stats.observe(started, marks)
+                if timing is not None and 'send_request_headers.started' in marks:
+                    timing['wire'] = marks[name] - marks['send_request_headers.started']
+
+        request.extensions['trace'] = trace
+
+    def run(self, coroutine, stats=None):
+        # Blocks the calling thread until the coroutine finished on the session loop
+        self.start()
+
+        async def with_stats():
+            current_stats.set(stats)
+            return await coroutine
+
+        return asyncio.run_coroutine_threadsafe(with_stats(), self.loop).result()
+
+    def close(self):
+        with self.lock:
+            loop, self.loop = self.loop, None
+            client, self.client = self.client, None
+        if loop is None:
+            if client is not None:
+                asyncio.run(client.close())
+            return
+
+        async def shutdown():
+            # Requests still in flight are cancelled, then the pooled connections are closed
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if client is not None:
+                await client.close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), loop).result(SHUTDOWN_TIMEOUT_SECONDS)
+        except Exception as e:
+            logging.warning(f"Client session did not shut down cleanly: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        self.thread.join(SHUTDOWN_TIMEOUT_SECONDS)
+        if not self.thread.is_alive():
+            loop.close()
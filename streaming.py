@@ -0,0 +1,195 @@
+import os
+import json
+import itertools
+import pandas as pd
+
+STREAM_CHUNK_ROWS = 10_000
+OUTPUT_FORMATS = ('same', 'csv', 'xlsx', 'parquet', 'feather', 'jsonl')
+WRITABLE_EXTENSIONS = ('.csv', '.xlsx', '.parquet', '.feather', '.jsonl')
+READABLE_EXTENSIONS = ('.csv', '.xlsx', '.xls', '.parquet', '.feather', '.jsonl')
+JSONL_HEADER_LINES = 100
+
+
+def import_pyarrow():
+    # Parquet and Feather are optional back-ends
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.feather
+        import pyarrow.ipc
+    except ImportError:
+        raise ValueError("Parquet and Feather files need pyarrow. Install it with: pip install pyarrow")
+    return pyarrow
+
+
+def validate_output_path(output_path):
+    # Checked before a run starts, so a bad extension does not surface after all requests were paid for
+    file_ext = os.path.splitext(output_path)[1].lower()
+    if file_ext not in WRITABLE_EXTENSIONS:
+        supported = ', '.join(WRITABLE_EXTENSIONS)
+        raise ValueError(f"Cannot write {file_ext or 'files without an extension'}; use one of {supported}")
+    if file_ext in ('.parquet', '.feather'):
+        import_pyarrow()
+
+
+def xlsx_columns(header):
+    # Named like pd.read_excel does, so the picker and the loader agree: raw values (a numeric header stays a
+    # number), "Unnamed: i" for blank cells, and trailing blank cells dropped
+    header = list(header)
+    while header and header[-1] is None:
+        header.pop()
+    return [value if value is not None else f"Unnamed: {i}" for i, value in enumerate(header)]
+
+
+def read_header(file_path):
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == '.csv':
+        return list(pd.read_csv(file_path, nrows=0).columns)
+    if file_ext == '.xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            return xlsx_columns(next(workbook.active.iter_rows(max_row=1, values_only=True), ()))
+        finally:
+            workbook.close()
+    if file_ext == '.xls':
+        return list(pd.read_excel(file_path, engine='xlrd', nrows=0).columns)
+    if file_ext == '.parquet':
+        pa = import_pyarrow()
+        return list(pa.parquet.read_schema(file_path).names)
+    if file_ext == '.feather':
+        pa = import_pyarrow()
+        with pa.memory_map(file_path) as source:
+            return list(pa.ipc.open_file(source).schema.names)
+    if file_ext == '.jsonl':
+        # Records may omit keys, so the header is the union over the first lines
+        columns = {}
+        with open(file_path, 'r', encoding='utf-8') as handle:
+            for line in itertools.islice(handle, JSONL_HEADER_LINES):
+                if line.strip():
+                    columns.update(dict.fromkeys(json.loads(line)))
+        return list(columns)
+    raise ValueError(f"Unsupported file format: {file_ext}")
+
+
+def iter_chunks(file_path, chunksize=STREAM_CHUNK_ROWS):
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == '.csv':
+        yield from pd.read_csv(file_path, chunksize=chunksize)
+    elif file_ext == '.xlsx':
+        yield from _iter_xlsx_chunks(file_path, chunksize)
+    elif file_ext == '.xls':
+        # xlrd cannot stream, so legacy workbooks are loaded once and sliced
+        df = pd.read_excel(file_path, engine='xlrd')
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+    elif file_ext == '.jsonl':
+        yield from pd.read_json(file_path, lines=True, chunksize=chunksize)
+    elif file_ext in ('.parquet', '.feather'):
+        yield from _iter_arrow_chunks(file_path, file_ext, chunksize)
+    else:
+        raise ValueError(f"Unsupported file format: {file_ext}")
+
+
+def _iter_arrow_chunks(file_path, file_ext, chunksize):
+    pa = import_pyarrow()
+    start = 0
+    if file_ext == '.parquet':
+        batches = pa.parquet.ParquetFile(file_path).iter_batches(batch_size=chunksize)
+        for batch in batches:
+            yield batch.to_pandas().set_axis(range(start, start + batch.num_rows))
+            start += batch.num_rows
+        return
+    # Feather files are memory-mapped, so only the slice being converted is paged in
+    with pa.memory_map(file_path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        for offset in range(0, table.num_rows, chunksize):
+            part = table.slice(offset, chunksize)
+            yield part.to_pandas().set_axis(range(offset, offset + part.num_rows))
+
+
+def _iter_xlsx_chunks(file_path, chunksize):
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = xlsx_columns(header)
+        width = len(columns)
+        start = 0
+        buffer = []
+        for row in rows:
+            buffer.append(row[:width] + (None,) * (width - len(row)))
+            if len(buffer) >= chunksize:
+                yield pd.DataFrame(buffer, columns=columns, index=range(start, start + len(buffer)))
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns, index=range(start, start + len(buffer)))
+    finally:
+        workbook.close()
+
+
+class ChunkWriter:
+    # Appends DataFrames to one output file, so results can be written as they arrive
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.file_ext = os.path.splitext(output_path)[1].lower()
+        self.rows_written = 0
+        self.header_written = False
+        self.workbook = None
+        self.sheet = None
+        self.arrow_writer = None
+        self.schema = None
+        validate_output_path(output_path)
+        if self.file_ext == '.xlsx':
+            from openpyxl import Workbook
+            self.workbook = Workbook(write_only=True)
+            self.sheet = self.workbook.create_sheet()
+
+    def write(self, df):
+        if self.file_ext == '.csv':
+            df.to_csv(self.output_path, mode='w' if not self.header_written else 'a',
+                      header=not self.header_written, index=False)
+        elif self.file_ext == '.xlsx':
+            self._write_xlsx(df)
+        elif self.file_ext == '.jsonl':
+            with open(self.output_path, 'w' if not self.header_written else 'a', encoding='utf-8') as handle:
+                df.to_json(handle, orient='records', lines=True, force_ascii=False)
+        else:
+            self._write_arrow(df)
+        self.header_written = True
+        self.rows_written += len(df)
+
+    def _write_xlsx(self, df):
+        if not self.header_written:
+            # Numeric headers stay numbers, so reading the output back gives the input's column names
+            self.sheet.append([col if isinstance(col, (int, float)) else str(col) for col in df.columns])
+        # Missing values are replaced column-wise rather than checked cell by cell
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            self.sheet.append(row)
+
+    def _write_arrow(self, df):
+        pa = import_pyarrow()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.arrow_writer is None:
+            # Columns that are empty in the first chunk are typed as text so later chunks still fit
+            self.schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema
+            ])
+            if self.file_ext == '.parquet':
+                self.arrow_writer = pa.parquet.ParquetWriter(self.output_path, self.schema)
+            else:
+                self.arrow_writer = pa.ipc.new_file(self.output_path, self.schema)
+        self.arrow_writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        if self.workbook is not None:
+            self.workbook.save(self.output_path)
+            self.workbook = None
+        if self.arrow_writer is not None:
+            self.arrow_writer.close()
+            self.arrow_writer = None
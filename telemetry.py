@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import logging
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+METRICS_SUFFIX = '.metrics.json'
+# Prompt tokens served from the provider's prefix cache are billed at half the prompt price
+CACHED_PROMPT_PRICE_RATIO = 0.5
+
+# USD per million prompt / completion tokens; models missing here are reported without a cost
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4': (30.00, 60.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+}
+
+request_logger = logging.getLogger('telemetry')
+
+
+def get_metrics_path(output_path):
+    return f"{output_path}{METRICS_SUFFIX}"
+
+
+def estimate_cost(model_name, prompt_tokens, completion_tokens, cached_tokens=0):
+    # Dated snapshots such as gpt-4o-mini-2024-07-18 use the price of their base model
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model_name == name or model_name.startswith(f"{name}-"):
+            prompt_price, completion_price = MODEL_PRICES[name]
+            uncached_tokens = prompt_tokens - cached_tokens
+            prompt_cost = (uncached_tokens + cached_tokens * CACHED_PROMPT_PRICE_RATIO) * prompt_price
+            return (prompt_cost + completion_tokens * completion_price) / 1_000_000
+    return None
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for position, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[position] += 1
+                return
+        self.counts[-1] += 1
+
+    def quantile(self, share):
+        # Interpolated within the bucket, the same way Prometheus' histogram_quantile does
+        if not self.count:
+            return 0.0
+        target = share * self.count
+        seen = 0
+        for position, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= target and bucket_count:
+                lower = self.bounds[position - 1] if position > 0 else 0.0
+                if position == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[position] - lower) * (target - seen) / bucket_count
+            seen += bucket_count
+        return self.bounds[-1]
+
+    def cumulative(self):
+        total = 0
+        for bound, bucket_count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            total += bucket_count
+            yield bound, total
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'buckets': {str(bound): total for bound, total in self.cumulative()},
+            'p50': round(self.quantile(0.50), 4),
+            'p95': round(self.quantile(0.95), 4),
+            'p99': round(self.quantile(0.99), 4),
+        }
+
+
+class Telemetry:
+    def __init__(self, model_name, records_path=None):
+        self.model_name = model_name
+        self.records_path = records_path
+        self.records_file = None
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        # A cascade bills two models, so tokens are also kept per model for the cost estimate
+        self.tokens_by_model = {}
+        # Share of the list price actually billed, e.g. half for Batch API runs
+        self.price_ratio = 1.0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.prompt_token_sizes = Histogram(TOKEN_BUCKETS)
+        self.completion_token_sizes = Histogram(TOKEN_BUCKETS)
+
+    def record(self, rows, latency, prompt_tokens=0, completion_tokens=0, retries=0, cache_hit=False, error=None,
+               model=None, cached_tokens=0):
+        model = model or self.model_name
+        self.requests += 1
+        self.retries += retries
+        if cache_hit:
+            self.cache_hits += 1
+        elif error is not None:
+            self.errors += 1
+        else:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+            model_tokens = self.tokens_by_model.setdefault(model, [0, 0, 0])
+            model_tokens[0] += prompt_tokens
+            model_tokens[1] += completion_tokens
+            model_tokens[2] += cached_tokens
+            self.latency.observe(latency)
+            self.prompt_token_sizes.observe(prompt_tokens)
+            self.completion_token_sizes.observe(completion_tokens)
+
+        entry = {
+            'rows': rows,
+            'model': model,
+            'latency': round(latency, 4),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cached_tokens': cached_tokens,
+            'retries': retries,
+            'cache_hit': cache_hit,
+            'error': error,
+        }
+        # Per-request records only reach the console at DEBUG level, so large runs do not flood stdout
+        request_logger.debug("request", extra={'telemetry': entry})
+        if self.records_path is not None:
+            if self.records_file is None:
+                self.records_file = open(self.records_path, 'a', encoding='utf-8')
+            self.records_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    @property
+    def cost(self):
+        if not self.tokens_by_model:
+            return estimate_cost(self.model_name, 0, 0)
+        costs = [estimate_cost(model, *tokens) for model, tokens in self.tokens_by_model.items()]
+        return None if None in costs else sum(costs) * self.price_ratio
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        cost = self.cost
+        return {
+            'model': self.model_name,
+            'started': self.started,
+            'elapsed_seconds': round(elapsed, 3),
+            'requests': self.requests,
+            'api_requests': self.latency.count,
+            'errors': self.errors,
+            'cache_hits': self.cache_hits,
+            'retries': self.retries,
+            'requests_per_second': round(self.requests / elapsed, 2) if elapsed > 0 else 0.0,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cached_prompt_tokens': self.cached_tokens,
+            'tokens_by_model': {
+                model: {'prompt_tokens': tokens[0], 'completion_tokens': tokens[1], 'cached_prompt_tokens': tokens[2]}
+                for model, tokens in self.tokens_by_model.items()
+            },
+            'estimated_cost_usd': round(cost, 6) if cost is not None else None,
+            'latency_seconds': self.latency.as_dict(),
+            'prompt_tokens_per_request': self.prompt_token_sizes.as_dict(),
+            'completion_tokens_per_request': self.completion_token_sizes.as_dict(),
+        }
+
+    def write_summary(self, path):
+        with open(path, 'w', encoding='utf-8') as handle:
+            json.dump(self.summary(), handle, indent=2)
+
+    def prometheus_lines(self):
+        labels = f'model="{self.model_name}"'
+        lines = []
+
+        def gauge(name, help_text, value):
+            lines.append(f"# HELP dataanalyzer_{name} {help_text}")
+            lines.append(f"# TYPE dataanalyzer_{name} gauge")
+            lines.append(f"dataanalyzer_{name}{{{labels}}} {value}")
+
+        def histogram(name, help_text, values):
+            lines.append(f"# HELP dataanalyzer_{name} {help_text}")
+            lines.append(f"# TYPE dataanalyzer_{name} histogram")
+            for bound, total in values.cumulative():
+                lines.append(f'dataanalyzer_{name}_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f"dataanalyzer_{name}_sum{{{labels}}} {values.sum}")
+            lines.append(f"dataanalyzer_{name}_count{{{labels}}} {values.count}")
+
+        gauge('last_run_timestamp_seconds', "Start time of the last run.", self.started)
+        gauge('last_run_duration_seconds', "Wall time of the last run.", round(time.time() - self.started, 3))
+        gauge('last_run_requests', "Requests answered in the last run, including cache hits.", self.requests)
+        gauge('last_run_errors', "Requests that failed after all retries.", self.errors)
+        gauge('last_run_cache_hits', "Requests answered from the response cache.", self.cache_hits)
+        gauge('last_run_retries', "Retried API attempts.", self.retries)
+        gauge('last_run_prompt_tokens', "Prompt tokens billed.", self.prompt_tokens)
+        gauge('last_run_completion_tokens', "Completion tokens billed.", self.completion_tokens)
+        gauge('last_run_cached_prompt_tokens', "Prompt tokens served from the provider's prefix cache.", self.cached_tokens)
+        if self.cost is not None:
+            gauge('last_run_cost_usd', "Estimated spend in USD.", round(self.cost, 6))
+        histogram('last_run_request_latency_seconds', "API request latency including retries.", self.latency)
+        return lines
+
+    def write_prometheus(self, path):
+        # Written to a temporary file and renamed, so the node_exporter textfile collector never reads half a file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            handle.write('\n'.join(self.prometheus_lines()) + '\n')
+        os.replace(temp_path, path)
+
+    def stats_text(self):
+        text = (
+            f"Latency p50 {self.latency.quantile(0.50):.2f} s, p95 {self.latency.quantile(0.95):.2f} s, "
+            f"p99 {self.latency.quantile(0.99):.2f} s, retries: {self.retries}"
+        )
+        if self.cost is not None:
+            text += f", estimated cost: ${self.cost:.4f}"
+        return text
+
+    def close(self):
+        if self.records_file is not None:
+            self.records_file.close()
+            self.records_file = None
@@ -0,0 +1,99 @@
+import json
+import pandas as pd
+import processing
+from batchapi import BATCH_PRICE_RATIO, BatchJob, make_custom_id, parse_custom_id, parse_output_line, run_batch
+from mock_server import DEFAULT_LABELS, MockConfig, pick_label, start_mock_server
+
+FULL_RUN = ["Classify: printer jam", "Classify: VPN down", "Classify: new laptop"]
+# An incremental run of the same file that reuses the first row sends a shorter, shifted list
+INCREMENTAL_RUN = ["Classify: VPN down", "Classify: new laptop"]
+SUBMITTED = [{'batch_id': 'batch_1', 'status': 'completed', 'positions': [0, 1]}]
+
+
+def submitted_job(state_path, prompts, labels=()):
+    job = BatchJob(None, state_path, "same-file-and-settings")
+    job.match_prompts(prompts, labels)
+    job.batches = list(SUBMITTED)
+    job.save()
+    return job
+
+
+def resumed_job(state_path, prompts, labels=()):
+    job = BatchJob(None, state_path, "same-file-and-settings")
+    job.load()
+    job.match_prompts(prompts, labels)
+    return job
+
+
+def test_batches_resume_for_the_same_prompts(tmp_path):
+    state_path = str(tmp_path / "input.batch.json")
+    submitted_job(state_path, FULL_RUN)
+    assert resumed_job(state_path, FULL_RUN).batches == SUBMITTED
+
+
+def test_batches_for_other_prompts_or_labels_are_not_merged(tmp_path):
+    state_path = str(tmp_path / "input.batch.json")
+    submitted_job(state_path, FULL_RUN)
+    assert resumed_job(state_path, INCREMENTAL_RUN).batches == []
+    submitted_job(state_path, FULL_RUN, labels=("incident", "service request"))
+    assert resumed_job(state_path, FULL_RUN, labels=("incident", "request")).batches == []
+
+
+def test_discarded_batches_are_cancelled(tmp_path):
+    state_path = str(tmp_path / "input.batch.json")
+    server = start_mock_server(MockConfig(latency_ms=5, latency_sigma=0, batch_seconds=60))
+    try:
+        engine = processing.build_engine('mock-model', api_key='mock', use_cache=False, base_url=server.base_url)
+        job = BatchJob(engine.api_client, state_path, "same-file-and-settings")
+        job.match_prompts(FULL_RUN)
+        job.submit(FULL_RUN, [0, 1, 2])
+        batch_id = job.batches[0]['batch_id']
+        job.close()
+        resumed = BatchJob(engine.api_client, state_path, "same-file-and-settings")
+        resumed.load()
+        resumed.match_prompts(INCREMENTAL_RUN)
+        try:
+            assert resumed.batches == []
+            assert resumed.open().batches.retrieve(batch_id).status == 'cancelled'
+        finally:
+            resumed.close()
+    finally:
+        server.stop()
+
+
+def output_line(position, status, body):
+    return json.dumps({'custom_id': make_custom_id(position), 'response': {'status_code': status, 'body': body}})
+
+
+def test_output_lines_are_matched_by_custom_id_and_classified():
+    assert parse_custom_id(make_custom_id(12)) == 12
+    answered = output_line(7, 200, {'choices': [{'message': {'content': " incident\n"}}], 'usage': {'prompt_tokens': 9}})
+    assert parse_output_line(answered) == (7, "incident", {'prompt_tokens': 9})
+    throttled = output_line(3, 429, {'error': {'message': "Rate limit reached"}})
+    assert parse_output_line(throttled) == (3, "Error (retryable): Rate limit reached", None)
+    rejected = output_line(4, 400, {'error': {'message': "Invalid prompt"}})
+    assert parse_output_line(rejected) == (4, "Error (permanent): Invalid prompt", None)
+
+
+def test_batch_replies_are_merged_back_to_every_row(tmp_path):
+    tickets = ["VPN down", "Disk full", "VPN down", "New laptop", "Password reset", "Disk full"]
+    df = pd.DataFrame({'Summary': tickets})
+    prompt_set = processing.prepare_prompt_set(df, ['Summary'], "Classify the ticket.", 'row_analysis')
+    server = start_mock_server(MockConfig(latency_ms=5, latency_sigma=0, batch_seconds=0.2))
+    try:
+        engine = processing.build_engine('mock-model', api_key='mock', use_cache=False, base_url=server.base_url)
+        job = BatchJob(engine.api_client, str(tmp_path / "input.batch.json"), "run-1", poll_seconds=0.1)
+        try:
+            results = run_batch(engine, job, prompt_set.prompts)
+        finally:
+            job.close()
+    finally:
+        server.stop()
+    assert engine.report['requests'] == 4
+    assert results == [pick_label(f"Classify the ticket.\n\nSummary: {ticket}", DEFAULT_LABELS) for ticket in tickets]
+    # One telemetry record per collected reply, with the usage from its output line
+    telemetry = engine.api_client.telemetry
+    assert telemetry.requests == telemetry.latency.count == 4
+    assert telemetry.prompt_tokens == engine.api_client.prompt_tokens > 0
+    assert telemetry.completion_tokens == engine.api_client.completion_tokens > 0
+    assert telemetry.price_ratio == BATCH_PRICE_RATIO
@@ -0,0 +1,19 @@
+from batching import chunk, parse_batch_reply
+
+
+def test_chunk_splits_into_fixed_sizes():
+    assert list(chunk([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]
+
+
+def test_parse_batch_reply_maps_item_numbers_to_positions():
+    reply = 'Here you go: {"1": "incident", "2.": " service request ", "3": "incident"} Thanks!'
+    assert parse_batch_reply(reply, 3) == {0: "incident", 1: "service request", 2: "incident"}
+
+
+def test_parse_batch_reply_drops_malformed_answers():
+    reply = '{"0": "x", "1": "", "2": ["a"], "3": null, "four": "y", "5": "out of range", "4": "incident"}'
+    assert parse_batch_reply(reply, 4) == {3: "incident"}
+    assert parse_batch_reply("incident", 2) == {}
+    assert parse_batch_reply('{"1": "incident"', 2) == {}
+    assert parse_batch_reply('["incident"]', 1) == {}
+    assert parse_batch_reply(None, 1) == {}
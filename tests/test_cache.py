@@ -0,0 +1,75 @@
+import sqlite3
+import multiprocessing
+import processing
+from cache import ResponseCache
+from mock_server import MockConfig, start_mock_server
+
+WORKERS = 4
+PUTS_PER_WORKER = 300
+
+
+def write_entries(path, worker):
+    cache = ResponseCache(path, commit_every=10)
+    try:
+        for number in range(PUTS_PER_WORKER):
+            cache.put(f"{worker}-{number}", f"reply {number}")
+            # Reads of other workers' entries queue accessed_at updates, which must not hold the write lock
+            cache.get(f"{(worker + 1) % WORKERS}-{number // 2}")
+    finally:
+        cache.close()
+
+
+def test_workers_write_one_cache_at_the_same_time(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    ResponseCache(path).close()
+    processes = [multiprocessing.Process(target=write_entries, args=(path, worker)) for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+    assert [process.exitcode for process in processes] == [0] * WORKERS
+    cache = ResponseCache(path)
+    try:
+        assert cache.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == WORKERS * PUTS_PER_WORKER
+        assert cache.get("3-299") == "reply 299"
+    finally:
+        cache.close()
+
+
+def test_no_write_lock_is_held_between_calls(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    first = ResponseCache(path)
+    second = ResponseCache(path)
+    try:
+        first.put("a", "reply a")
+        first.get("a")
+        # Committed at once and not blocked by the first connection's pending accessed_at update
+        assert second.get("a") == "reply a"
+        second.put("b", "reply b")
+        assert first.get("b") == "reply b"
+    finally:
+        first.close()
+        second.close()
+
+
+class LockedCache:
+    def get(self, key):
+        raise sqlite3.OperationalError("database is locked")
+
+    def put(self, key, response):
+        raise sqlite3.OperationalError("database is locked")
+
+    def stats_text(self):
+        return "Cache: locked"
+
+
+def test_a_failing_cache_does_not_fail_rows():
+    server = start_mock_server(MockConfig(latency_ms=5, latency_sigma=0))
+    try:
+        engine = processing.build_engine('mock-model', api_key='mock', use_cache=False, base_url=server.base_url)
+        engine.api_client.cache = LockedCache()
+        results = engine.run(["Row 1", "Row 2", "Row 1"])
+    finally:
+        server.stop()
+    assert len(results) == 3
+    assert not [result for result in results if str(result).startswith('Error')]
@@ -0,0 +1,76 @@
+import threading
+import processing
+import checkpoint
+from checkpoint import RunJournal, run_fingerprint, run_resumable
+from mock_server import MockConfig, fetch_stats, start_mock_server
+
+
+def test_journal_keeps_replies_but_not_errors(tmp_path):
+    path = str(tmp_path / "input.journal.jsonl")
+    journal = RunJournal(path, "run-1")
+    journal.open(resume=False)
+    journal.record(0, "incident")
+    journal.record(1, "Error (retryable): timeout")
+    journal.record(2, None)
+    journal.record(3, "service request")
+    journal.close()
+    # A process that died mid-write leaves a torn last line, which is skipped
+    with open(path, 'a', encoding='utf-8') as handle:
+        handle.write('{"row": 4, "resp')
+    resumed = RunJournal(path, "run-1")
+    assert resumed.load() == 2
+    assert resumed.completed == {0: "incident", 3: "service request"}
+    assert RunJournal(path, "other-run").load() == 0
+
+
+def test_replies_are_synced_off_the_calling_thread(tmp_path, monkeypatch):
+    journal = RunJournal(str(tmp_path / "input.journal.jsonl"), "run-1")
+    journal.open(resume=False)
+    syncing_threads = set()
+    fsync = checkpoint.os.fsync
+    monkeypatch.setattr(checkpoint.os, 'fsync', lambda fd: syncing_threads.add(threading.current_thread()) or fsync(fd))
+    for row in range(checkpoint.JOURNAL_FLUSH_ROWS * 2):
+        journal.record(row, "incident")
+    journal.lines.join()
+    assert syncing_threads and threading.current_thread() not in syncing_threads
+    journal.close()
+    assert RunJournal(journal.path, "run-1").load() == checkpoint.JOURNAL_FLUSH_ROWS * 2
+
+
+def test_fingerprint_changes_with_the_settings(tmp_path):
+    data = tmp_path / "input.csv"
+    data.write_text("Summary\nVPN down\n")
+    fingerprint = run_fingerprint(str(data), 'gpt-4o-mini', "Classify {Summary}", ['Summary'])
+    assert fingerprint == run_fingerprint(str(data), 'gpt-4o-mini', "Classify {Summary}", ['Summary'])
+    assert fingerprint != run_fingerprint(str(data), 'gpt-4o', "Classify {Summary}", ['Summary'])
+    assert fingerprint != run_fingerprint(str(data), 'gpt-4o-mini', "Label {Summary}", ['Summary'])
+
+
+def test_resumed_run_sends_only_rows_missing_from_the_journal(tmp_path):
+    path = str(tmp_path / "input.journal.jsonl")
+    prompts = [f"Ticket {number}" for number in range(10)]
+    journal = RunJournal(path, "run-1")
+    journal.open(resume=False)
+    for row in range(6):
+        journal.record(row, "answered earlier")
+    journal.close()
+
+    server = start_mock_server(MockConfig(latency_ms=5, latency_sigma=0))
+    try:
+        engine = processing.build_engine('mock-model', api_key='mock', use_cache=False, base_url=server.base_url)
+        resumed = RunJournal(path, "run-1")
+        resumed.load()
+        resumed.open(resume=True)
+        try:
+            results = run_resumable(engine, resumed, prompts)
+        finally:
+            resumed.close()
+        requests = fetch_stats(server.base_url)['requests']
+    finally:
+        server.stop()
+    assert requests == 4
+    assert results[:6] == ["answered earlier"] * 6
+    assert all(results[6:])
+    assert engine.report['resumed_rows'] == 6
+    # Replies of the resumed run are journaled too, so a second interruption loses nothing
+    assert RunJournal(path, "run-1").load() == 10
@@ -0,0 +1,62 @@
+import pandas as pd
+import processing
+from mock_server import DEFAULT_LABELS, MockConfig, fetch_stats, pick_label, start_mock_server
+
+TICKETS = ["VPN down", "Disk full", "VPN down", "New laptop", "Disk full", "Password reset", "VPN down"]
+
+
+def run_tickets(tmp_path, batch_size=1, use_cache=False, runs=1):
+    df = pd.DataFrame({'Summary': TICKETS})
+    prompt_set = processing.prepare_prompt_set(df, ['Summary'], "Classify the ticket.", 'row_analysis', batch_size)
+    server = start_mock_server(MockConfig(latency_ms=5, latency_sigma=0))
+    try:
+        results = []
+        for _ in range(runs):
+            engine = processing.build_engine(
+                'mock-model', api_key='mock', batch_size=batch_size, use_cache=use_cache, base_url=server.base_url,
+                cache_path=str(tmp_path / "responses.sqlite")
+            )
+            try:
+                results.append(engine.run(
+                    prompt_set.prompts, batch_items=prompt_set.batch_items,
+                    batch_instructions=prompt_set.batch_instructions
+                ))
+            finally:
+                if engine.api_client.cache is not None:
+                    engine.api_client.cache.close()
+        return results, engine, fetch_stats(server.base_url)['requests']
+    finally:
+        server.stop()
+
+
+def test_every_row_gets_its_own_reply_in_order(tmp_path):
+    (results,), engine, requests = run_tickets(tmp_path)
+    assert engine.report['rows'] == len(TICKETS)
+    assert results == [pick_label(f"Classify the ticket.\n\nSummary: {ticket}", DEFAULT_LABELS) for ticket in TICKETS]
+
+
+def test_cached_replies_are_not_sent_again(tmp_path):
+    (first, second), engine, requests = run_tickets(tmp_path, use_cache=True, runs=2)
+    assert requests == 4
+    assert first == second
+    assert engine.api_client.cache.hits == 4
+
+
+def test_duplicate_prompts_are_sent_once(tmp_path):
+    (results,), engine, requests = run_tickets(tmp_path)
+    assert requests == 4
+    assert engine.report['rows'] == 7
+    assert engine.report['requests'] == 4
+    assert results[0] == results[2] == results[6]
+    assert results[1] == results[4]
+    assert not [result for result in results if result.startswith('Error')]
+
+
+def test_micro_batched_replies_are_merged_back_to_their_rows(tmp_path):
+    (batched,), engine, requests = run_tickets(tmp_path, batch_size=3)
+    # 4 unique prompts in batches of up to 3 rows
+    assert requests == 2
+    assert engine.report['batch_requests'] == 2
+    assert engine.report.get('batch_fallbacks', 0) == 0
+    # The mock labels each numbered item by its own text, so every row must get its own item's answer
+    assert batched == [pick_label(f"Summary: {ticket}", DEFAULT_LABELS) for ticket in TICKETS]
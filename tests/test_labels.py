@@ -0,0 +1,32 @@
+from labels import extract_labels, match_label, normalize_label, parse_labels, label_request_options
+
+LABELS = ("incident", "service request")
+
+
+def test_parse_labels_splits_and_trims():
+    assert parse_labels(" incident, service request ,, ") == LABELS
+    assert parse_labels("") == ()
+
+
+def test_extract_labels_removes_the_directive_line():
+    template = "Classify the ticket.\n#labels: incident, service request\nSummary: {Summary}"
+    assert extract_labels(template) == ("Classify the ticket.\nSummary: {Summary}", LABELS)
+    assert extract_labels("Classify {Summary}") == ("Classify {Summary}", ())
+
+
+def test_match_label_ignores_case_spacing_and_wrapping_punctuation():
+    assert normalize_label(' "Service   Request." ') == "service request"
+    assert match_label("**Incident**", LABELS) == "incident"
+    assert match_label("'service  request'.", LABELS) == "service request"
+    assert match_label("This is an incident.", LABELS) is None
+
+
+def test_label_request_options_bound_the_reply():
+    options = label_request_options(LABELS, 'gpt-4o-mini')
+    assert options['response_format']['json_schema']['schema']['properties']['label']['enum'] == list(LABELS)
+    plain = label_request_options(LABELS, 'gpt-3.5-turbo')
+    assert 'response_format' not in plain
+    assert plain['max_tokens'] < options['max_tokens'] < 20
+    batched = label_request_options(LABELS, 'gpt-3.5-turbo', count=3)
+    assert batched['response_format'] == {'type': 'json_object'}
+    assert batched['max_tokens'] > options['max_tokens']
@@ -0,0 +1,50 @@
+import pandas as pd
+from matching import NameIndex, normalize_name, name_key, extract_local_replies
+from processing import prepare_prompt_set
+
+REPLY_LINES = "#match-reply: {name}: True\n#no-match-reply: {name}: False"
+
+
+def test_normalization_ignores_case_accents_punctuation_and_order():
+    assert normalize_name("  José   O'Neil ") == "jose o neil"
+    assert name_key("Doe, John") == name_key("john doe")
+
+
+def test_extract_local_replies_strips_the_directive_lines():
+    instructions, replies = extract_local_replies(f"Compare the names.\n{REPLY_LINES}")
+    assert instructions == "Compare the names."
+    assert replies == ("{name}: True", "{name}: False")
+    assert extract_local_replies("Compare the names.") == ("Compare the names.", (None, None))
+
+
+def test_resolve_without_declared_replies_leaves_the_answer_to_the_model():
+    index = NameIndex(["Doe John", "Janet Smith"])
+    assert index.resolve("John Doe") == (None, ["Doe John"])
+    assert index.resolve("Qq") == (None, [])
+    assert index.resolve("John Doe", "{name}: yes", "{name}: no") == ("John Doe: yes", [])
+    assert index.resolve("Qq", "{name}: yes", "{name}: no") == ("Qq: no", [])
+
+
+def test_declared_replies_keep_other_braces():
+    index = NameIndex(["Doe John"])
+    assert index.resolve("John Doe", '{"name": "{name}", "match": true}') == ('{"name": "John Doe", "match": true}', [])
+    assert index.resolve("Qq", None, "{name}: {0} {") == ("Qq: {0} {", [])
+
+
+def test_candidates_rank_the_closest_names_first():
+    index = NameIndex(["Anna Petrova", "Boris Ivanov", "Anna Petrov", "Carla Rossi"], top_k=2)
+    assert index.candidates("Ana Petrova") == ["Anna Petrova", "Anna Petrov"]
+
+
+def test_column_mode_writes_local_replies_only_in_the_declared_format():
+    df = pd.DataFrame({'a': ["John Doe", "Qq", "Jane"], 'b': ["Doe John", "Janet", "Zed"]})
+    undeclared = prepare_prompt_set(df, ['a', 'b'], "Reply 'name - yes/no'.", 'column_analysis')
+    assert undeclared.local_results == {}
+    assert undeclared.batch_items == [
+        "Name: John Doe\nList of names: Doe John",
+        "Name: Qq\nList of names: (none)",
+        "Name: Jane\nList of names: Janet",
+    ]
+    declared = prepare_prompt_set(df, ['a', 'b'], f"Reply 'name: True/False'.\n{REPLY_LINES}", 'column_analysis')
+    assert declared.local_results == {0: "John Doe: True", 1: "Qq: False"}
+    assert declared.prompts == ["Reply 'name: True/False'.\n\nName: Jane\nList of names: Janet"]
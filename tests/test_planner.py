@@ -0,0 +1,86 @@
+import pandas as pd
+import processing
+from mock_server import MockConfig, fetch_stats, start_mock_server
+from batching import BATCH_FORMAT_INSTRUCTIONS
+from planner import MESSAGE_OVERHEAD_TOKENS, TokenCounter, plan_run
+
+PROMPT_ROWS = 40
+
+
+def make_prompt_set(batch_size=1):
+    df = pd.DataFrame({'Summary': [f"Ticket {number}" for number in range(PROMPT_ROWS)]})
+    return processing.prepare_prompt_set(df, ['Summary'], "Classify {Summary}", batch_size=batch_size)
+
+
+def plan_with(tmp_path, sample_rows, cached_rows=0, **engine_options):
+    server = start_mock_server(MockConfig(latency_ms=5, latency_sigma=0))
+    try:
+        engine = processing.build_engine(
+            'mock-model', api_key='mock', base_url=server.base_url, cache_path=str(tmp_path / "responses.sqlite"),
+            **engine_options
+        )
+        try:
+            prompt_set = make_prompt_set(engine.batch_size)
+            for prompt in prompt_set.prompts[:cached_rows]:
+                engine.api_client.cache.put(engine.api_client.cache_key(prompt, {}), "cached")
+            plan = plan_run(engine, prompt_set, sample_rows)
+        finally:
+            if engine.api_client.cache is not None:
+                engine.api_client.cache.close()
+        return plan, engine, fetch_stats(server.base_url)['requests']
+    finally:
+        server.stop()
+
+
+def test_plan_sends_nothing_by_default(tmp_path):
+    plan, _, requests = plan_with(tmp_path, 0)
+    assert requests == 0
+    assert plan.sampled == 0
+
+
+def test_plan_does_not_sample_without_the_cache(tmp_path):
+    for options in ({'use_cache': False}, {'bypass_cache': True}):
+        plan, _, requests = plan_with(tmp_path, 5, **options)
+        assert requests == 0
+        assert "without the response cache" in plan.text()
+
+
+def test_sampled_replies_are_cached_for_the_run(tmp_path):
+    plan, _, requests = plan_with(tmp_path, 5)
+    assert requests == 5
+    assert plan.sampled == 5
+    assert plan.cached == 5
+
+
+def test_cascade_sampling_leaves_the_run_counters_alone(tmp_path):
+    plan, engine, requests = plan_with(tmp_path, 5, fallback_model='mock-large', min_confidence=0.75)
+    assert requests == 5
+    assert engine.api_client.rows == 0
+    assert sum(engine.api_client.escalated.values()) == 0
+    assert plan.escalated_share is not None
+    # Only replies the cascade would accept are cached as its answers
+    assert plan.cached == round(5 * (1 - plan.escalated_share))
+
+
+def test_micro_batched_runs_do_not_count_rows_cached_on_their_own(tmp_path):
+    plan, _, requests = plan_with(tmp_path, 5, cached_rows=10)
+    assert requests == 5
+    assert plan.cached == 15
+    # The run would look up whole batches, so neither the cached rows nor samples would be reused
+    plan, _, requests = plan_with(tmp_path, 5, cached_rows=10, batch_size=4)
+    assert requests == 0
+    assert plan.cached == 0
+    assert "micro-batched run" in plan.text()
+    assert plan.modes[1]['requests'] == PROMPT_ROWS // 4
+
+
+def test_micro_batched_estimate_counts_the_instructions_once_per_request(tmp_path):
+    plan, _, _ = plan_with(tmp_path, 0, use_cache=False)
+    prompt_set = make_prompt_set()
+    counter = TokenCounter('mock-model')
+    # The template and the item format note that dispatch_batched would send, then one numbered item per row
+    instructions = counter.count(f"{prompt_set.batch_instructions}\n\n{BATCH_FORMAT_INSTRUCTIONS}")
+    items = sum(counter.count(prompt) + 2 for prompt in prompt_set.prompts)
+    batched = plan.modes[1]
+    assert batched['requests'] == 4
+    assert batched['prompt_tokens'] == 4 * (instructions + 2 * MESSAGE_OVERHEAD_TOKENS) + items
@@ -0,0 +1,22 @@
+import pandas as pd
+import processing
+
+
+def test_report_lists_the_rows_reused_from_the_previous_output(tmp_path):
+    tickets = [f"Ticket {number}" for number in range(14)]
+    previous_path = str(tmp_path / "input_analyzed.csv")
+    pd.DataFrame({'Summary': tickets, 'Analysis': ["incident"] * 13 + ["Error (retryable): timeout"]}).to_csv(
+        previous_path, index=False
+    )
+    # The new export changes row 2 and adds a row; row 13 failed last time and is sent again
+    df = pd.DataFrame({'Summary': tickets[:2] + ["Ticket 2, updated"] + tickets[3:] + ["Ticket 14"]})
+    previous = processing.load_previous_analysis(previous_path, ['Summary'])
+    prompt_set = processing.prepare_prompt_set(df, ['Summary'], "Classify {Summary}", previous=previous)
+    assert prompt_set.prompts == ["Classify Ticket 2, updated", "Classify Ticket 13", "Classify Ticket 14"]
+    assert prompt_set.reused_row_ids == [0, 1] + list(range(3, 13))
+
+    engine = processing.build_engine('mock-model', api_key='mock', use_cache=False)
+    processing.count_answered(engine, prompt_set)
+    assert "Reused from the previous output: 12 unchanged rows (0, 1, 3, 4, 5, 6, 7, 8, 9, 10 and 2 more)" in (
+        engine.report_text()
+    )
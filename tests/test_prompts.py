@@ -0,0 +1,58 @@
+import pandas as pd
+from batching import build_batch_prompt, BATCH_FORMAT_INSTRUCTIONS
+from bench import BENCH_INSTRUCTIONS
+from processing import prepare_prompt_set, MAX_INPUT_TOKENS
+from prompts import SplitPrompt, build_messages
+
+# The built-in templates offered by appv2
+APPV2_TEMPLATES = [
+    "Review the following text and categorize it as either an 'incident' or a 'service request' according to the "
+    "ITIL framework. Respond with only 'incident' or 'service request'. Do not explain your answer. "
+    "Summary: {Summary}, Description: {Description}",
+    "Compare the name '{Names1}' with '{Names2}'. If they are the same person (even if the first name and last name "
+    "are inverted), reply with the name from '{Names1}'. If they are different, reply with 'different person'. "
+    "Do not explain your answer.",
+    "Compare {Column1} with {Column2} and note differences",
+]
+ROW = {'Summary': "VPN down", 'Description': "No access since 9am", 'Names1': "Anna Petrova",
+       'Names2': "Petrova Anna", 'Column1': "red", 'Column2': "blue"}
+LONG_INSTRUCTIONS = "Classify the ticket by the examples below.\n" + "Example: printer jam -> incident\n" * 200
+
+
+def messages(prompt_set):
+    return [build_messages(prompt) for prompt in prompt_set.prompts]
+
+
+def test_builtin_templates_send_the_same_single_message_as_before():
+    df = pd.DataFrame([ROW])
+    for template in APPV2_TEMPLATES:
+        columns = [column for column in ROW if '{' + column + '}' in template]
+        prompt_set = prepare_prompt_set(df, columns, template)
+        assert messages(prompt_set) == [[{"role": "user", "content": template.format(**ROW)}]]
+
+
+def test_short_row_and_column_instructions_stay_one_message():
+    df = pd.DataFrame({'Summary': ["VPN down"], 'Description': ["No access"]})
+    instructions = BENCH_INSTRUCTIONS['row_analysis']
+    prompt_set = prepare_prompt_set(df, ['Summary', 'Description'], instructions, 'row_analysis')
+    assert messages(prompt_set) == [[{
+        "role": "user", "content": f"{instructions}\n\nSummary: VPN down\nDescription: No access"
+    }]]
+    names = pd.DataFrame({'a': ["Anna Petrova"], 'b': ["Ana Petrov"]})
+    prompt_set = prepare_prompt_set(names, ['a', 'b'], "Reply True or False.", 'column_analysis')
+    assert messages(prompt_set) == [[{
+        "role": "user", "content": "Reply True or False.\n\nName: Anna Petrova\nList of names: Ana Petrov"
+    }]]
+    assert build_batch_prompt("Classify.", ["a", "b"]) == f"Classify.\n\n{BATCH_FORMAT_INSTRUCTIONS}\n\n1. a\n\n2. b"
+
+
+def test_long_instruction_block_becomes_a_shared_prefix():
+    df = pd.DataFrame([ROW])
+    prompt_set = prepare_prompt_set(df, ['Summary'], LONG_INSTRUCTIONS + "\nSummary: {Summary}")
+    assert prompt_set.prompts == [SplitPrompt(LONG_INSTRUCTIONS.rstrip(), "Summary: VPN down")]
+    # Without a line break before the placeholder there is no complete block to split off
+    paragraph = "Classify the ticket as an incident or a service request. " * 100
+    prompt_set = prepare_prompt_set(df, ['Summary'], paragraph + "Summary: {Summary}")
+    assert prompt_set.prompts == [(paragraph + "Summary: VPN down")[:MAX_INPUT_TOKENS]]
+    prompt_set = prepare_prompt_set(df, ['Summary'], LONG_INSTRUCTIONS, 'row_analysis')
+    assert prompt_set.prompts == [SplitPrompt(LONG_INSTRUCTIONS.rstrip(), "Summary: VPN down")]
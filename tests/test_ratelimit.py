@@ -0,0 +1,56 @@
+import time
+import processing
+from mock_server import MockConfig, start_mock_server
+from ratelimit import RateLimiter
+
+THROUGHPUT_ROWS = 400
+
+
+def test_headers_only_lower_the_configured_budgets():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=10_000)
+    limiter.apply_headers({'x-ratelimit-limit-requests': '5000', 'x-ratelimit-limit-tokens': '2000000'})
+    assert limiter.requests.capacity == 600
+    assert limiter.tokens.capacity == 10_000
+    limiter.apply_headers({'x-ratelimit-limit-requests': '300', 'x-ratelimit-limit-tokens': '4000'})
+    assert limiter.requests.capacity == 300
+    assert limiter.tokens.capacity == 4000
+
+
+def test_isolated_429s_do_not_lower_concurrency():
+    limiter = RateLimiter(max_concurrency=100)
+    for i in range(400):
+        if i % 20 == 0:
+            limiter.on_throttled()
+        else:
+            limiter.on_success(0.05)
+    assert limiter.concurrency_limit == 100
+
+
+def test_sustained_429s_halve_concurrency():
+    limiter = RateLimiter(max_concurrency=100)
+    for _ in range(10):
+        limiter.on_throttled()
+    assert limiter.concurrency_limit == 50
+
+
+def run_rows(error_rate):
+    server = start_mock_server(MockConfig(latency_ms=20, latency_sigma=0, error_rate=error_rate, seed=1))
+    try:
+        engine = processing.build_engine(
+            'mock-model', api_key='mock', concurrency=50, requests_per_minute=10_000_000,
+            tokens_per_minute=10_000_000_000, use_cache=False, base_url=server.base_url
+        )
+        started = time.perf_counter()
+        results = engine.run([f"Row {i}" for i in range(THROUGHPUT_ROWS)])
+        return time.perf_counter() - started, results
+    finally:
+        server.stop()
+
+
+def test_throughput_under_a_5_percent_429_rate():
+    # A 429 delays only its own request, so a run with 5% throttled replies takes about one
+    # retry-after longer than a clean run, rather than pausing every request each time
+    clean_seconds, _ = run_rows(0.0)
+    throttled_seconds, results = run_rows(0.05)
+    assert not [result for result in results if str(result).startswith('Error')]
+    assert throttled_seconds < clean_seconds + 4.0
@@ -0,0 +1,30 @@
+import pandas as pd
+from openpyxl import Workbook
+from processing import load_data_file
+from streaming import iter_chunks, read_header
+
+
+def write_workbook(path, rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save(path)
+
+
+def test_xlsx_header_matches_the_loader(tmp_path):
+    path = str(tmp_path / "numeric.xlsx")
+    write_workbook(path, [[2023, "Name", None, 7.5, None], ["a", "b", "c", "d", None], ["e", "f", "g", "h", None]])
+    columns = read_header(path)
+    assert columns == [2023, "Name", "Unnamed: 2", 7.5]
+    assert columns == list(pd.read_excel(path).columns)
+    assert list(load_data_file(path, [2023, "Name"])[2023]) == ["a", "e"]
+    assert list(next(iter_chunks(path)).columns) == columns
+
+
+def test_xlsx_output_keeps_numeric_headers(tmp_path):
+    from streaming import ChunkWriter
+    path = str(tmp_path / "out.xlsx")
+    writer = ChunkWriter(path)
+    writer.write(pd.DataFrame({2023: ["a"], "Name": ["b"]}))
+    writer.close()
+    assert read_header(path) == [2023, "Name"]
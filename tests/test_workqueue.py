@@ -0,0 +1,79 @@
+import time
+import workqueue
+from prompts import SplitPrompt
+from workqueue import WorkQueue, decode_prompts, encode_prompts, unique_prompts
+
+PROMPTS = [f"Ticket {number}" for number in range(5)]
+
+
+def make_queue(tmp_path, shard_rows=2):
+    queue = WorkQueue(str(tmp_path / "input.queue.sqlite"))
+    queue.fill({'model': 'mock-model'}, PROMPTS, shard_rows=shard_rows)
+    return queue
+
+
+def test_prompts_round_trip_with_shared_prefixes_stored_once():
+    prompts = [SplitPrompt("Classify.", "a"), "plain", SplitPrompt("Classify.", "b")]
+    payload = encode_prompts(prompts)
+    assert payload['prefixes'] == ["Classify."]
+    assert decode_prompts(payload) == prompts
+
+
+def test_unique_prompts_maps_every_row_to_its_prompt():
+    prompts, _, rows, prompt_map = unique_prompts(["a", "b", "a", "c"], row_ids=[10, 11, 12, 13])
+    assert prompts == ["a", "b", "c"]
+    assert rows == [10, 11, 13]
+    assert prompt_map == [0, 1, 0, 2]
+
+
+def test_each_shard_is_leased_to_one_worker(tmp_path):
+    queue = make_queue(tmp_path)
+    try:
+        leased = [queue.lease("worker-a"), queue.lease("worker-b"), queue.lease("worker-a")]
+        assert [shard_id for shard_id, _ in leased] == [1, 2, 3]
+        assert queue.lease("worker-b") is None
+        assert queue.progress()['leased'] == 3
+        for shard_id, payload in leased:
+            queue.complete(shard_id, "worker-a", [f"reply {prompt}" for prompt in decode_prompts(payload)])
+        assert queue.results() == [f"reply {prompt}" for prompt in PROMPTS]
+        assert queue.shards_by_worker() == {"worker-a": 3}
+    finally:
+        queue.close()
+
+
+def test_an_expired_lease_is_reassigned(tmp_path):
+    queue = make_queue(tmp_path, shard_rows=5)
+    try:
+        shard_id, _ = queue.lease("worker-a", lease_seconds=0.05)
+        assert queue.renew(shard_id, "worker-a", lease_seconds=0.05)
+        time.sleep(0.1)
+        assert queue.active_leases() == 0
+        assert queue.lease("worker-b")[0] == shard_id
+        # The first worker learns it lost the shard; its late result is still taken while the shard is open
+        assert not queue.renew(shard_id, "worker-a")
+        assert queue.complete(shard_id, "worker-a", ["late"] * 5)
+        assert not queue.complete(shard_id, "worker-b", ["again"] * 5)
+        assert queue.results() == ["late"] * 5
+    finally:
+        queue.close()
+
+
+def test_released_shards_go_back_to_the_queue(tmp_path):
+    queue = make_queue(tmp_path, shard_rows=5)
+    try:
+        shard_id, _ = queue.lease("worker-a")
+        queue.release(shard_id, "worker-a")
+        assert queue.lease("worker-b")[0] == shard_id
+        assert not queue.finished()
+    finally:
+        queue.close()
+
+
+def test_local_workers_share_the_default_cache(monkeypatch):
+    commands = []
+    monkeypatch.setattr(workqueue.subprocess, 'Popen', commands.append)
+    workqueue.spawn_workers("input.queue.sqlite", 3, ['--rpm', '100'])
+    assert len(commands) == 3
+    # Only the worker id differs, so a shard rerun by another worker is answered from the same cache
+    assert len({tuple(command[:4] + command[5:]) for command in commands}) == 1
+    assert not [arg for command in commands for arg in command if 'cache' in arg]
@@ -0,0 +1,407 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import subprocess
+import threading
+from prompts import SplitPrompt
+
+QUEUE_SUFFIX = '.queue.sqlite'
+SHARD_ROWS = 1000
+LEASE_SECONDS = 300.0
+QUEUE_POLL_SECONDS = 5.0
+SHUTDOWN_SECONDS = 10.0
+
+# A shard is pending until a worker leases it, and done once its replies are stored. A leased shard whose lease
+# ran out (the worker died or lost its network) is handed to the next worker that asks.
+SHARD_PENDING = 'pending'
+SHARD_LEASED = 'leased'
+SHARD_DONE = 'done'
+
+
+def get_queue_path(file_path):
+    return f"{file_path}{QUEUE_SUFFIX}"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def encode_prompts(prompts):
+    # Shared prefixes are stored once per shard instead of once per prompt
+    prefixes = {}
+    encoded = []
+    for prompt in prompts:
+        if isinstance(prompt, SplitPrompt):
+            encoded.append([prefixes.setdefault(prompt.prefix, len(prefixes)), prompt.suffix])
+        else:
+            encoded.append(prompt)
+    return {'prefixes': list(prefixes), 'prompts': encoded}
+
+
+def decode_prompts(payload):
+    prefixes = payload['prefixes']
+    return [
+        SplitPrompt(prefixes[prompt[0]], prompt[1]) if isinstance(prompt, list) else prompt
+        for prompt in payload['prompts']
+    ]
+
+
+def unique_prompts(prompts, batch_items=None, row_ids=None):
+    # Duplicate prompts are queued once, so no two workers pay for the same prompt
+    index = {}
+    unique = []
+    prompt_map = []
+    for position, prompt in enumerate(prompts):
+        if prompt not in index:
+            index[prompt] = len(unique)
+            unique.append(position)
+        prompt_map.append(index[prompt])
+    items = [batch_items[position] for position in unique] if batch_items is not None else None
+    rows = [int(row_ids[position]) for position in unique] if row_ids is not None else None
+    return [prompts[position] for position in unique], items, rows, prompt_map
+
+
+class WorkQueue:
+    # SQLite file shared by the coordinator and every worker. It uses the rollback journal rather than WAL,
+    # since WAL needs shared memory and does not work when the workers reach the file over a network share.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS shards ("
+            "id INTEGER PRIMARY KEY, payload TEXT NOT NULL, rows INTEGER NOT NULL, status TEXT NOT NULL, "
+            "worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, results TEXT, "
+            "errors INTEGER NOT NULL DEFAULT 0, tokens INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def get_meta(self):
+        with self.lock:
+            return {key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM meta")}
+
+    def fill(self, meta, prompts, batch_items=None, row_ids=None, shard_rows=SHARD_ROWS):
+        # Replaces the queue's contents with the prompts split into shards of shard_rows
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM meta")
+                self.conn.execute("DELETE FROM shards")
+                self.conn.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(value, ensure_ascii=False)) for key, value in meta.items()]
+                )
+                for start in range(0, len(prompts), shard_rows):
+                    end = start + shard_rows
+                    payload = encode_prompts(prompts[start:end])
+                    payload['batch_items'] = batch_items[start:end] if batch_items is not None else None
+                    payload['row_ids'] = row_ids[start:end] if row_ids is not None else None
+                    self.conn.execute(
+                        "INSERT INTO shards (payload, rows, status) VALUES (?, ?, ?)",
+                        (json.dumps(payload, ensure_ascii=False), len(prompts[start:end]), SHARD_PENDING)
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def lease(self, worker, lease_seconds=LEASE_SECONDS):
+        # Returns (shard_id, payload) of the next pending or abandoned shard, or None when none is left
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT id, payload, status, worker FROM shards "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY id LIMIT 1",
+                    (SHARD_PENDING, SHARD_LEASED, now)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE shards SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                        "WHERE id = ?",
+                        (SHARD_LEASED, worker, now + lease_seconds, row[0])
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        if row[2] == SHARD_LEASED:
+            logging.warning(f"Reassigning shard {row[0]} from {row[3]}, whose lease ran out")
+        return row[0], json.loads(row[1])
+
+    def renew(self, shard_id, worker, lease_seconds=LEASE_SECONDS):
+        # False once the shard was reassigned to another worker
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE shards SET lease_expires = ? WHERE id = ? AND status = ? AND worker = ?",
+                (time.time() + lease_seconds, shard_id, SHARD_LEASED, worker)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, shard_id, worker):
+        # Hands an unfinished shard back at once instead of waiting for its lease to run out
+        with self.lock:
+            self.conn.execute(
+                "UPDATE shards SET status = ?, worker = NULL, lease_expires = NULL WHERE id = ? AND status = ? AND worker = ?",
+                (SHARD_PENDING, shard_id, SHARD_LEASED, worker)
+            )
+
+    def complete(self, shard_id, worker, results, tokens=0):
+        # A late result from a worker whose lease was taken over is still accepted if the shard is not done yet
+        errors = sum(1 for result in results if result is None or str(result).startswith('Error'))
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE shards SET status = ?, worker = ?, results = ?, errors = ?, tokens = ?, lease_expires = NULL "
+                "WHERE id = ? AND status != ?",
+                (SHARD_DONE, worker, json.dumps(results, ensure_ascii=False), errors, tokens, shard_id, SHARD_DONE)
+            )
+        return cursor.rowcount == 1
+
+    def progress(self):
+        # {'shards', 'done', 'leased', 'rows', 'rows_done', 'errors', 'tokens'}
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*), SUM(rows), SUM(errors), SUM(tokens) FROM shards GROUP BY status"
+            ).fetchall()
+        progress = {'shards': 0, 'done': 0, 'leased': 0, 'rows': 0, 'rows_done': 0, 'errors': 0, 'tokens': 0}
+        for status, shards, count, errors, tokens in rows:
+            progress['shards'] += shards
+            progress['rows'] += count
+            progress['errors'] += errors
+            progress['tokens'] += tokens
+            if status == SHARD_DONE:
+                progress['done'] += shards
+                progress['rows_done'] += count
+            elif status == SHARD_LEASED:
+                progress['leased'] += shards
+        return progress
+
+    def finished(self):
+        progress = self.progress()
+        return progress['done'] == progress['shards']
+
+    def active_leases(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM shards WHERE status = ? AND lease_expires >= ?", (SHARD_LEASED, time.time())
+            ).fetchone()[0]
+
+    def shards_by_worker(self):
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT worker, COUNT(*) FROM shards WHERE status = ? GROUP BY worker ORDER BY worker", (SHARD_DONE,)
+            ).fetchall())
+
+    def results(self):
+        # Replies of every shard in queue order; raises ValueError while shards are still open
+        if not self.finished():
+            raise ValueError(f"The work queue {self.path} still has unfinished shards")
+        results = []
+        with self.lock:
+            for (shard_results,) in self.conn.execute("SELECT results FROM shards ORDER BY id"):
+                results.extend(json.loads(shard_results))
+        return results
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class LeaseKeeper:
+    # Renews a shard's lease in the background while its requests are in flight
+    def __init__(self, queue, shard_id, worker, lease_seconds):
+        self.queue = queue
+        self.shard_id = shard_id
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.keep, name=f'lease-{shard_id}', daemon=True)
+
+    def keep(self):
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            try:
+                if not self.queue.renew(self.shard_id, self.worker, self.lease_seconds):
+                    self.lost = True
+                    logging.warning(f"Lost the lease on shard {self.shard_id}; another worker took it over")
+                    return
+            except sqlite3.Error as e:
+                logging.warning(f"Could not renew the lease on shard {self.shard_id}: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def run_worker(queue, engine, worker=None, lease_seconds=LEASE_SECONDS, poll_seconds=QUEUE_POLL_SECONDS,
+               status_callback=None):
+    # Leases and answers shards until the queue is done or the engine is cancelled; returns the shards completed
+    worker = worker or default_worker_id()
+    batch_instructions = queue.get_meta().get('batch_instructions')
+    completed = 0
+    while not engine.cancelled:
+        shard = queue.lease(worker, lease_seconds)
+        if shard is None:
+            if queue.finished():
+                break
+            # Other workers hold the remaining shards; wait in case one of their leases runs out
+            engine.cancel_event.wait(poll_seconds)
+            continue
+        shard_id, payload = shard
+        prompts = decode_prompts(payload)
+        tokens_before = engine.api_client.total_tokens
+        try:
+            with LeaseKeeper(queue, shard_id, worker, lease_seconds):
+                replies = engine.run(
+                    prompts,
+                    batch_items=payload['batch_items'],
+                    batch_instructions=batch_instructions,
+                    row_ids=payload['row_ids']
+                )
+        except BaseException:
+            queue.release(shard_id, worker)
+            raise
+        if engine.cancelled:
+            queue.release(shard_id, worker)
+            break
+        queue.complete(shard_id, worker, replies, engine.api_client.total_tokens - tokens_before)
+        completed += 1
+        if status_callback:
+            progress = queue.progress()
+            status_callback(
+                f"Shard {shard_id} done ({len(prompts)} prompts); "
+                f"{progress['done']} of {progress['shards']} shards finished"
+            )
+    return completed
+
+
+def spawn_workers(queue_path, count, worker_args=()):
+    # Local worker processes for one host; remote hosts start `python workqueue.py <queue>` themselves
+    script = os.path.abspath(__file__)
+    return [
+        subprocess.Popen([sys.executable, script, queue_path, '--worker-id', f"{default_worker_id()}-{number}", *worker_args])
+        for number in range(1, count + 1)
+    ]
+
+
+def wait_for_queue(queue, workers=(), progress_callback=None, poll_seconds=QUEUE_POLL_SECONDS):
+    # Blocks until every shard is done. Raises RuntimeError if all local workers exited and no lease is active,
+    # so a run without remote workers does not wait forever.
+    while True:
+        progress = queue.progress()
+        if progress_callback:
+            progress_callback(progress['rows_done'], progress['rows'])
+        if progress['done'] == progress['shards']:
+            return progress
+        if workers and all(process.poll() is not None for process in workers) and not queue.active_leases():
+            raise RuntimeError(
+                f"All local workers exited with {progress['shards'] - progress['done']} shards left; "
+                "rerun the same command to continue"
+            )
+        time.sleep(poll_seconds)
+
+
+def stop_workers(workers, timeout=SHUTDOWN_SECONDS):
+    for process in workers:
+        if process.poll() is None:
+            process.terminate()
+    for process in workers:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Work on a shared queue created by cli.py --shard. Start one per host, each with its own "
+                    "OPENAI_API_KEY; the model and prompts come from the queue."
+    )
+    parser.add_argument('queue', help="Path of the <input>.queue.sqlite file")
+    parser.add_argument('--worker-id', default=None, help="Name shown in the coordinator's report (default: host-pid)")
+    parser.add_argument('--concurrency', type=int, default=None, help="Requests in flight at once (default: 200)")
+    parser.add_argument('--rpm', type=int, default=None, help="Requests-per-minute budget of this worker's key")
+    parser.add_argument('--tpm', type=int, default=None, help="Tokens-per-minute budget of this worker's key")
+    parser.add_argument('--base-url', default=None, help="OpenAI-compatible endpoint, e.g. a local mock_server.py")
+    parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS,
+                        help="A shard not renewed within this time is given to another worker")
+    parser.add_argument('--no-cache', action='store_true', help="Do not use the response cache at all")
+    parser.add_argument('--metrics-json', default=None, help="Write this worker's run summary to this path")
+    parser.add_argument('--quiet', action='store_true', help="Do not print progress")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from dotenv import load_dotenv
+    from logconfig import setup_json_logging
+    from processing import build_engine, export_telemetry
+    from engine import MAX_CONCURRENT_REQUESTS, CASCADE_MIN_CONFIDENCE
+    from session import ClientSession, session_options_from_env
+    from ratelimit import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+
+    setup_json_logging()
+    load_dotenv(dotenv_path='./config/.env')
+    if not os.path.exists(args.queue):
+        print(f"Queue not found: {args.queue}", file=sys.stderr)
+        return 1
+    queue = WorkQueue(args.queue)
+    meta = queue.get_meta()
+    base_url = args.base_url or os.getenv('OPENAI_BASE_URL')
+    session = ClientSession(api_key=os.getenv('OPENAI_API_KEY'), base_url=base_url, **session_options_from_env())
+    engine = build_engine(
+        meta['model'],
+        api_key=os.getenv('OPENAI_API_KEY'),
+        concurrency=args.concurrency or MAX_CONCURRENT_REQUESTS,
+        batch_size=meta.get('batch_size', 1),
+        requests_per_minute=args.rpm or DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute=args.tpm or DEFAULT_TOKENS_PER_MINUTE,
+        use_cache=not args.no_cache,
+        base_url=base_url,
+        fallback_model=meta.get('fallback_model'),
+        min_confidence=meta.get('min_confidence', CASCADE_MIN_CONFIDENCE),
+        labels=tuple(meta.get('labels', ())),
+        session=session
+    )
+    worker = args.worker_id or default_worker_id()
+    try:
+        completed = run_worker(
+            queue, engine, worker, args.lease_seconds,
+            status_callback=None if args.quiet else lambda text: print(f"[{worker}] {text}", file=sys.stderr, flush=True)
+        )
+    except KeyboardInterrupt:
+        # The shard in hand is picked up by another worker once its lease runs out
+        print(f"\n[{worker}] Stopped", file=sys.stderr)
+        return 130
+    finally:
+        session.close()
+        queue.close()
+        if engine.api_client.cache is not None:
+            engine.api_client.cache.close()
+        export_telemetry(engine, args.metrics_json)
+
+    print(f"[{worker}] Completed {completed} shards\n{engine.report_text()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())